@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# Downloads HTML pages with asyncio instead of threads
+
+import aiohttp
+import asyncio
+from crawler.downloader import CHUNK_SIZE, DEFAULT_TIMEOUT, USER_AGENT, \
+    AtomicFile, DownloadStats, commit_or_alias, conditional_headers
+from crawler.journal import DONE, FAILED
+from crawler.scheduler import CONNECTION, TIMEOUT, CrawlReport, \
+    RetryPolicy, classify, classify_status
+from collections import Counter
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def classify_aiohttp(exc):
+    """
+    scheduler.classify for aiohttp exceptions.
+    :param exc: an exception raised by download
+    :return: failure class, or None if retrying will not help
+    """
+    if isinstance(exc, asyncio.TimeoutError):
+        return TIMEOUT
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return classify_status(exc.status)
+    if isinstance(exc, aiohttp.ClientConnectionError):
+        return CONNECTION
+    return classify(exc)
+
+
+class HostRateLimiter(object):
+    """
+    Spaces out requests to the same host to at most <rate> per second.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: requests per second per host, or None for no limit
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}
+
+    async def wait(self, url):
+        """
+        Sleeps until a request to the host of <url> is allowed.
+        :param url: str
+        :return: None
+        """
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        slot = max(now, self._next.get(host, now))
+        # Reserve the slot before sleeping, so concurrent waiters queue up
+        self._next[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def download(session, limiter, url, file_path, overwrite=False,
+                   stats=None, journal=None, revalidate=False, store=None):
+    """
+    Downloads the content of <url> to <file_path>, or under <url> in
+    <store>. File writes run in the
+    default executor so they do not block the event loop. Responses with an
+    error status are not saved and raise aiohttp.ClientResponseError. Pages
+    with the content of an earlier download are linked to it, as in
+    downloader.download.
+    :param session: an aiohttp.ClientSession
+    :param limiter: a HostRateLimiter
+    :param url: url to download
+    :param file_path: file to save to
+    :param overwrite: whether to overwrite existing files; ignored with a
+                      journal
+    :param stats: a DownloadStats to record the request in
+    :param journal: a DownloadJournal to record the outcome in
+    :param revalidate: with a journal, send the validators of the last
+                       download and leave the saved page untouched if the
+                       server answers 304 or the body has the same hash
+    :param store: a PageStore to save to instead of <file_path>
+    :return: None
+    """
+    loop = asyncio.get_running_loop()
+    if journal is None and not overwrite:
+        if store is not None:
+            exists = await loop.run_in_executor(None, store.__contains__, url)
+        else:
+            exists = await loop.run_in_executor(None, os.path.isfile,
+                                                file_path)
+        if exists:
+            log.error("File exists: {}. Abort.".format(file_path))
+            return
+    previous = None
+    if journal is not None and revalidate:
+        previous = await loop.run_in_executor(
+            None, lambda: journal.validators(url, file_path, store=store))
+    alias_of = None
+    await limiter.wait(url)
+    start = time.perf_counter()
+    try:
+        async with session.get(
+                url, headers=conditional_headers(previous)) as resp:
+            resp.raise_for_status()
+            not_modified = previous is not None and resp.status == 304
+            if not not_modified:
+                if store is not None:
+                    file = store.writer(url)
+                else:
+                    file = await loop.run_in_executor(None, AtomicFile,
+                                                      file_path)
+                try:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        await loop.run_in_executor(None, file.write, chunk)
+                except BaseException:
+                    await loop.run_in_executor(None, file.abort)
+                    raise
+                unchanged = previous is not None and \
+                    file.sha1 == previous['sha1']
+                # Keep an unchanged file and its mtime, so the cleaner and
+                # the parser skip it
+                if unchanged:
+                    await loop.run_in_executor(None, file.abort)
+                elif store is None and journal is not None:
+                    alias_of = await loop.run_in_executor(
+                        None, commit_or_alias, file, journal)
+                else:
+                    await loop.run_in_executor(None, file.commit)
+    except Exception as e:
+        if journal is not None:
+            await loop.run_in_executor(
+                None, lambda: journal.record(
+                    url, file_path, FAILED,
+                    http_status=getattr(e, 'status', None), error=repr(e)))
+        raise
+    if not_modified:
+        n_bytes, sha1 = previous['bytes'], previous['sha1']
+    else:
+        n_bytes, sha1 = file.n_bytes, file.sha1
+    if stats is not None:
+        stats.record(time.perf_counter() - start,
+                     0 if not_modified else n_bytes,
+                     not_modified=not_modified,
+                     unchanged=not_modified or unchanged)
+    if journal is not None:
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if not_modified:
+            etag = etag or previous['etag']
+            last_modified = last_modified or previous['last_modified']
+        if not_modified or unchanged:
+            # The saved file is kept, and so is what it links to
+            alias_of = previous['alias_of']
+        await loop.run_in_executor(
+            None, lambda: journal.record(
+                url, file_path, DONE, http_status=resp.status,
+                n_bytes=n_bytes, sha1=sha1, etag=etag,
+                last_modified=last_modified, alias_of=alias_of))
+    if not_modified or unchanged:
+        log.info("Unchanged: {}.".format(url))
+    elif alias_of is not None:
+        log.info("Same content as {}: {}.".format(alias_of, url))
+    else:
+        log.info("Successfully saved {}.".format(url))
+
+
+async def download_many(tasks, concurrency=100, per_host_rate=None,
+                        timeout=DEFAULT_TIMEOUT, stats=None, journal=None,
+                        policy=None, report=None, revalidate=False,
+                        store=None):
+    """
+    Downloads (url, file_path) pairs with at most <concurrency> requests in
+    flight. A fixed number of worker coroutines pull from <tasks>, so memory
+    stays flat however long it is.
+    :param tasks: iterable of (url, file_path)
+    :param concurrency: maximum number of requests in flight
+    :param per_host_rate: requests per second per host, or None
+    :param timeout: (connect, read) timeouts in seconds
+    :param stats: a DownloadStats
+    :param journal: a DownloadJournal
+    :param policy: a RetryPolicy for failed downloads
+    :param report: a CrawlReport
+    :param revalidate: re-request saved pages conditionally
+    :param store: a PageStore to save pages to instead of files
+    :return: None
+    """
+    if policy is None:
+        policy = RetryPolicy()
+    if report is None:
+        report = CrawlReport()
+    connect, read = timeout
+    client_timeout = aiohttp.ClientTimeout(sock_connect=connect,
+                                           sock_read=read)
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    limiter = HostRateLimiter(per_host_rate)
+    tasks = iter(tasks)
+
+    async def worker(session):
+        for url, file_path in tasks:
+            attempts = Counter()
+            while True:
+                try:
+                    await download(session, limiter, url, file_path,
+                                   stats=stats, journal=journal,
+                                   revalidate=revalidate, store=store)
+                except Exception as e:
+                    failure = classify_aiohttp(e)
+                    if not policy.should_retry(failure, attempts):
+                        report.add_dead_letter(url, file_path, failure, e,
+                                               attempts)
+                        break
+                    delay = policy.delay(sum(attempts.values()), e)
+                    attempts[failure] += 1
+                    report.add_retry(failure)
+                    log.warning('Retrying {} in {:.1f}s ({}): {!r}'.format(
+                        url, delay, failure, e))
+                    await asyncio.sleep(delay)
+                else:
+                    report.add_done()
+                    break
+
+    async with aiohttp.ClientSession(
+            connector=connector, timeout=client_timeout,
+            headers={'User-Agent': USER_AGENT}) as session:
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+
+
+def download_all(tasks, concurrency=100, per_host_rate=None,
+                 timeout=DEFAULT_TIMEOUT, journal=None, policy=None,
+                 revalidate=False, store=None):
+    """
+    Runs download_many in a new event loop.
+    :param tasks: iterable of (url, file_path)
+    :param concurrency: maximum number of requests in flight
+    :param per_host_rate: requests per second per host, or None
+    :param timeout: (connect, read) timeouts in seconds
+    :param journal: a DownloadJournal
+    :param policy: a RetryPolicy for failed downloads
+    :param revalidate: re-request saved pages conditionally
+    :param store: a PageStore to save pages to instead of files
+    :return: (DownloadStats, CrawlReport)
+    """
+    stats = DownloadStats()
+    report = CrawlReport()
+    asyncio.run(download_many(tasks, concurrency=concurrency,
+                              per_host_rate=per_host_rate, timeout=timeout,
+                              stats=stats, journal=journal, policy=policy,
+                              report=report, revalidate=revalidate,
+                              store=store))
+    log.info('Download stats: {}'.format(stats.summary()))
+    report.log()
+    if journal is not None:
+        log.info('Journal: {}'.format(journal.counts()))
+    return stats, report
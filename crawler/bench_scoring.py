@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Benchmarks search result scoring against the original implementation
+
+import argparse
+from crawler.scoring import COMPANY_SCORER, PERSON_SCORER
+from crawler.search_cache import CACHE_PATH
+import json
+import logging
+import random
+import re
+import sqlite3
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def legacy_person(name, items):
+    """
+    The original googler.find_linkedin_url, logging removed, returning
+    None instead of failing when no result is kept.
+    """
+    site = 'linkedin.com'
+    candidates = []
+    for item in items:
+        if not item['kind'] == 'customsearch#result':
+            continue
+        url = item['link']
+        title = item['title'].lower()
+        if not re.search(site, url):
+            continue
+        if re.search('/in/', url) or \
+                (re.search('/pub/', url) and not re.search('/pub/dir/', url)):
+            candidates.append((10, item))
+            continue
+        if re.search('/pub/dir/', url) or re.search('/title/', url):
+            continue
+        if re.search('top', title) or re.search('profiles', title):
+            continue
+        candidates.append((5, item))
+    names = name.split(' ')
+    for part in names:
+        for i, pair in enumerate(candidates):
+            conf, item = pair
+            if re.search(part, item['title']):
+                conf += 20
+                candidates[i] = (conf, item)
+    if len(candidates) == 0:
+        return None
+    conf, item = max(candidates, key=lambda x: x[0])
+    return conf, item['title'], item['link']
+
+
+def legacy_company(name, items):
+    """
+    The original googler_company_id.find_linkedin_url, logging removed.
+    """
+    site = 'linkedin.com'
+    candidates = []
+    for item in items:
+        if not item['kind'] == 'customsearch#result':
+            continue
+        url = item['link']
+        if not re.search(site, url):
+            continue
+        if re.search('/company/', url):
+            candidates.append((40, item))
+            continue
+        if re.search('/jobs/', url) or re.search('/title/', url):
+            continue
+        candidates.append((5, item))
+    for i, pair in enumerate(candidates):
+        conf, item = pair
+        if re.search(name, item['title'], re.IGNORECASE):
+            conf += 10
+            candidates[i] = (conf, item)
+    if len(candidates) == 0:
+        return None
+    conf, item = max(candidates, key=lambda x: x[0])
+    return conf, item['title'], item['link']
+
+
+def load_cached(path):
+    """
+    Reads the result pages recorded in a search cache.
+    :param path: SQLite file of a SearchCache
+    :return: list of (query, items)
+    """
+    conn = sqlite3.connect(path)
+    corpus = []
+    for query, response in conn.execute(
+            'SELECT query, response FROM responses'):
+        items = json.loads(response).get('items')
+        if items:
+            corpus.append((query, items))
+    conn.close()
+    return corpus
+
+
+def make_synthetic(n_pages, seed=0):
+    """
+    Makes result pages resembling Custom Search responses.
+    :param n_pages: int
+    :param seed: random seed
+    :return: list of (query, items)
+    """
+    rng = random.Random(seed)
+    first = ['Anna', 'Ben', 'Chen', 'Dara', 'Eli', 'Fatima', 'Goran']
+    last = ['Smith', 'Lee', 'Garcia', 'Novak', 'Okafor', 'Ivanova']
+    paths = ['/in/{}', '/pub/{}/1/2', '/pub/dir/{}', '/title/{}',
+             '/company/{}', '/jobs/{}', '/{}']
+    hosts = ['https://www.linkedin.com', 'https://uk.linkedin.com',
+             'https://example.com']
+    corpus = []
+    for _ in range(n_pages):
+        name = '{} {}'.format(rng.choice(first), rng.choice(last))
+        items = []
+        for _ in range(10):
+            other = '{} {}'.format(rng.choice(first), rng.choice(last))
+            who = name if rng.random() < 0.3 else other
+            items.append({
+                'kind': 'customsearch#result',
+                'link': rng.choice(hosts) + rng.choice(paths).format(
+                    who.lower().replace(' ', '-')),
+                'title': rng.choice(['{} | LinkedIn', 'Top {} profiles',
+                                     '{} - Engineer - Acme']).format(who)})
+        corpus.append((name, items))
+    return corpus
+
+
+def bench(label, func, corpus, repeat):
+    """
+    :return: (list of results, seconds per page)
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [func(name, items) for name, items in corpus]
+    seconds = time.perf_counter() - start
+    per_page = seconds / (repeat * len(corpus))
+    log.info('{}: {:.1f} us per page'.format(label, per_page * 1e6))
+    return results, per_page
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks search result scoring.')
+    arg_parser.add_argument('--cache', default=None,
+                            help='search cache to take result pages from, '
+                                 'default {}'.format(CACHE_PATH))
+    arg_parser.add_argument('--synthetic', type=int, default=0,
+                            help='number of generated result pages to use '
+                                 'instead')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    if args.synthetic:
+        corpus = make_synthetic(args.synthetic)
+    else:
+        corpus = load_cached(args.cache or CACHE_PATH)
+    if not corpus:
+        raise SystemExit('No result pages to score.')
+    log.info('{} result pages.'.format(len(corpus)))
+
+    n_diff = 0
+    for label, legacy, scorer in [('person', legacy_person, PERSON_SCORER),
+                                  ('company', legacy_company,
+                                   COMPANY_SCORER)]:
+        expected, before = bench('{} legacy'.format(label), legacy, corpus,
+                                 args.repeat)
+        actual, after = bench('{} scorer'.format(label), scorer.best, corpus,
+                              args.repeat)
+        log.info('{}: {:.1f}x faster'.format(label, before / after))
+        for (name, _), x, y in zip(corpus, expected, actual):
+            if x != y:
+                n_diff += 1
+                log.error('{} {!r}: {!r} != {!r}'.format(label, name, x, y))
+    if n_diff:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
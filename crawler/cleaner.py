@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 # Cleans stuff from saved HTML pages
 
+import argparse
 from bs4 import BeautifulSoup
-from glob import glob
+from crawler.pagestore import PageStore, open_store
+import hashlib
+import json
 import logging
+from lxml import etree
+import lxml.html
+import multiprocessing
 import os
 
 # Set up logging
@@ -11,17 +17,29 @@ import os
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+# Tags removed from the page together with their contents
+JUNK_TAGS = ['code', 'script']
+
+_PROFILE = etree.XPath("(//*[@id='profile'])[1]")
+_JUNK = etree.XPath('|'.join('.//{}'.format(tag) for tag in JUNK_TAGS))
+_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+# Records every cleaned file, one JSON object per line
+MANIFEST_NAME = '.manifest.jsonl'
+
 
 def clean_up(content):
     """
     Trims the HTML for only useful information
     :param content: input HTML string
-    :return: a string
+    :return: a string, or None if the page has no profile
     """
     soup = BeautifulSoup(content, 'lxml')
     sub_soup = soup.find(id='profile')
+    if sub_soup is None:
+        return None
     # Remove code and scripts
-    for tag in ['code', 'script']:
+    for tag in JUNK_TAGS:
         for s in sub_soup.find_all(tag):
             s.decompose()
 
@@ -30,25 +48,312 @@ def clean_up(content):
     return result
 
 
-def main():
+def isolate_profile(content):
     """
-    Driver method.
+    Finds the profile in a saved page and removes code and scripts from it.
+    :param content: input HTML, UTF-8 bytes
+    :return: an lxml element, or None if the page has no profile
+    """
+    root = lxml.html.document_fromstring(content, parser=_HTML_PARSER)
+    profile = _PROFILE(root)
+    if not profile:
+        return None
+    profile = profile[0]
+    # Remove code and scripts, keeping the text that follows them
+    for element in _JUNK(profile):
+        element.drop_tree()
+    return profile
+
+
+def clean_up_lxml(content):
+    """
+    Trims the HTML for only useful information. Faster than clean_up, and
+    keeps the original whitespace instead of pretty-printing.
+    :param content: input HTML, UTF-8 bytes
+    :return: UTF-8 bytes, or None if the page has no profile
+    """
+    profile = isolate_profile(content)
+    if profile is None:
+        return None
+    return lxml.html.tostring(profile, encoding='utf-8', with_tail=False)
+
+
+def clean_content(content, engine='bs4'):
+    """
+    Cleans up a saved page with the given engine.
+    :param content: input HTML, UTF-8 bytes
+    :param engine: 'bs4' or 'lxml'
+    :return: UTF-8 bytes, or None if the page has no profile
+    """
+    if engine == 'lxml':
+        return clean_up_lxml(content)
+    result = clean_up(content.decode('utf-8'))
+    if result is None:
+        return None
+    return result.encode('utf-8')
+
+
+def write_atomic(file_path, data):
+    """
+    Writes a file so that it is either complete or absent after a crash.
+    :param file_path: str
+    :param data: bytes
+    :return: None
+    """
+    tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def clean_file(in_path, out_path, engine='bs4'):
+    """
+    Cleans up a saved page.
+    :param in_path: the saved page
+    :param out_path: where to write the cleaned page
+    :param engine: 'bs4' or 'lxml'
+    :return: (bytes read, bytes written), bytes written is None if the page
+             has no profile, in which case nothing is written
+    """
+    with open(in_path, 'rb') as file:
+        content = file.read()
+    result = clean_content(content, engine)
+    if result is None:
+        log.warning("No profile in {}.".format(in_path))
+        return len(content), None
+    write_atomic(out_path, result)
+    return len(content), len(result)
+
+
+def read_manifest(root_path):
+    """
+    :param root_path: directory of cleaned pages
+    :return: dict from file name to its latest manifest entry
+    """
+    manifest = {}
+    manifest_path = os.path.join(root_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            manifest[entry['file']] = entry
+    return manifest
+
+
+def plan_tasks(in_path, root_path, manifest, engine='bs4'):
+    """
+    Lists the pages that need cleaning. A page is skipped if its output is
+    newer than it, or if the manifest recorded it with the same size and
+    modification time, unless the manifest says another engine cleaned
+    it. Pages whose output exists but is older are hashed by the worker
+    and skipped if the content is unchanged.
+    :param in_path: directory of saved pages
+    :param root_path: directory of cleaned pages
+    :param manifest: as returned by read_manifest
+    :param engine: 'bs4' or 'lxml'
+    :return: (list of tasks for clean_task, number of skipped pages)
+    """
+    outputs = {}
+    for entry in os.scandir(root_path):
+        outputs[entry.name] = entry.stat().st_mtime
+    tasks = []
+    skipped = 0
+    for entry in os.scandir(in_path):
+        if not entry.name.endswith('.html'):
+            continue
+        st = entry.stat()
+        known = manifest.get(entry.name)
+        # Entries written before the engine was recorded are from bs4
+        if known is not None and known.get('engine', 'bs4') != engine:
+            known = None
+            out_mtime = None
+        else:
+            out_mtime = outputs.get(entry.name)
+        if out_mtime is not None and out_mtime >= st.st_mtime:
+            skipped += 1
+            continue
+        if known is not None and \
+                (out_mtime is not None or known['bytes_out'] is None):
+            if known['mtime'] == st.st_mtime and \
+                    known['bytes_in'] == st.st_size:
+                skipped += 1
+                continue
+            known_hash = known['sha1']
+        else:
+            known_hash = None
+        tasks.append((entry.path, os.path.join(root_path, entry.name),
+                      known_hash, engine))
+    return tasks, skipped
+
+
+def clean_task(task):
+    """
+    Cleans up one page unless its content hash is already known.
+    :param task: (input path, output path, known SHA-1 or None, engine)
+    :return: a manifest entry, with 'changed' telling whether it was cleaned
+    """
+    in_path, out_path, known_hash, engine = task
+    with open(in_path, 'rb') as file:
+        content = file.read()
+    digest = hashlib.sha1(content).hexdigest()
+    entry = {'file': os.path.basename(in_path),
+             'sha1': digest,
+             'mtime': os.stat(in_path).st_mtime,
+             'bytes_in': len(content),
+             'engine': engine}
+    if digest == known_hash:
+        # Same content as last time: only refresh the output's timestamp
+        if os.path.exists(out_path):
+            os.utime(out_path)
+        entry['bytes_out'] = None if not os.path.exists(out_path) \
+            else os.path.getsize(out_path)
+        entry['changed'] = False
+        return entry
+    result = clean_content(content, engine)
+    if result is None:
+        log.warning("No profile in {}.".format(in_path))
+        entry['bytes_out'] = None
+    else:
+        write_atomic(out_path, result)
+        entry['bytes_out'] = len(result)
+    entry['changed'] = True
+    return entry
+
+
+def clean_all(in_path, root_path, engine='bs4', workers=1):
+    """
+    Cleans up every new or changed page in <in_path>. Progress is recorded
+    in a manifest as it goes, so an interrupted run resumes where it
+    stopped.
+    :param in_path: directory of saved pages
+    :param root_path: directory of cleaned pages
+    :param engine: 'bs4' or 'lxml'
+    :param workers: number of processes
+    :return: None
     """
-    root_path = '../tmp/clean_profiles/'
     if not os.path.exists(root_path):
         os.makedirs(root_path)
+    manifest = read_manifest(root_path)
+    tasks, skipped = plan_tasks(in_path, root_path, manifest, engine)
+    log.info("{} pages to clean, {} up to date.".format(len(tasks), skipped))
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        entries = pool.imap_unordered(clean_task, tasks, chunksize=16)
+    else:
+        pool = None
+        entries = map(clean_task, tasks)
+
+    cleaned = unchanged = total_in = total_out = 0
+    manifest_path = os.path.join(root_path, MANIFEST_NAME)
+    with open(manifest_path, 'a') as manifest_file:
+        for entry in entries:
+            changed = entry.pop('changed')
+            manifest_file.write(json.dumps(entry) + '\n')
+            manifest_file.flush()
+            if not changed:
+                unchanged += 1
+                continue
+            cleaned += 1
+            total_in += entry['bytes_in']
+            total_out += entry['bytes_out'] or 0
+            log.debug("Cleaned up {} ({} -> {} bytes).".format(
+                entry['file'], entry['bytes_in'], entry['bytes_out']))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    log.info("Cleaned up {} files ({} -> {} bytes), {} unchanged.".format(
+        cleaned, total_in, total_out, unchanged))
+
+
+def clean_page(task):
+    """
+    Cleans up one page of a page store.
+    :param task: (store directory, key, SHA-1 of the page, engine)
+    :return: (key, SHA-1 of the page, cleaned bytes or None)
+    """
+    root, key, digest, engine = task
+    content = open_store(root).get_blob(digest)
+    return key, digest, clean_content(content, engine)
+
+
+def clean_store(in_store, out_store, engine='bs4', workers=1):
+    """
+    Cleans up every new or changed page of a page store into another.
+    Each cleaned page records the hash of the page it was made from, so
+    pages whose content did not change since they were cleaned are
+    skipped. Workers read pages from <in_store> themselves; this process
+    is the only writer of <out_store>.
+    :param in_store: PageStore of saved pages
+    :param out_store: PageStore of cleaned pages
+    :param engine: 'bs4' or 'lxml'
+    :param workers: number of processes
+    :return: None
+    """
+    todo = []
+    skipped = 0
+    for key, info in in_store.infos():
+        out = out_store.info(key)
+        if out is not None and out['source'] == info['sha1']:
+            skipped += 1
+            continue
+        todo.append((key, info['sha1']))
+    log.info("{} pages to clean, {} up to date.".format(len(todo), skipped))
+    tasks = [(in_store.root, key, digest, engine) for key, digest in todo]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(clean_page, tasks, chunksize=16)
+    else:
+        pool = None
+        results = map(clean_page, tasks)
+
+    cleaned = missing = total_out = 0
+    for key, digest, result in results:
+        if result is None:
+            log.warning("No profile in {}.".format(key))
+            missing += 1
+            continue
+        out_store.put(key, result, source=digest)
+        cleaned += 1
+        total_out += len(result)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    log.info("Cleaned up {} pages ({} bytes), {} without profile.".format(
+        cleaned, total_out, missing))
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Cleans up saved LinkedIn pages.')
+    arg_parser.add_argument('--engine', choices=['bs4', 'lxml'],
+                            default='bs4', help='HTML cleaning engine')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of cleaning processes')
+    arg_parser.add_argument('--store', nargs=2, default=None,
+                            metavar=('IN', 'OUT'),
+                            help='clean from one page store into another')
+    args = arg_parser.parse_args()
 
-    files = glob('../tmp/profiles/*.html')
-    for file_path in files:
-        with open(file_path, 'r') as file:
-            content = file.read()
-        content = clean_up(content)
-
-        file_name = os.path.basename(file_path)
-        output_path = os.path.join(root_path, file_name)
-        with open(output_path, 'w') as file:
-            file.write(content)
-        log.info("Cleaned up {}.".format(file_path))
+    if args.store:
+        in_store = PageStore(args.store[0], readonly=True)
+        out_store = PageStore(args.store[1])
+        clean_store(in_store, out_store, engine=args.engine,
+                    workers=args.workers)
+        in_store.close()
+        out_store.close()
+        return
+    clean_all('../tmp/profiles/', '../tmp/clean_profiles/',
+              engine=args.engine, workers=args.workers)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 # Downloads HTML pages from LinkedIn
 
-import ast
+import argparse
+from crawler.interchange import find_input, read_results
+from crawler.journal import DONE, FAILED, DownloadJournal
+from crawler.pagestore import PageStore
+from crawler.scheduler import Scheduler
+import hashlib
+import itertools
 import logging
 import os
-import queue
 import requests
+from requests.adapters import HTTPAdapter
 import threading
+import time
 
 # Set up logging
 
@@ -17,6 +24,10 @@ USER_AGENT = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_2) AppleWebKit/'
               '537.36 (KHTML, like Gecko) Chrome/49.0.2593.0 Safari/537.36'
               )
 
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+CHUNK_SIZE = 64 * 1024
+
 
 def make_filename(title):
     """
@@ -31,85 +42,430 @@ def make_filename(title):
     return with_ext
 
 
-def download(url, file_path, overwrite=False):
+class DownloadStats(object):
+    """
+    Thread-safe counters of downloads and their latencies.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.not_modified = 0
+        self.unchanged = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, n_bytes, not_modified=False, unchanged=False):
+        """
+        :param latency: seconds from sending the request to the last byte
+        :param n_bytes: size of the body
+        :param not_modified: whether the server answered 304
+        :param unchanged: whether the body matched the saved page
+        :return: None
+        """
+        with self._lock:
+            self.requests += 1
+            self.bytes += n_bytes
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.not_modified += not_modified
+            self.unchanged += unchanged
+
+    def summary(self, session=None):
+        """
+        :param session: the session used, to report connection reuse
+        :return: a dict of statistics
+        """
+        with self._lock:
+            result = {'requests': self.requests,
+                      'bytes': self.bytes,
+                      'mean_latency': (self.total_latency / self.requests
+                                       if self.requests else 0.0),
+                      'max_latency': self.max_latency,
+                      'not_modified': self.not_modified,
+                      'unchanged': self.unchanged}
+        if session is not None:
+            result.update(connection_stats(session))
+        return result
+
+
+def make_session(pool_size=10):
+    """
+    Creates a session keeping up to <pool_size> connections per host alive,
+    to be shared by all download threads.
+    :param pool_size: int, normally the number of threads
+    :return: a requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Fake browser visit
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def connection_stats(session):
+    """
+    Counts the connections opened by a session and the requests sent.
+    :param session: a requests.Session
+    :return: dict with 'connections', 'pooled_requests' and 'reused'
+    """
+    connections = 0
+    pooled_requests = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+    return {'connections': connections,
+            'pooled_requests': pooled_requests,
+            'reused': pooled_requests - connections}
+
+
+def conditional_headers(previous):
+    """
+    Request headers revalidating an earlier download.
+    :param previous: journal record of the earlier download, or None
+    :return: dict
+    """
+    headers = {}
+    if previous is None:
+        return headers
+    if previous['etag']:
+        headers['If-None-Match'] = previous['etag']
+    if previous['last_modified']:
+        headers['If-Modified-Since'] = previous['last_modified']
+    return headers
+
+
+class AtomicFile(object):
+    """
+    A file written under a temporary name and renamed into place once
+    complete, so a crash never leaves a partial file behind. It also hashes
+    what is written.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.tmp_path = '{}.part'.format(file_path)
+        self.n_bytes = 0
+        self._sha1 = hashlib.sha1()
+        self._file = open(self.tmp_path, 'wb')
+
+    @property
+    def sha1(self):
+        return self._sha1.hexdigest()
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._sha1.update(chunk)
+        self.n_bytes += len(chunk)
+
+    def commit(self):
+        """
+        Moves the complete file into place.
+        """
+        self._file.close()
+        os.replace(self.tmp_path, self.file_path)
+
+    def abort(self):
+        """
+        Discards the partial file.
+        """
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+def same_content(path, sha1):
+    """
+    :param path: a file
+    :param sha1: hex SHA-1 of a body
+    :return: whether the file exists and holds that body
     """
-    Downloads the content of <url> to <file_path>.
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return False
+    return digest.hexdigest() == sha1
+
+
+def commit_or_alias(file, journal):
+    """
+    Moves a complete download into place, or, if the journal knows a file
+    with the same content from any URL, makes the file a hard link to it
+    instead of a second copy.
+    :param file: a complete AtomicFile
+    :param journal: a DownloadJournal
+    :return: the file linked to, or None if <file> was saved as is
+    """
+    for original in journal.find_content(file.sha1, file.file_path):
+        # The journal may be behind the files, e.g. after another URL was
+        # saved under the same name
+        if not same_content(original, file.sha1):
+            continue
+        link_path = '{}.link'.format(file.file_path)
+        try:
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+            os.link(original, link_path)
+            os.replace(link_path, file.file_path)
+        except OSError as e:
+            log.warning('Cannot link {} to {}: {}'.format(
+                file.file_path, original, e))
+            break
+        file.abort()
+        return original
+    file.commit()
+    return None
+
+
+def download(url, file_path, overwrite=False, session=None,
+             timeout=DEFAULT_TIMEOUT, stats=None, journal=None,
+             revalidate=False, store=None):
+    """
+    Downloads the content of <url> to <file_path>, or under <url> in
+    <store>. Responses with an error status are not saved and raise
+    requests.HTTPError. With a journal, a page with the content of an
+    earlier download of any URL is saved as a hard link to it; a store
+    keeps one copy of each content by itself.
     :param url: url to download
     :param file_path: file to save to
-    :param overwrite: whether to overwrite existing files
+    :param overwrite: whether to overwrite existing files; ignored with a
+                      journal, which decides what to download instead
+    :param session: a requests.Session to reuse connections from
+    :param timeout: (connect, read) timeouts in seconds
+    :param stats: a DownloadStats to record the request in
+    :param journal: a DownloadJournal to record the outcome in
+    :param revalidate: with a journal, send the validators of the last
+                       download and leave the saved page untouched if the
+                       server answers 304 or the body has the same hash
+    :param store: a PageStore to save to instead of <file_path>
     :return: None
     """
-    if not overwrite:
-        if os.path.isfile(file_path):
+    if journal is None and not overwrite:
+        if url in store if store is not None else os.path.isfile(file_path):
             log.error("File exists: {}. Abort.".format(file_path))
             return
+    if session is None:
+        session = requests
+    previous = None
+    if journal is not None and revalidate:
+        previous = journal.validators(url, file_path, store=store)
     # Fake browser visit
     headers = {'User-Agent': USER_AGENT}
-    resp = requests.get(url, headers=headers)
-    with open(file_path, 'wb+') as file:
-        for chunk in resp.iter_content():
-            file.write(chunk)
+    headers.update(conditional_headers(previous))
+    alias_of = None
+    start = time.perf_counter()
+    try:
+        with session.get(url, headers=headers, timeout=timeout,
+                         stream=True) as resp:
+            resp.raise_for_status()
+            not_modified = previous is not None and resp.status_code == 304
+            if not not_modified:
+                if store is not None:
+                    file = store.writer(url)
+                else:
+                    file = AtomicFile(file_path)
+                try:
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+                except BaseException:
+                    file.abort()
+                    raise
+                unchanged = previous is not None and \
+                    file.sha1 == previous['sha1']
+                if unchanged:
+                    # Keep the old file and its mtime, so the cleaner and
+                    # the parser skip it
+                    file.abort()
+                elif store is None and journal is not None:
+                    alias_of = commit_or_alias(file, journal)
+                else:
+                    file.commit()
+    except Exception as e:
+        if journal is not None:
+            response = getattr(e, 'response', None)
+            journal.record(url, file_path, FAILED,
+                           http_status=getattr(response, 'status_code', None),
+                           error=repr(e))
+        raise
+    if not_modified:
+        n_bytes, sha1 = previous['bytes'], previous['sha1']
+    else:
+        n_bytes, sha1 = file.n_bytes, file.sha1
+    if stats is not None:
+        stats.record(time.perf_counter() - start,
+                     0 if not_modified else n_bytes,
+                     not_modified=not_modified,
+                     unchanged=not_modified or unchanged)
+    if journal is not None:
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if not_modified:
+            etag = etag or previous['etag']
+            last_modified = last_modified or previous['last_modified']
+        if not_modified or unchanged:
+            # The saved file is kept, and so is what it links to
+            alias_of = previous['alias_of']
+        journal.record(url, file_path, DONE, http_status=resp.status_code,
+                       n_bytes=n_bytes, sha1=sha1, etag=etag,
+                       last_modified=last_modified, alias_of=alias_of)
+    if not_modified or unchanged:
+        log.info("Unchanged: {}.".format(url))
+    elif alias_of is not None:
+        log.info("Same content as {}: {}.".format(alias_of, url))
+    else:
         log.info("Successfully saved {}.".format(url))
 
 
-task_queue = queue.Queue()
-
-
-def thread_worker():
-    global task_queue
+def thread_worker(scheduler, session, timeout, stats, journal, revalidate,
+                  store):
+    """
+    Downloads tasks from <scheduler> until the crawl is over. Failures are
+    handed back to the scheduler, so the thread survives them.
+    """
     while True:
-        item = task_queue.get()
-        if item is None:
+        task = scheduler.get()
+        if task is None:
             return
-        url, file_path = item
-        download(url, file_path)
-        task_queue.task_done()
+        try:
+            download(task.url, task.file_path, session=session,
+                     timeout=timeout, stats=stats, journal=journal,
+                     revalidate=revalidate, store=store)
+        except Exception as e:
+            scheduler.task_failed(task, e)
+        else:
+            scheduler.task_done(task)
 
 
-def download_all(results, offset=0, n_threads=10):
+def make_tasks(results, root_path, offset=0):
     """
-    Download all results to local files
-    :param results: list of triplets
+    Lists what to download for search results.
+    :param results: iterable of triplets
+    :param root_path: directory to save to
     :param offset: int
-    :param n_threads: int
-    :return: None
+    :return: generator of (url, file_path)
     """
-    root_path = '../tmp/banks/'
-    if not os.path.exists(root_path):
-        os.makedirs(root_path)
-
-    global task_queue
-    for triplet in results[offset:]:
+    for triplet in itertools.islice(results, offset, None):
         if triplet is None:
             continue
         conf, title, url = triplet
         file_path = os.path.join(root_path, make_filename(title))
-        task_queue.put((url, file_path))
+        yield url, file_path
 
+
+def download_all(results, offset=0, n_threads=10, root_path='../tmp/banks/',
+                 timeout=DEFAULT_TIMEOUT, engine='threads', concurrency=100,
+                 per_host_rate=None, journal=None, policy=None,
+                 stall_timeout=600.0, revalidate=False, store=None):
+    """
+    Download all results to local files
+    :param results: iterable of triplets, read lazily
+    :param offset: int
+    :param n_threads: int
+    :param root_path: directory to save to
+    :param timeout: (connect, read) timeouts in seconds
+    :param engine: 'threads', or 'asyncio' for crawler.async_downloader
+    :param concurrency: requests in flight with the asyncio engine
+    :param per_host_rate: requests per second per host with the asyncio
+                          engine, or None
+    :param journal: a DownloadJournal; if given, only URLs that are not
+                    recorded as done are downloaded
+    :param policy: a RetryPolicy for failed downloads
+    :param stall_timeout: seconds without any download finishing after
+                          which the threads engine gives up
+    :param revalidate: with a journal, re-request pages already downloaded
+                       conditionally instead of skipping them
+    :param store: a PageStore to save pages to, keyed by URL, instead of
+                  files under <root_path>
+    :return: (DownloadStats, CrawlReport)
+    """
+    if store is None and not os.path.exists(root_path):
+        os.makedirs(root_path)
+
+    tasks = make_tasks(results, root_path, offset)
+    if journal is not None and not revalidate:
+        tasks = journal.pending(tasks)
+
+    if engine == 'asyncio':
+        from crawler import async_downloader
+        return async_downloader.download_all(
+            tasks, concurrency=concurrency, per_host_rate=per_host_rate,
+            timeout=timeout, journal=journal, policy=policy,
+            revalidate=revalidate, store=store)
+
+    scheduler = Scheduler(policy=policy, stall_timeout=stall_timeout)
+    session = make_session(pool_size=n_threads)
+    stats = DownloadStats()
     threads = []
     for i in range(n_threads):
-        t = threading.Thread(target=thread_worker)
+        t = threading.Thread(target=thread_worker,
+                             args=(scheduler, session, timeout, stats,
+                                   journal, revalidate, store))
+        # Threads stuck in a stalled request must not keep the process alive
+        t.daemon = True
         t.start()
         threads.append(t)
 
-    task_queue.join()
-    log.info('All tasks done. Stopping.')
-
-    for i in range(n_threads):
-        task_queue.put(None)
-    for t in threads:
-        t.join()
+    scheduler.feed(tasks, max_pending=10 * n_threads)
+    if scheduler.wait():
+        log.info('All tasks done. Stopping.')
+        for t in threads:
+            t.join()
+    else:
+        log.error('Crawl stalled. Stopping.')
+    log.info('Download stats: {}'.format(stats.summary(session)))
+    scheduler.report.log()
+    if journal is not None:
+        log.info('Journal: {}'.format(journal.counts()))
+    return stats, scheduler.report
 
 
 def main():
     """
     Driver method.
     """
-    file_path = '../tmp/bank_links.py'
-    with open(file_path) as file:
-        content = file.read()
-        people = ast.literal_eval(content)
-    download_all(people)
+    arg_parser = argparse.ArgumentParser(
+        description='Downloads LinkedIn pages.')
+    arg_parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                            default='threads', help='download engine')
+    arg_parser.add_argument('--threads', type=int, default=10,
+                            help='number of threads')
+    arg_parser.add_argument('--concurrency', type=int, default=100,
+                            help='requests in flight with asyncio')
+    arg_parser.add_argument('--per-host-rate', type=float, default=None,
+                            help='requests per second per host with asyncio')
+    arg_parser.add_argument('--revalidate', action='store_true',
+                            help='re-request downloaded pages conditionally')
+    arg_parser.add_argument('--store', default=None,
+                            help='page store to save to instead of files')
+    arg_parser.add_argument('--stall-timeout', type=float, default=600.0,
+                            help='seconds without progress before giving up')
+    arg_parser.add_argument('--links', default=find_input('../tmp/bank_links'),
+                            help='search results to download')
+    args = arg_parser.parse_args()
+
+    people = read_results(args.links)
+    journal = DownloadJournal()
+    store = PageStore(args.store) if args.store else None
+    download_all(people, n_threads=args.threads, engine=args.engine,
+                 concurrency=args.concurrency,
+                 per_host_rate=args.per_host_rate, journal=journal,
+                 stall_timeout=args.stall_timeout,
+                 revalidate=args.revalidate, store=store)
+    journal.close()
+    if store is not None:
+        log.info('Page store: {}'.format(store.stats()))
+        store.close()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # Extracts Company ID from saved LinkedIn company pages
 
-import ast
+import argparse
+from crawler.interchange import find_input, read_results
+from crawler.scanner import scan_all, scan_task
 import csv
 import logging
 import os
@@ -12,6 +14,8 @@ import re
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+COMPANY_ID = re.compile(rb'\?companyId=(\d*)&amp;')
+
 
 def make_filename(title):
     """
@@ -32,60 +36,67 @@ def find_company_id(file_path):
     :param file_path: str
     :return: an ID string, or None
     """
-    try:
-        with open(file_path) as file:
-            html = file.read()
-            r = re.search('\?companyId=(\d*)&amp;', html)
-            if r is None:
-                return None
-            id_str = r.group(1)
-            return id_str
-    except FileNotFoundError:
-        log.error("File not found: {}".format(file_path))
-        return None
-
-
-def process_all(items):
+    return scan_task((COMPANY_ID, None, file_path))
+
+
+def process_all(items, workers=1, store=None):
     """
     Process all results from their local copies
-    :param items: list of triplets
-    :return: results: list of tuples
+    :param items: iterable of triplets, read lazily
+    :param workers: number of scanning processes
+    :param store: directory of a page store to read pages from, keyed by
+                  URL, instead of files
+    :return: results: generator of tuples, in the order of <items>
     """
     root_path = '../tmp/companies/'
 
-    results = []
-    for i, triplet in enumerate(items):
-        seq = i + 1
-        if triplet is None:
-            results.append((seq, None, None))
-            continue
-        conf, title, url = triplet
-        if conf < 40:
-            log.warning("Skipping {}".format(url))
-            results.append((seq, None, None))
-            continue
-
-        file_path = os.path.join(root_path, make_filename(title))
-        result = find_company_id(file_path)
-
-        suffix = ' | LinkedIn'
-        name = title.split(suffix)[0]
-        results.append((seq, name, result))
-
-    return results
-
+    def rows():
+        for i, triplet in enumerate(items):
+            seq = i + 1
+            if triplet is None:
+                yield seq, None, None
+                continue
+            conf, title, url = triplet
+            if conf < 40:
+                log.warning("Skipping {}".format(url))
+                yield seq, None, None
+                continue
+
+            if store is None:
+                location = os.path.join(root_path, make_filename(title))
+            else:
+                location = url
+
+            suffix = ' | LinkedIn'
+            name = title.split(suffix)[0]
+            yield seq, name, location
+
+    # The scan reads ahead of the output by at most a few chunks
+    ids = scan_all((((seq, name), location)
+                    for seq, name, location in rows()), COMPANY_ID,
+                   workers=workers, store=store)
+    for (seq, name), id_str in ids:
+        yield seq, name, id_str
 
 
 def main():
     """
     Driver method.
     """
-    file_path = '../tmp/company_links.py'
-    with open(file_path) as file:
-        content = file.read()
-        items = ast.literal_eval(content)
-
-    results = process_all(items)
+    arg_parser = argparse.ArgumentParser(
+        description='Extracts company IDs from saved company pages.')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of scanning processes')
+    arg_parser.add_argument('--store', default=None,
+                            help='page store to read pages from')
+    arg_parser.add_argument('--links',
+                            default=find_input('../tmp/company_links'),
+                            help='search results to extract from')
+    args = arg_parser.parse_args()
+
+    items = read_results(args.links)
+
+    results = process_all(items, workers=args.workers, store=args.store)
 
     out_path = '../tmp/company_ids.csv'
     with open(out_path, 'w+') as file:
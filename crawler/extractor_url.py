@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # Extracts real LinkedIn URL from saved LinkedIn pages
 
+import argparse
+from crawler.interchange import write_results
+from crawler.scanner import scan_all, scan_task
+import csv
 import logging
 import os
 import pprint
@@ -11,6 +15,8 @@ import re
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+PUBLIC_URL = re.compile(rb'<A class="view-public-profile" href="(.*?)">')
+
 
 def find_url(file_path):
     """
@@ -18,52 +24,66 @@ def find_url(file_path):
     :param file_path: str
     :return: an ID string, or None
     """
-    try:
-        with open(file_path) as file:
-            html = file.read()
-            r = re.search('<A class="view-public-profile" href="(.*?)">', html)
-            if r is None:
-                return None
-            id_str = r.group(1)
-            return id_str
-    except FileNotFoundError as e:
-        log.error(e)
-        return None
+    return scan_task((PUBLIC_URL, None, file_path))
 
 
-def process_all(items):
+def process_all(items, workers=1, store=None):
     """
     Process all results from their local copies
-    :param items: list of file names
-    :return: results: list of tuples
+    :param items: iterable of file names, read lazily
+    :param workers: number of scanning processes
+    :param store: directory of a page store to read pages from, keyed by
+                  file name, instead of files
+    :return: results: generator of tuples
     """
     root_path = '../tmp/html/'
 
-    results = []
-    for filename in items:
-        filename = filename.strip()
-        file_path = os.path.join(root_path, filename)
-        url = find_url(file_path)
+    filenames = (filename.strip() for filename in items)
+    if store is None:
+        pages = ((filename, os.path.join(root_path, filename))
+                 for filename in filenames)
+    else:
+        pages = ((filename, filename) for filename in filenames)
+    urls = scan_all(pages, PUBLIC_URL, workers=workers, store=store)
+    for filename, url in urls:
         if url is not None:
             suffix = '  LinkedIn'
             name = filename.split(suffix)[0]
             result = (0, name, url)
-            results.append(result)
-
-    return results
+            yield result
 
 
 def main():
     """
     Driver method.
     """
+    arg_parser = argparse.ArgumentParser(
+        description='Extracts public profile URLs from saved pages.')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of scanning processes')
+    arg_parser.add_argument('--store', default=None,
+                            help='page store to read pages from')
+    arg_parser.add_argument('--out', default='../tmp/html_urls.jsonl',
+                            help='file to write results to as they come')
+    arg_parser.add_argument('--csv', action='store_true',
+                            help='write CSV instead of JSON lines')
+    arg_parser.add_argument('--print', action='store_true',
+                            help='print the results instead')
+    args = arg_parser.parse_args()
+
     file_path = '../tmp/html/_html_list.txt'
     with open(file_path) as file:
-        items = file.readlines()
-
-    results = process_all(items)
+        results = process_all(file, workers=args.workers, store=args.store)
 
-    pprint.pprint(results, width=100)
+        if args.print:
+            pprint.pprint(list(results), width=100)
+        elif args.csv:
+            with open(args.out, 'w+') as out_file:
+                writer = csv.writer(out_file)
+                for row in results:
+                    writer.writerow(list(row))
+        else:
+            write_results(args.out, results)
 
 if __name__ == '__main__':
     main()
@@ -1,18 +1,15 @@
 #!/usr/bin/env python
 # Search Google for LinkedIn URL of personal profile pages
 
+import argparse
+from crawler.scoring import PERSON_SCORER
+from crawler.search_cache import CACHE_PATH, DEFAULT_TTL, SearchCache
+from crawler.search_driver import QuotaLimiter, run_searches, \
+    search_google
 import csv
-import json
+import functools
 import logging
-import os
 import pprint
-import re
-import requests
-
-# Retrieve API Keys
-
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
 
 # Set up logging
 
@@ -20,94 +17,21 @@ logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
-def search_google(keyword, site, start=0):
-    """
-    Run a google search with given parameters and return the JSON result
-    :param keyword: string
-    :param site: the domain name for the URL we are searching in
-    :param start: offset for search result
-    :return: a Python object returned by JSON parser
-    """
-    log.info('Searching Google with keyword={}, site={}, start={}'.format(
-            keyword, site, start))
-    url = 'https://www.googleapis.com/customsearch/v1'
-    params = {'key': GOOGLE_API_KEY,
-              'cx': GOOGLE_CSE_ID,
-              'q': '{0} site:{1}'.format(keyword, site)}
-    if start > 0:
-        params['start'] = start
-    resp = requests.get(url, params)
-    data = json.loads(resp.text)
-    return data
-
-
 def find_linkedin_url(name, items):
     """
     :param name: the name of the person
     :param items: a list of search result items
-    :return: (str, str) or None
+    :return: (confidence, title, link) or None
     """
-    site = 'linkedin.com'
-    candidates = []
-
-    # Step 1: Filter candidates
-
-    for item in items:
-        if not item['kind'] == 'customsearch#result':
-            log.warn('Google returned result of different kind: {}'.format(
-                    item['kind']))
-            continue
-        url = item['link']
-        title = item['title'].lower()
-        if not re.search(site, url):
-            log.debug('Not from LinkedIn: {0}'.format(url))
-            continue
-        # White list - confidence level 10
-        if re.search('/in/', url) or \
-                (re.search('/pub/', url) and not re.search('/pub/dir/', url)):
-            log.debug('Profile detected - confidence 10')
-            c = (10, item)
-            candidates.append(c)
-            continue
-        # Black list
-        if re.search('/pub/dir/', url) or re.search('/title/', url):
-            log.debug('Not personal profile: {0}'.format(url))
-            continue
-        if re.search('top', title) or re.search('profiles', title):
-            log.debug('Not personal profile: {0}'.format(title))
-            continue
-        # Passed blacklist - confidence level 5
-        log.debug('Profile detected - confidence 5')
-        c = (5, item)
-        candidates.append(c)
-        continue
-
-    # Step 2: Match names
-
-    names = name.split(' ')
-    for part in names:
-        # First name or last name
-        for i, pair in enumerate(candidates):
-            conf, item = pair
-            if re.search(part, item['title']):
-                # Add confidence if we find part of the name
-                conf += 20
-                candidates[i] = (conf, item)
-
-    # Step 3: Choose the best result
-
-    best = max(candidates, key=lambda x: x[0])
-    if best is None:
-        return None
-    else:
-        conf, item = best
-        return conf, item['title'], item['link']
+    return PERSON_SCORER.best(name, items)
 
 
-def get_linkedin_url(triplet):
+def get_linkedin_url(triplet, cache=None, limiter=None):
     """
     Search Google to get the LinkedIn URL of the given person
     :param triplet: a tuple of strings: (name, location, title)
+    :param cache: a SearchCache, or None
+    :param limiter: a QuotaLimiter, or None
     :return: (str, str) or None
     """
     site = 'linkedin.com'
@@ -117,11 +41,11 @@ def get_linkedin_url(triplet):
     keyword = ' '.join(triplet)
     name = triplet[0]
     while offset < search_limit:
-        result = search_google(keyword, site, start=offset)
-        try:
-            items = result['items']
-        except (TypeError, KeyError):
-            log.error('Bad response from Google: {0}'.format(result))
+        result = search_google(keyword, site, start=offset, cache=cache,
+                               limiter=limiter)
+        # No items when Google found nothing more
+        items = result.get('items')
+        if not items:
             return None
         offset += len(items)
         result = find_linkedin_url(name, items)
@@ -151,18 +75,78 @@ def read_people(file_path, limit):
     return ret
 
 
+def make_arg_parser(description, out_path):
+    """
+    Makes a parser of the options shared by the googler scripts.
+    :param description: of the script
+    :param out_path: default file of results
+    :return: an argparse.ArgumentParser
+    """
+    arg_parser = argparse.ArgumentParser(description=description)
+    arg_parser.add_argument('--out', default=out_path,
+                            help='JSON lines file of search progress, '
+                                 'resumed if it exists')
+    arg_parser.add_argument('--workers', type=int, default=8,
+                            help='searches in flight')
+    arg_parser.add_argument('--qps', type=float, default=10.0,
+                            help='API queries per second')
+    arg_parser.add_argument('--per-day', type=int, default=10000,
+                            help='API queries per day')
+    arg_parser.add_argument('--cache', default=CACHE_PATH,
+                            help='search cache file')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='always query the API')
+    arg_parser.add_argument('--ttl', type=float, default=DEFAULT_TTL / 86400,
+                            help='days a cached response stays valid')
+    arg_parser.add_argument('--offline', action='store_true',
+                            help='only use cached responses, expired or not')
+    return arg_parser
+
+
+def make_cache(args):
+    """
+    :param args: as parsed by make_arg_parser
+    :return: a SearchCache, or None
+    """
+    if args.no_cache:
+        return None
+    return SearchCache(args.cache, ttl=args.ttl * 86400,
+                       offline=args.offline)
+
+
+def make_limiter(args):
+    """
+    :param args: as parsed by make_arg_parser
+    :return: a QuotaLimiter
+    """
+    return QuotaLimiter(per_second=args.qps, per_day=args.per_day)
+
+
 def main():
     """
     Driver method.
     """
-    people = read_people('../input/people.csv', limit=10)
+    arg_parser = make_arg_parser(
+        'Searches Google for LinkedIn profiles of people.',
+        '../tmp/people_search.jsonl')
+    arg_parser.add_argument('--limit', type=int, default=10,
+                            help='number of people to search')
+    args = arg_parser.parse_args()
+    cache = make_cache(args)
+    limiter = make_limiter(args)
+
+    people = read_people('../input/people.csv', limit=args.limit)
     pprint.pprint(people)
 
-    results = []
-    for p in people:
-        result = get_linkedin_url(p)
-        results.append(result)
+    search = functools.partial(get_linkedin_url, cache=cache,
+                               limiter=limiter)
+    results, complete = run_searches(people, search, args.out,
+                                     workers=args.workers)
     pprint.pprint(results)
+    log.info('API queries today: {}'.format(limiter.used))
+    if cache is not None:
+        log.info('Search cache: {}'.format(cache.stats()))
+        cache.close()
 
 if __name__ == '__main__':
     main()
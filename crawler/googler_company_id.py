@@ -1,17 +1,13 @@
 #!/usr/bin/env python
 # Search Google for LinkedIn URL of company pages
 
-import json
+from crawler.googler import make_arg_parser, make_cache, make_limiter
+from crawler.interchange import write_results
+from crawler.scoring import COMPANY_SCORER
+from crawler.search_driver import run_searches, search_google
+import functools
 import logging
-import os
 import pprint
-import re
-import requests
-
-# Retrieve API Keys
-
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
 
 # Set up logging
 
@@ -19,87 +15,21 @@ logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
-def search_google(keyword, site, start=0):
-    """
-    Run a google search with given parameters and return the JSON result
-    :param keyword: string
-    :param site: the domain name for the URL we are searching in
-    :param start: offset for search result
-    :return: a Python object returned by JSON parser
-    """
-    log.info('Searching Google with keyword={}, site={}, start={}'.format(
-            keyword, site, start))
-    url = 'https://www.googleapis.com/customsearch/v1'
-    params = {'key': GOOGLE_API_KEY,
-              'cx': GOOGLE_CSE_ID,
-              'q': '{0} site:{1}'.format(keyword, site)}
-    if start > 0:
-        params['start'] = start
-    resp = requests.get(url, params)
-    data = json.loads(resp.text)
-    return data
-
-
 def find_linkedin_url(name, items):
     """
     :param name: the name of the person
     :param items: a list of search result items
-    :return: (str, str) or None
+    :return: (confidence, title, link) or None
     """
-    site = 'linkedin.com'
-    candidates = []
-
-    # Step 1: Filter candidates
-
-    for item in items:
-        if not item['kind'] == 'customsearch#result':
-            log.warn('Google returned result of different kind: {}'.format(
-                    item['kind']))
-            continue
-        url = item['link']
-        title = item['title'].lower()
-        if not re.search(site, url):
-            log.debug('Not from LinkedIn: {0}'.format(url))
-            continue
-        # White list - confidence level 10
-        if re.search('/company/', url):
-            log.debug('Company detected - confidence 10')
-            c = (40, item)
-            candidates.append(c)
-            continue
-        # Black list
-        if re.search('/jobs/', url) or re.search('/title/', url):
-            log.debug('Not company profile: {0}'.format(url))
-            continue
-        # Passed blacklist - confidence level 5
-        log.debug('Potential company detected - confidence 5')
-        c = (5, item)
-        candidates.append(c)
-        continue
-
-    # Step 2: Match names
-
-    # First name or last name
-    for i, pair in enumerate(candidates):
-        conf, item = pair
-        if re.search(name, item['title'], re.IGNORECASE):
-            # Add confidence if we find part of the name
-            conf += 10
-            candidates[i] = (conf, item)
-
-    # Step 3: Choose the best result
-
-    if len(candidates) == 0:
-        return None
-    best = max(candidates, key=lambda x: x[0])
-    conf, item = best
-    return conf, item['title'], item['link']
-
-
-def get_linkedin_url(name):
+    return COMPANY_SCORER.best(name, items)
+
+
+def get_linkedin_url(name, cache=None, limiter=None):
     """
     Search Google to get the LinkedIn URL of the given person
     :param name: str
+    :param cache: a SearchCache, or None
+    :param limiter: a QuotaLimiter, or None
     :return: (str, str) or None
     """
     site = 'linkedin.com'
@@ -108,11 +38,11 @@ def get_linkedin_url(name):
 
     keyword = name
     while offset < search_limit:
-        result = search_google(keyword, site, start=offset)
-        try:
-            items = result['items']
-        except (TypeError, KeyError):
-            log.error('Bad response from Google: {0}'.format(result))
+        result = search_google(keyword, site, start=offset, cache=cache,
+                               limiter=limiter)
+        # No items when Google found nothing more
+        items = result.get('items')
+        if not items:
             return None
         offset += len(items)
         result = find_linkedin_url(name, items)
@@ -139,17 +69,36 @@ def main():
     """
     Driver method.
     """
-    companies = read_companies('../input/companies.txt', start=1001)
+    arg_parser = make_arg_parser(
+        'Searches Google for LinkedIn pages of companies.',
+        '../tmp/company_search.jsonl')
+    arg_parser.add_argument('--start', type=int, default=0,
+                            help='first line of the company list')
+    arg_parser.add_argument('--end', type=int, default=None,
+                            help='line after the last one to search')
+    args = arg_parser.parse_args()
+    cache = make_cache(args)
+    limiter = make_limiter(args)
+
+    companies = read_companies('../input/companies.txt', start=args.start,
+                               end=args.end)
     pprint.pprint(companies)
 
-    results = []
-    for item in companies:
-        result = get_linkedin_url(item)
-        results.append(result)
-
+    search = functools.partial(get_linkedin_url, cache=cache,
+                               limiter=limiter)
+    results, complete = run_searches(companies, search, args.out,
+                                     workers=args.workers)
+    log.info('API queries today: {}'.format(limiter.used))
+    if cache is not None:
+        log.info('Search cache: {}'.format(cache.stats()))
+        cache.close()
+    if not complete:
+        log.warning('Run again to resume.')
+        return
+
+    results = [None if r is None else tuple(r) for r in results]
     pprint.pprint(results)
-    with open('../tmp/company_links.py', 'a+') as file:
-        pprint.pprint(results, stream=file, width=1000)
+    write_results('../tmp/company_links.jsonl', results)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# Reads and writes the search results passed between stages
+
+import argparse
+import ast
+import json
+import logging
+import os
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# A result is a (confidence, title, url) triplet, or None when a search
+# found nothing. Results are stored one JSON object per line, null for
+# None, so they can be appended to and read back one at a time.
+FIELDS = ('conf', 'title', 'url')
+
+
+def find_input(stem):
+    """
+    Finds the results file of a stage, preferring the JSON lines format to
+    the Python literals written by older versions.
+    :param stem: path without extension, e.g. '../tmp/bank_links'
+    :return: path of the .jsonl file, or of the .py file if only that
+             exists
+    """
+    path = '{}.jsonl'.format(stem)
+    legacy_path = '{}.py'.format(stem)
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        return legacy_path
+    return path
+
+
+def to_record(triplet):
+    """
+    :param triplet: (confidence, title, url) or None
+    :return: dict or None
+    """
+    if triplet is None:
+        return None
+    return dict(zip(FIELDS, triplet))
+
+
+def from_record(record):
+    """
+    :param record: dict or None
+    :return: (confidence, title, url) or None
+    """
+    if record is None:
+        return None
+    return tuple(record[field] for field in FIELDS)
+
+
+class ResultWriter(object):
+    """
+    Writes results one line at a time, flushing each so that a reader or
+    a crash never sees more than one partial line.
+    """
+
+    def __init__(self, path, append=False):
+        """
+        :param path: JSON lines file
+        :param append: whether to add to an existing file
+        """
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'a' if append else 'w')
+
+    def write(self, triplet):
+        """
+        :param triplet: (confidence, title, url) or None
+        :return: None
+        """
+        self._file.write(json.dumps(to_record(triplet)) + '\n')
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_results(path, results, append=False):
+    """
+    :param path: JSON lines file
+    :param results: iterable of triplets or None
+    :param append: whether to add to an existing file
+    :return: number of results written
+    """
+    with ResultWriter(path, append=append) as writer:
+        for triplet in results:
+            writer.write(triplet)
+    return writer.count
+
+
+def read_legacy(path):
+    """
+    Reads results saved as Python literals by pprint. Files that several
+    runs appended to hold one list per run; they are read in turn.
+    :param path: .py file
+    :return: generator of triplets or None
+    """
+    with open(path) as file:
+        content = file.read()
+    try:
+        chunks = [ast.literal_eval(content)]
+    except SyntaxError:
+        # pprint starts every list it writes at the start of a line, and
+        # indents its continuation lines
+        chunks = []
+        lines = []
+        for line in content.splitlines(True):
+            if line.startswith('[') and lines:
+                chunks.append(ast.literal_eval(''.join(lines)))
+                lines = []
+            lines.append(line)
+        if lines:
+            chunks.append(ast.literal_eval(''.join(lines)))
+    for chunk in chunks:
+        for triplet in chunk:
+            yield None if triplet is None else tuple(triplet)
+
+
+def read_results(path):
+    """
+    Reads results lazily, so memory use does not depend on the file size.
+    :param path: JSON lines file, or a .py file of an older version
+    :return: generator of triplets or None
+    """
+    if path.endswith('.py'):
+        yield from read_legacy(path)
+        return
+    with open(path) as file:
+        for n, line in enumerate(file, 1):
+            if not line.endswith('\n'):
+                log.warning('Ignoring partial line {} of {}.'.format(
+                    n, path))
+                return
+            yield from_record(json.loads(line))
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Converts results saved as Python literals to JSON '
+                    'lines.')
+    arg_parser.add_argument('in_path', help='.py file')
+    arg_parser.add_argument('out_path', help='.jsonl file')
+    args = arg_parser.parse_args()
+
+    count = write_results(args.out_path, read_legacy(args.in_path))
+    log.info('Converted {} results.'.format(count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Durable record of downloaded URLs
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+JOURNAL_PATH = '../tmp/downloads.sqlite3'
+
+DONE = 'done'
+FAILED = 'failed'
+
+COLUMNS = ('url', 'file_path', 'status', 'http_status', 'bytes', 'sha1',
+           'error', 'updated', 'etag', 'last_modified', 'alias_of')
+
+CREATE_DOWNLOADS = '''
+    CREATE TABLE IF NOT EXISTS {} (
+        url TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        status TEXT NOT NULL,
+        http_status INTEGER,
+        bytes INTEGER,
+        sha1 TEXT,
+        error TEXT,
+        updated REAL NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        alias_of TEXT,
+        PRIMARY KEY (url, file_path)
+    )'''
+
+
+class DownloadJournal(object):
+    """
+    A SQLite journal with the outcome of every download: URL, file, status,
+    size, content hash and time. Downloads are keyed by URL and file, as
+    the same page may be saved under several names. A download whose
+    content was already saved to another file records that file as
+    alias_of. It is safe to share between threads.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        """
+        :param path: SQLite file, created if it does not exist
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(CREATE_DOWNLOADS.format('downloads'))
+        # Journals created before revalidation lack the validator columns,
+        # and those created before aliases the alias column
+        table_info = list(self._conn.execute('PRAGMA table_info(downloads)'))
+        columns = {row[1] for row in table_info}
+        for column in ('etag', 'last_modified', 'alias_of'):
+            if column not in columns:
+                self._conn.execute(
+                    'ALTER TABLE downloads ADD COLUMN {} TEXT'.format(column))
+        # Journals created before files were part of the key
+        if [row[1] for row in table_info if row[5]] == ['url']:
+            self._rekey()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS downloads_sha1 '
+                           'ON downloads (sha1)')
+        self._conn.commit()
+
+    def _rekey(self):
+        """
+        Copies the downloads into a table keyed by URL and file.
+        """
+        columns = ', '.join(COLUMNS)
+        self._conn.execute(CREATE_DOWNLOADS.format('downloads_rekeyed'))
+        self._conn.execute(
+            'INSERT INTO downloads_rekeyed ({0}) SELECT {0} FROM downloads '
+            'WHERE file_path IS NOT NULL'.format(columns))
+        self._conn.execute('DROP TABLE downloads')
+        self._conn.execute(
+            'ALTER TABLE downloads_rekeyed RENAME TO downloads')
+        log.info('Keyed the download journal by URL and file.')
+
+    def record(self, url, file_path, status, http_status=None, n_bytes=None,
+               sha1=None, error=None, etag=None, last_modified=None,
+               alias_of=None):
+        """
+        Records the outcome of a download, replacing any earlier one to
+        the same file.
+        :param url: str
+        :param file_path: str
+        :param status: DONE or FAILED
+        :param http_status: int or None
+        :param n_bytes: size of the saved body
+        :param sha1: hex SHA-1 of the saved body
+        :param error: error message of a failed download
+        :param etag: ETag header of the response
+        :param last_modified: Last-Modified header of the response
+        :param alias_of: the file <file_path> is a link to, if the same
+                         content was downloaded there before
+        :return: None
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO downloads (url, file_path, status, '
+                'http_status, bytes, sha1, error, updated, etag, '
+                'last_modified, alias_of) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                (url, file_path, status, http_status, n_bytes, sha1, error,
+                 time.time(), etag, last_modified, alias_of))
+            self._conn.commit()
+
+    def get(self, url, file_path):
+        """
+        :param url: str
+        :param file_path: str
+        :return: dict of the latest record of <url> to <file_path>, or None
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT * FROM downloads WHERE url = ? AND file_path = ?',
+                (url, file_path))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cursor.description], row))
+
+    def validators(self, url, file_path, store=None):
+        """
+        Looks up what is needed to revalidate an earlier download.
+        :param url: str
+        :param file_path: where the page is saved
+        :param store: the PageStore the page is saved in instead, if any
+        :return: the record of the last successful download of <url> to
+                 <file_path> if the saved page is still there, or None
+        """
+        previous = self.get(url, file_path)
+        if previous is None or previous['status'] != DONE:
+            return None
+        if store is not None:
+            info = store.info(url)
+            if info is None or info['sha1'] != previous['sha1']:
+                return None
+        elif not os.path.isfile(file_path):
+            return None
+        return previous
+
+    def find_content(self, sha1, file_path):
+        """
+        Looks up the files other downloads saved the same content to, of
+        any URL.
+        :param sha1: hex SHA-1 of a body
+        :param file_path: the file being written, left out
+        :return: list of file paths, newest first; the files may have
+                 changed or gone since
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT file_path FROM downloads WHERE sha1 = ? AND '
+                'status = ? AND file_path != ? GROUP BY file_path '
+                'ORDER BY MAX(updated) DESC',
+                (sha1, DONE, file_path))
+            return [file_path for file_path, in rows]
+
+    def done_tasks(self):
+        """
+        :return: set of (url, file_path) downloaded successfully
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT url, file_path FROM downloads WHERE status = ?',
+                (DONE,))
+            return set(rows)
+
+    def pending(self, tasks):
+        """
+        Filters out the tasks already downloaded successfully, to the same
+        file.
+        :param tasks: iterable of (url, file_path)
+        :return: generator of (url, file_path)
+        """
+        done = self.done_tasks()
+        skipped = 0
+        for url, file_path in tasks:
+            if (url, file_path) in done:
+                skipped += 1
+                continue
+            yield url, file_path
+        log.info('Skipped {} URLs already downloaded.'.format(skipped))
+
+    def counts(self):
+        """
+        :return: dict from status to number of downloads
+        """
+        with self._lock:
+            return dict(self._conn.execute(
+                'SELECT status, COUNT(*) FROM downloads GROUP BY status'))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
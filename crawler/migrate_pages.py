@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Moves a directory of saved HTML pages into a page store
+
+import argparse
+from crawler.cleaner import read_manifest
+from crawler.downloader import make_filename
+from crawler.interchange import find_input, read_results
+from crawler.pagestore import PageStore
+import logging
+import os
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def file_names_to_urls(results):
+    """
+    Maps the file names pages were saved under back to their URLs.
+    :param results: iterable of triplets or None
+    :return: dict from file name to URL
+    """
+    urls = {}
+    for triplet in results:
+        if triplet is None:
+            continue
+        conf, title, url = triplet
+        # Downloaded pages are named by make_filename, cleaned ones after
+        # the full title
+        urls.setdefault(make_filename(title), url)
+        urls.setdefault("{}.html".format(title), url)
+    return urls
+
+
+def migrate_directory(in_path, store, results):
+    """
+    Copies every page of <in_path> into <store>, keyed by its URL. Pages
+    whose URL is unknown are keyed by their file name. If the directory
+    has a cleaner manifest, the hash of the page each file was cleaned
+    from is kept, so cleaning the migrated store skips them.
+    :param in_path: directory of saved pages
+    :param store: a PageStore
+    :param results: iterable of triplets the pages were saved from
+    :return: None
+    """
+    urls = file_names_to_urls(results)
+    manifest = read_manifest(in_path)
+    n_pages = n_unknown = 0
+    for entry in sorted(os.scandir(in_path), key=lambda e: e.name):
+        if not entry.name.endswith('.html'):
+            continue
+        key = urls.get(entry.name)
+        if key is None:
+            log.warning("No URL for {}.".format(entry.name))
+            key = entry.name
+            n_unknown += 1
+        source = manifest.get(entry.name, {}).get('sha1')
+        with open(entry.path, 'rb') as file:
+            store.put(key, file.read(), source=source)
+        n_pages += 1
+    log.info("Migrated {} pages, {} without URL.".format(n_pages, n_unknown))
+    log.info("Page store: {}".format(store.stats()))
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Moves saved pages into a page store.')
+    arg_parser.add_argument('in_path', help='directory of saved pages')
+    arg_parser.add_argument('store', help='page store directory')
+    arg_parser.add_argument('--results',
+                            default=find_input('../tmp/bank_links'),
+                            help='results file of the triplets the pages '
+                                 'came from, JSON lines or Python literals')
+    args = arg_parser.parse_args()
+
+    store = PageStore(args.store)
+    migrate_directory(args.in_path, store, read_results(args.results))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
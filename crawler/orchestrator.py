@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# Runs the crawler and parser stages from a shared task queue
+
+import argparse
+from crawler import googler, googler_company_id
+from crawler.cleaner import clean_file
+from crawler.downloader import DEFAULT_TIMEOUT, download, make_session
+from crawler.extractor_company_id import COMPANY_ID
+from crawler.interchange import from_record, read_results, to_record
+from crawler.scanner import scan_file
+from crawler.scheduler import RetryPolicy, classify
+from crawler.search_cache import CACHE_PATH, DEFAULT_TTL
+from crawler.search_driver import NotCached, QuotaExceeded
+from db.queue import TaskQueue, default_owner, make_queue_engine
+import hashlib
+import json
+import logging
+import os
+import pprint
+import requests
+import signal
+import threading
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Stages, each a queue of the task queue
+SEARCH = 'search'
+DOWNLOAD = 'download'
+CLEAN = 'clean'
+PARSE = 'parse'
+EXTRACT = 'extract'
+
+# Workers prefer later stages, finishing pages in flight before starting
+# new ones
+STAGES = [PARSE, EXTRACT, CLEAN, DOWNLOAD, SEARCH]
+
+PERSON = 'person'
+COMPANY = 'company'
+
+# The stage after each stage, for each kind of page
+NEXT_STAGE = {(PERSON, SEARCH): DOWNLOAD,
+              (PERSON, DOWNLOAD): CLEAN,
+              (PERSON, CLEAN): PARSE,
+              (COMPANY, SEARCH): DOWNLOAD,
+              (COMPANY, DOWNLOAD): EXTRACT}
+
+# Workers on several hosts must see the same directories, e.g. over NFS.
+# Page stores have a single writer, so they are not used here.
+RAW_PATHS = {PERSON: '../tmp/profiles/', COMPANY: '../tmp/companies/'}
+CLEAN_PATH = '../tmp/clean_profiles/'
+
+# Seconds searches are paused, for every worker, when one runs out of
+# search quota
+QUOTA_DELAY = 3600.0
+
+
+def digest(value):
+    """
+    :param value: a JSON-serializable value
+    :return: SHA-1 hex digest of its JSON
+    """
+    return hashlib.sha1(json.dumps(value).encode('utf-8')).hexdigest()
+
+
+def task_key(kind, value):
+    """
+    :param kind: PERSON or COMPANY
+    :param value: what identifies the task, e.g. the URL of a page
+    :return: key of the task, unique per queue
+    """
+    return '{}:{}'.format(kind, digest(value))
+
+
+def page_filename(payload):
+    """
+    :param payload: payload of a task of a stage after search
+    :return: name of the files of the page, from the digest of its URL:
+             people with the same name have pages with the same title
+    """
+    return '{}.html'.format(digest(payload['url']))
+
+
+def page_task(kind, triplet):
+    """
+    :param kind: PERSON or COMPANY
+    :param triplet: (confidence, title, url)
+    :return: (payload, key) of the task of a stage after search
+    """
+    payload = to_record(triplet)
+    payload['kind'] = kind
+    return payload, task_key(kind, payload['url'])
+
+
+def search_task(kind, query):
+    """
+    :param kind: PERSON or COMPANY
+    :param query: (name, location, title) of a person, or a company name
+    :return: (payload, key) of a search task
+    """
+    return {'kind': kind, 'query': query}, task_key(kind, query)
+
+
+class StageRunner(object):
+    """
+    Runs one task of any stage. Connections, the search cache and the
+    database session are made on first use, so a worker only opens what
+    its stages need.
+    """
+
+    def __init__(self, args):
+        """
+        :param args: options of the work command
+        """
+        self.args = args
+        self._http = None
+        self._search = None
+        self._session = None
+        self._cache = None
+
+    def run(self, stage, payload):
+        """
+        :param stage: name of the stage
+        :param payload: the task
+        :return: (result or None, list of (stage, payload, key) to enqueue)
+        """
+        kind = payload['kind']
+        result, triplet = getattr(self, stage)(payload)
+        next_stage = NEXT_STAGE.get((kind, stage))
+        if next_stage is None or triplet is None:
+            return result, []
+        payload, key = page_task(kind, triplet)
+        return result, [(next_stage, payload, key)]
+
+    def raw_path(self, payload):
+        return os.path.join(RAW_PATHS[payload['kind']],
+                            page_filename(payload))
+
+    def clean_path(self, payload):
+        return os.path.join(CLEAN_PATH, page_filename(payload))
+
+    def search(self, payload):
+        if self._search is None:
+            self._search = (googler.make_cache(self.args),
+                            googler.make_limiter(self.args))
+        cache, limiter = self._search
+        if payload['kind'] == PERSON:
+            triplet = googler.get_linkedin_url(payload['query'], cache=cache,
+                                               limiter=limiter)
+        else:
+            triplet = googler_company_id.get_linkedin_url(
+                payload['query'], cache=cache, limiter=limiter)
+        return to_record(triplet), triplet
+
+    def download(self, payload):
+        if self._http is None:
+            self._http = make_session(pool_size=1)
+        file_path = self.raw_path(payload)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        download(payload['url'], file_path, overwrite=True,
+                 session=self._http, timeout=DEFAULT_TIMEOUT)
+        return None, from_record(payload)
+
+    def clean(self, payload):
+        out_path = self.clean_path(payload)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        n_in, n_out = clean_file(self.raw_path(payload), out_path,
+                                 self.args.engine)
+        result = {'bytes_in': n_in, 'bytes_out': n_out}
+        if n_out is None:
+            # No profile in the page, nothing to parse
+            return result, None
+        return result, from_record(payload)
+
+    def parse(self, payload):
+        # Imported here, so that hosts without the parser's dependencies
+        # can still run the crawler stages
+        from db.cache import EntityCache
+        from db.driver import prepare_db_session
+        from parsing.loader import ProfileLoader
+        from parsing.main import read_profile
+        if self._session is None:
+            self._session = prepare_db_session()
+            self._cache = EntityCache()
+            self._cache.warm(self._session)
+            # Ends the read, which holds the write lock on SQLite
+            self._session.commit()
+        profile = read_profile(payload['title'], payload['url'],
+                               engine=self.args.engine,
+                               file_path=self.clean_path(payload))
+        try:
+            ProfileLoader(self._session, cache=self._cache).load(profile)
+            self._session.commit()
+        except BaseException:
+            self._session.rollback()
+            self._cache.rollback()
+            raise
+        self._cache.sync()
+        return None, None
+
+    def extract(self, payload):
+        company_id = scan_file(self.raw_path(payload), COMPANY_ID)
+        return {'company_id': company_id}, None
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renews the lease of a task every <interval> seconds until stopped.
+    """
+
+    def __init__(self, queue, task, interval):
+        super(Heartbeat, self).__init__(daemon=True)
+        self.queue = queue
+        self.task = task
+        self.interval = interval
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.task):
+                    log.warning('Lease of {} lost.'.format(self.task))
+                    self.lost = True
+                    return
+            except Exception as e:
+                # The lease may still be renewed in time on the next beat
+                log.error('Heartbeat of {} failed: {!r}'.format(self.task, e))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def should_retry(stage, exc):
+    """
+    :param stage: name of the stage
+    :param exc: the exception that failed a task
+    :return: whether another attempt may succeed
+    """
+    if stage == DOWNLOAD and isinstance(exc, requests.HTTPError):
+        # 404 and the like will not go away
+        return classify(exc) is not None
+    # A search the cache cannot answer offline is retried with 'retry'
+    # once online
+    return not isinstance(exc, (FileNotFoundError, ValueError, NotCached))
+
+
+def work(queue, runner, stages, owner=None, heartbeat_interval=None,
+         poll_interval=5.0, exit_when_idle=False, policy=None):
+    """
+    Claims and runs tasks until stopped, or until <stages> have no pending
+    or leased tasks left with <exit_when_idle>.
+    :param queue: a TaskQueue
+    :param runner: a StageRunner
+    :param stages: names of the stages to work on, in order of preference
+    :param owner: name of this worker, by default 'host:pid'
+    :param heartbeat_interval: seconds between lease renewals, by default
+                               a third of the visibility timeout
+    :param poll_interval: seconds to wait when there is no task
+    :param exit_when_idle: whether to return once there is no work left
+    :param policy: a RetryPolicy for the delay before retrying a task
+    :return: Counter-like dict of task outcomes
+    """
+    owner = owner or default_owner()
+    if heartbeat_interval is None:
+        heartbeat_interval = queue.visibility_timeout / 3
+    policy = policy or RetryPolicy()
+    stages = list(stages)
+    outcomes = {'done': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+    while stages:
+        task = queue.claim(stages, owner)
+        if task is None:
+            if exit_when_idle and queue.idle(stages):
+                break
+            time.sleep(poll_interval)
+            continue
+        log.info('{} working on {}.'.format(owner, task))
+        heartbeat = Heartbeat(queue, task, heartbeat_interval)
+        heartbeat.start()
+        try:
+            result, follow_ups = runner.run(task.queue, task.payload)
+        except QuotaExceeded as e:
+            heartbeat.stop()
+            # Workers share the quota, so none of them searches until the
+            # pause ends; the task waits with the rest
+            queue.pause(SEARCH, QUOTA_DELAY, reason=str(e))
+            queue.release(task)
+            continue
+        except Exception as e:
+            heartbeat.stop()
+            log.error('{} failed: {!r}'.format(task, e))
+            delay = policy.delay(task.attempts - 1, e)
+            if queue.fail(task, repr(e), delay=delay,
+                          retry=should_retry(task.queue, e)):
+                outcomes['retried'] += 1
+            else:
+                outcomes['failed'] += 1
+            continue
+        except BaseException:
+            # Stopped; another worker can take the task at once
+            heartbeat.stop()
+            queue.release(task)
+            raise
+        heartbeat.stop()
+        if queue.complete(task, result, follow_ups):
+            outcomes['done'] += 1
+        else:
+            outcomes['lost'] += 1
+    return outcomes
+
+
+def seed(queue, args):
+    """
+    Enqueues the tasks of a stage from an input file.
+    :param queue: a TaskQueue
+    :param args: options of the seed command
+    :return: number of tasks added
+    """
+    if args.stage == SEARCH:
+        if args.kind == PERSON:
+            queries = googler.read_people(args.input or
+                                          '../input/people.csv',
+                                          args.limit or float('inf'))
+        else:
+            queries = googler_company_id.read_companies(
+                args.input or '../input/companies.txt', end=args.limit)
+        items = (search_task(args.kind, query) for query in queries)
+    else:
+        if args.input is None:
+            raise SystemExit('--input is required to seed {}'.format(
+                args.stage))
+        items = (page_task(args.kind, triplet)
+                 for triplet in read_results(args.input)
+                 if triplet is not None)
+    return queue.put_many(args.stage, items)
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Runs the crawler and parser stages from a task queue '
+                    'shared by worker processes on any number of hosts.')
+    arg_parser.add_argument('--db', default=None,
+                            help='database URL of the task queue, by default '
+                                 '$QUEUE_DB_URL or a SQLite file')
+    arg_parser.add_argument('--lease', type=float, default=300.0,
+                            help='seconds a task stays claimed without a '
+                                 'heartbeat')
+    arg_parser.add_argument('--max-attempts', type=int, default=5,
+                            help='claims of a task before it fails for good')
+    commands = arg_parser.add_subparsers(dest='command')
+    commands.required = True
+
+    seed_parser = commands.add_parser('seed', help='enqueue tasks')
+    seed_parser.add_argument('stage', choices=STAGES)
+    seed_parser.add_argument('--kind', choices=[PERSON, COMPANY],
+                             default=PERSON)
+    seed_parser.add_argument('--input', default=None,
+                             help='people CSV or company list to search, or '
+                                  'search results for the other stages')
+    seed_parser.add_argument('--limit', type=int, default=None,
+                             help='number of people or companies to search')
+
+    work_parser = commands.add_parser('work', help='run tasks')
+    work_parser.add_argument('--stages', default=','.join(STAGES),
+                             help='comma-separated stages to work on, in '
+                                  'order of preference')
+    work_parser.add_argument('--owner', default=None,
+                             help='name of the worker, default host:pid')
+    work_parser.add_argument('--heartbeat', type=float, default=None,
+                             help='seconds between lease renewals')
+    work_parser.add_argument('--poll', type=float, default=5.0,
+                             help='seconds to wait when there is no task')
+    work_parser.add_argument('--exit-when-idle', action='store_true',
+                             help='stop when the stages have no work left')
+    work_parser.add_argument('--engine', choices=['bs4', 'lxml'],
+                             default='bs4', help='cleaner and parser engine')
+    work_parser.add_argument('--qps', type=float, default=1.0,
+                             help='API queries per second of this worker')
+    work_parser.add_argument('--per-day', type=int, default=10000,
+                             help='API queries per day of this host')
+    work_parser.add_argument('--cache', default=CACHE_PATH,
+                             help='search cache file')
+    work_parser.add_argument('--no-cache', action='store_true',
+                             help='always query the API')
+    work_parser.add_argument('--ttl', type=float, default=DEFAULT_TTL / 86400,
+                             help='days a cached response stays valid')
+    work_parser.add_argument('--offline', action='store_true',
+                             help='only use cached responses, expired or not')
+
+    commands.add_parser('status', help='count tasks by stage and status')
+
+    retry_parser = commands.add_parser('retry',
+                                       help='requeue the failed tasks')
+    retry_parser.add_argument('stage', choices=STAGES)
+    args = arg_parser.parse_args()
+
+    queue = TaskQueue(make_queue_engine(args.db),
+                      visibility_timeout=args.lease,
+                      max_attempts=args.max_attempts)
+    if args.command == 'seed':
+        count = seed(queue, args)
+        log.info('Added {} {} tasks.'.format(count, args.stage))
+    elif args.command == 'work':
+        stages = [s for s in args.stages.split(',') if s]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise SystemExit('Unknown stages: {}'.format(sorted(unknown)))
+        # Stop like on Ctrl-C, handing the current task back
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        outcomes = work(queue, StageRunner(args), stages, owner=args.owner,
+                        heartbeat_interval=args.heartbeat,
+                        poll_interval=args.poll,
+                        exit_when_idle=args.exit_when_idle)
+        log.info('Tasks: {}'.format(outcomes))
+    elif args.command == 'retry':
+        count = queue.retry_failed(args.stage)
+        log.info('Requeued {} {} tasks.'.format(count, args.stage))
+    pprint.pprint(queue.counts())
+    for stage, until in queue.paused(STAGES).items():
+        log.info('{} is paused until {}.'.format(stage, time.ctime(until)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# Stores pages in compressed segment files with a SQLite index
+
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.sqlite3'
+SEGMENT_NAME = 'segment-{:05d}.gz'
+# A new segment is started once the current one grows past this size
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+class PageStore(object):
+    """
+    A content-addressed store of pages, keyed by URL. Each distinct content
+    is gzip-compressed and appended as one member to a segment file, so a
+    segment is itself a valid .gz file. An SQLite index maps content hashes
+    to (segment, offset, length) and keys to content hashes, so identical
+    pages are stored once and any page can be read without scanning.
+
+    Any number of processes may read a store, but only one may write to
+    it. Within that process the store is safe to share between threads.
+    """
+
+    def __init__(self, root, readonly=False, segment_size=SEGMENT_SIZE,
+                 level=6):
+        """
+        :param root: directory of the store, created if it does not exist
+        :param readonly: open the index read-only, e.g. in worker processes
+        :param segment_size: bytes after which a new segment is started
+        :param level: gzip compression level
+        """
+        self.root = root
+        self.readonly = readonly
+        self.segment_size = segment_size
+        self.level = level
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._writer = None
+        self._segment = None
+        index_path = os.path.join(root, INDEX_NAME)
+        if readonly:
+            self._conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(index_path), uri=True,
+                check_same_thread=False)
+            return
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha1 TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                sha1 TEXT NOT NULL REFERENCES blobs(sha1),
+                source TEXT,
+                updated REAL NOT NULL
+            )''')
+        self._conn.commit()
+
+    def put(self, key, data, source=None):
+        """
+        Stores a page under <key>, replacing any earlier version. The
+        content is only written if no page has the same hash.
+        :param key: str, normally the URL of the page
+        :param data: bytes
+        :param source: SHA-1 of the page this one was derived from, if any
+        :return: (SHA-1 of <data>, whether the page under <key> changed)
+        """
+        if self.readonly:
+            raise ValueError('Store {} is read-only'.format(self.root))
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT sha1, source FROM pages WHERE key = ?',
+                (key,)).fetchone()
+            if row is not None and row[0] == digest and row[1] == source:
+                return digest, False
+            known = self._conn.execute(
+                'SELECT 1 FROM blobs WHERE sha1 = ?', (digest,)).fetchone()
+            if known is None:
+                segment, offset, length = self._append(
+                    gzip.compress(data, self.level, mtime=0))
+                self._conn.execute(
+                    'INSERT INTO blobs VALUES (?,?,?,?,?)',
+                    (digest, segment, offset, length, len(data)))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?,?,?,?)',
+                (key, digest, source, time.time()))
+            self._conn.commit()
+        return digest, row is None or row[0] != digest
+
+    def _append(self, member):
+        """
+        Appends a compressed member to the current segment. The data is
+        flushed before the index points to it, so a crash can leave unused
+        bytes at the end of a segment but never a dangling index entry.
+        :param member: gzip bytes
+        :return: (segment number, offset, length)
+        """
+        if self._writer is None:
+            if self._segment is None:
+                last = self._conn.execute(
+                    'SELECT MAX(segment) FROM blobs').fetchone()[0]
+                self._segment = last or 0
+            self._writer = open(self._segment_path(self._segment), 'ab')
+        if self._writer.tell() >= self.segment_size:
+            self._writer.close()
+            self._segment += 1
+            self._writer = open(self._segment_path(self._segment), 'ab')
+        offset = self._writer.tell()
+        self._writer.write(member)
+        self._writer.flush()
+        return self._segment, offset, len(member)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, SEGMENT_NAME.format(segment))
+
+    def _read(self, segment, offset, length):
+        """
+        :return: the decompressed member at <offset> in <segment>
+        """
+        fd = self._readers.get(segment)
+        if fd is None:
+            with self._lock:
+                fd = self._readers.get(segment)
+                if fd is None:
+                    fd = os.open(self._segment_path(segment), os.O_RDONLY)
+                    self._readers[segment] = fd
+        # pread does not move a shared file position, so threads can share
+        # the descriptor
+        return gzip.decompress(os.pread(fd, length, offset))
+
+    def get(self, key):
+        """
+        :param key: str
+        :return: the page stored under <key> as bytes, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT segment, offset, length FROM pages JOIN blobs '
+                'USING (sha1) WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return self._read(*row)
+
+    def get_blob(self, sha1):
+        """
+        :param sha1: hex SHA-1 of a content
+        :return: the content as bytes, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT segment, offset, length FROM blobs WHERE sha1 = ?',
+                (sha1,)).fetchone()
+        if row is None:
+            return None
+        return self._read(*row)
+
+    def info(self, key):
+        """
+        :param key: str
+        :return: dict with the 'sha1', 'size', 'source' and 'updated' of
+                 the page stored under <key>, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT sha1, size, source, updated FROM pages JOIN blobs '
+                'USING (sha1) WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('sha1', 'size', 'source', 'updated'), row))
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM pages WHERE key = ?',
+                (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def infos(self):
+        """
+        :return: list of (key, info dict as returned by info())
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, sha1, size, source, updated FROM pages JOIN '
+                'blobs USING (sha1) ORDER BY key').fetchall()
+        return [(row[0], dict(zip(('sha1', 'size', 'source', 'updated'),
+                                  row[1:])))
+                for row in rows]
+
+    def items(self, keys=None):
+        """
+        Streams pages in the order they are laid out on disk, so a full
+        scan reads each segment sequentially.
+        :param keys: iterable of keys to read, or None for all of them
+        :return: generator of (key, bytes)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, segment, offset, length FROM pages JOIN blobs '
+                'USING (sha1) ORDER BY segment, offset').fetchall()
+        if keys is not None:
+            keys = set(keys)
+            rows = [row for row in rows if row[0] in keys]
+        for key, segment, offset, length in rows:
+            yield key, self._read(segment, offset, length)
+
+    def writer(self, key):
+        """
+        :param key: str
+        :return: a PageWriter storing a page under <key> once committed
+        """
+        return PageWriter(self, key)
+
+    def stats(self):
+        """
+        :return: dict with the number of pages and distinct contents, and
+                 their raw and stored sizes in bytes
+        """
+        with self._lock:
+            pages, = self._conn.execute(
+                'SELECT COUNT(*) FROM pages').fetchone()
+            blobs, size, stored = self._conn.execute(
+                'SELECT COUNT(*), TOTAL(size), TOTAL(length) '
+                'FROM blobs').fetchone()
+        return {'pages': pages, 'contents': blobs,
+                'bytes': int(size), 'stored_bytes': int(stored)}
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers = {}
+            self._conn.close()
+
+
+class PageWriter(object):
+    """
+    Collects a page as it is downloaded and stores it on commit(). Has the
+    interface of downloader.AtomicFile.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.n_bytes = 0
+        self._chunks = []
+        self._sha1 = hashlib.sha1()
+
+    @property
+    def sha1(self):
+        return self._sha1.hexdigest()
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+        self._sha1.update(chunk)
+        self.n_bytes += len(chunk)
+
+    def commit(self):
+        """
+        Stores the complete page.
+        """
+        self.store.put(self.key, b''.join(self._chunks))
+        self._chunks = []
+
+    def abort(self):
+        """
+        Discards the page.
+        """
+        self._chunks = []
+
+
+_open_stores = {}
+
+
+def open_store(root):
+    """
+    Opens a store read-only, once per process. Meant for worker processes,
+    which cannot share the parent's SQLite connection.
+    :param root: directory of the store
+    :return: a PageStore
+    """
+    key = (os.getpid(), root)
+    store = _open_stores.get(key)
+    if store is None:
+        store = PageStore(root, readonly=True)
+        _open_stores[key] = store
+    return store
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Searches saved pages for a regular expression in bulk
+
+import itertools
+import logging
+import mmap
+import os
+from crawler.pagestore import open_store
+from parsing.pipeline import imap_ordered
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def _group(match):
+    if match is None:
+        return None
+    return match.group(1).decode('utf-8')
+
+
+def scan_file(file_path, pattern):
+    """
+    Searches a file for a compiled bytes pattern without reading it into
+    a string: the file is memory-mapped and the search stops at the first
+    match.
+    :param file_path: str
+    :param pattern: a compiled bytes regular expression with one group
+    :return: the first match of the group as a string, or None
+    """
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _group(pattern.search(data))
+
+
+def scan_page(store, key, pattern):
+    """
+    Searches a page of a page store for a compiled bytes pattern.
+    :param store: directory of the page store
+    :param key: key of the page
+    :param pattern: a compiled bytes regular expression with one group
+    :return: the first match of the group as a string, or None
+    """
+    content = open_store(store).get(key)
+    if content is None:
+        raise FileNotFoundError('No page for {} in {}'.format(key, store))
+    return _group(pattern.search(content))
+
+
+def scan_task(task):
+    """
+    :param task: (pattern, page store directory or None, file path or key,
+                 or None to skip)
+    :return: the first match, or None if there is none or the page is
+             missing
+    """
+    pattern, store, location = task
+    if location is None:
+        return None
+    try:
+        if store is None:
+            return scan_file(location, pattern)
+        return scan_page(store, location, pattern)
+    except FileNotFoundError as e:
+        log.error(e)
+        return None
+
+
+def scan_chunk(pattern, store, items):
+    """
+    :return: list of (tag, scan_task result) for the (tag, location) pairs
+             of <items>
+    """
+    return [(tag, scan_task((pattern, store, location)))
+            for tag, location in items]
+
+
+def scan_all(items, pattern, workers=1, store=None, chunksize=64):
+    """
+    Searches many pages, in a process pool if <workers> > 1. Results come
+    in the order of <items> as soon as they are ready, so callers can write
+    them out as they go.
+    :param items: iterable of (tag, location), read once: the location is
+                  a file path, or a key with a store, or None to skip the
+                  page; the tag is anything picklable, handed back with the
+                  result so callers need not read <items> twice
+    :param pattern: a compiled bytes regular expression with one group
+    :param workers: number of processes
+    :param store: directory of a page store to read from instead of files
+    :param chunksize: pages handed to a worker at a time
+    :return: generator of (tag, first match in the page, or None)
+    """
+    if workers <= 1:
+        for tag, location in items:
+            yield tag, scan_task((pattern, store, location))
+        return
+    # Bounded queues keep <items> from being read far ahead of the results
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    tasks = ((pattern, store, chunk) for chunk in chunks)
+    for results in imap_ordered(scan_chunk, tasks, workers=workers):
+        if results is None:
+            # imap_ordered logged the error
+            raise RuntimeError('Scanning a chunk of pages failed')
+        yield from results
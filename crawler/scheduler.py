@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# Schedules downloads with retries, backoff and a dead-letter list
+
+from collections import Counter
+import heapq
+import itertools
+import logging
+import random
+import requests
+import threading
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Failure classes
+TIMEOUT = 'timeout'
+SERVER_ERROR = '5xx'
+RATE_LIMITED = '429'
+CONNECTION = 'connection'
+
+# Retries allowed per task for each failure class
+DEFAULT_BUDGETS = {TIMEOUT: 3,
+                   SERVER_ERROR: 4,
+                   RATE_LIMITED: 8,
+                   CONNECTION: 4}
+
+
+def classify_status(status):
+    """
+    :param status: HTTP status code
+    :return: failure class, or None if retrying will not help
+    """
+    if status == 429:
+        return RATE_LIMITED
+    if status is not None and status >= 500:
+        return SERVER_ERROR
+    return None
+
+
+def classify(exc):
+    """
+    Sorts a download exception into a failure class.
+    :param exc: an exception raised by downloader.download
+    :return: failure class, or None if retrying will not help
+    """
+    # Timeouts first: ConnectTimeout is also a ConnectionError
+    if isinstance(exc, (requests.Timeout, TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, requests.HTTPError):
+        return classify_status(getattr(exc.response, 'status_code', None))
+    if isinstance(exc, (requests.ConnectionError, ConnectionError)):
+        return CONNECTION
+    return None
+
+
+def retry_after(exc):
+    """
+    :param exc: an exception carrying an HTTP response, or not
+    :return: seconds requested by a Retry-After header, or None
+    """
+    headers = getattr(exc, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('Retry-After')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter, and a retry budget per failure
+    class.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=300.0, budgets=None):
+        """
+        :param base_delay: seconds before the first retry, on average
+        :param max_delay: cap of the backoff in seconds
+        :param budgets: dict from failure class to retries allowed
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budgets = dict(DEFAULT_BUDGETS)
+        if budgets is not None:
+            self.budgets.update(budgets)
+
+    def should_retry(self, failure, attempts):
+        """
+        :param failure: failure class or None
+        :param attempts: Counter of earlier retries by failure class
+        :return: bool
+        """
+        return failure is not None and \
+            attempts[failure] < self.budgets.get(failure, 0)
+
+    def delay(self, attempt, exc=None):
+        """
+        :param attempt: number of retries so far
+        :param exc: the exception that failed the task
+        :return: seconds to wait before retrying
+        """
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(0, cap)
+        requested = retry_after(exc)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+
+class CrawlReport(object):
+    """
+    Thread-safe summary of a crawl: completed tasks, retries by failure
+    class and tasks given up on.
+    """
+
+    def __init__(self):
+        self.done = 0
+        self.retries = Counter()
+        self.dead_letters = []
+        self.stalled = []
+        self._lock = threading.Lock()
+
+    def add_done(self):
+        with self._lock:
+            self.done += 1
+
+    def add_retry(self, failure):
+        with self._lock:
+            self.retries[failure] += 1
+
+    def add_dead_letter(self, url, file_path, failure, exc, attempts):
+        with self._lock:
+            self.dead_letters.append({'url': url,
+                                      'file_path': file_path,
+                                      'failure': failure,
+                                      'error': repr(exc),
+                                      'attempts': sum(attempts.values()) + 1})
+
+    def summary(self):
+        """
+        :return: a dict of counts
+        """
+        with self._lock:
+            return {'done': self.done,
+                    'retries': dict(self.retries),
+                    'dead_letters': len(self.dead_letters),
+                    'stalled': len(self.stalled)}
+
+    def log(self):
+        log.info('Crawl report: {}'.format(self.summary()))
+        for item in self.dead_letters:
+            log.error('Gave up on {url} after {attempts} attempts '
+                      '({failure}): {error}'.format(**item))
+        for url in self.stalled:
+            log.error('Stalled: {}'.format(url))
+
+
+class Task(object):
+    """
+    A URL to download, with its retry history.
+    """
+    __slots__ = ('url', 'file_path', 'attempts')
+
+    def __init__(self, url, file_path):
+        self.url = url
+        self.file_path = file_path
+        self.attempts = Counter()
+
+
+class Scheduler(object):
+    """
+    A thread-safe queue of download tasks. Failed tasks are put back with a
+    backoff delay while their failure class has retry budget left, and end
+    up in the report's dead-letter list otherwise. wait() returns once
+    every task is done or given up on, or when no task has finished for
+    <stall_timeout> seconds while some are in flight.
+    """
+
+    def __init__(self, policy=None, stall_timeout=600.0):
+        """
+        :param policy: a RetryPolicy
+        :param stall_timeout: seconds without progress before giving up
+        """
+        self.policy = policy or RetryPolicy()
+        self.stall_timeout = stall_timeout
+        self.report = CrawlReport()
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._last_progress = time.monotonic()
+
+    def put(self, url, file_path, delay=0.0, task=None):
+        """
+        Schedules a download.
+        :param url: url to download
+        :param file_path: file to save to
+        :param delay: seconds from now
+        :param task: the Task being retried, if any
+        :return: None
+        """
+        if task is None:
+            task = Task(url, file_path)
+        with self._cond:
+            heapq.heappush(self._heap,
+                           (time.monotonic() + delay, next(self._seq), task))
+            self._cond.notify()
+
+    def get(self):
+        """
+        Blocks until a task is due.
+        :return: a Task, or None once wait() has ended the crawl
+        """
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, task = heapq.heappop(self._heap)
+                    if not self._in_flight:
+                        self._last_progress = now
+                    self._in_flight.add(task)
+                    return task
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+            return None
+
+    def task_done(self, task):
+        """
+        :param task: a Task returned by get()
+        :return: None
+        """
+        self.report.add_done()
+        with self._cond:
+            self._in_flight.discard(task)
+            self._last_progress = time.monotonic()
+            self._cond.notify_all()
+
+    def task_failed(self, task, exc, failure=None):
+        """
+        Retries <task> later or gives up on it.
+        :param task: a Task returned by get()
+        :param exc: the exception it failed with
+        :param failure: failure class, by default classify(exc)
+        :return: None
+        """
+        if failure is None:
+            failure = classify(exc)
+        if self.policy.should_retry(failure, task.attempts):
+            delay = self.policy.delay(sum(task.attempts.values()), exc)
+            task.attempts[failure] += 1
+            self.report.add_retry(failure)
+            log.warning('Retrying {} in {:.1f}s ({}): {!r}'.format(
+                task.url, delay, failure, exc))
+            self.put(task.url, task.file_path, delay=delay, task=task)
+        else:
+            self.report.add_dead_letter(task.url, task.file_path, failure,
+                                        exc, task.attempts)
+        with self._cond:
+            self._in_flight.discard(task)
+            self._last_progress = time.monotonic()
+            self._cond.notify_all()
+
+    def feed(self, tasks, max_pending=1000):
+        """
+        Schedules (url, file_path) pairs as workers make room for them, so
+        no more than <max_pending> new tasks wait in memory however long
+        <tasks> is.
+        :param tasks: iterable of (url, file_path)
+        :param max_pending: int
+        :return: None
+        """
+        for url, file_path in tasks:
+            with self._cond:
+                while len(self._heap) >= max_pending and \
+                        not self._closed and not self._stalled():
+                    self._cond.wait(1.0)
+                if self._closed:
+                    return
+            self.put(url, file_path)
+
+    def _stalled(self):
+        """
+        Closes the scheduler if tasks are in flight but none finished for
+        <stall_timeout> seconds. Call with the lock held.
+        :return: whether it did
+        """
+        if not self._in_flight or \
+                time.monotonic() - self._last_progress < self.stall_timeout:
+            return False
+        self.report.stalled = [t.url for t in self._in_flight]
+        self._closed = True
+        self._cond.notify_all()
+        return True
+
+    def wait(self):
+        """
+        Blocks until the crawl is over, then stops the workers.
+        :return: True if every task finished, False if the crawl stalled
+        """
+        with self._cond:
+            while (self._heap or self._in_flight) and not self._closed:
+                if self._stalled():
+                    break
+                if self._in_flight:
+                    idle = time.monotonic() - self._last_progress
+                    self._cond.wait(min(self.stall_timeout - idle, 1.0))
+                else:
+                    self._cond.wait(1.0)
+            finished = not self.report.stalled
+            self._closed = True
+            self._cond.notify_all()
+        return finished
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Scores Google search results as candidate LinkedIn pages
+
+import logging
+import re
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+RESULT_KIND = 'customsearch#result'
+
+# Rules are tried in order and the first one matching decides: a result
+# gets the rule's score, or is dropped if the score is None. A rule is
+# (score, field, pattern, unless pattern or None), where field is 'link'
+# or 'title' (lower-cased). Results no rule matches get the default score.
+# Each part of the name found in the title adds the name boost; 'parts'
+# splits the name on spaces, 'whole' looks for the full name.
+
+PERSON_SCORING = {
+    'site': 'linkedin.com',
+    'rules': [(10, 'link', '/in/', None),
+              (10, 'link', '/pub/', '/pub/dir/'),
+              (None, 'link', '/pub/dir/|/title/', None),
+              (None, 'title', 'top|profiles', None)],
+    'default': 5,
+    'name_boost': 20,
+    'name_mode': 'parts',
+    'ignore_case': False,
+}
+
+COMPANY_SCORING = {
+    'site': 'linkedin.com',
+    'rules': [(40, 'link', '/company/', None),
+              (None, 'link', '/jobs/|/title/', None)],
+    'default': 5,
+    'name_boost': 10,
+    'name_mode': 'whole',
+    'ignore_case': True,
+}
+
+
+def _compile(pattern, flags=0):
+    """
+    Compiles a name as a regular expression, like re.search(name, ...)
+    did, falling back to a literal match if it is not a valid one.
+    """
+    try:
+        return re.compile(pattern, flags)
+    except re.error:
+        return re.compile(re.escape(pattern), flags)
+
+
+class Scorer(object):
+    """
+    Scores search results against a rule set compiled once.
+    """
+
+    def __init__(self, config):
+        """
+        :param config: dict like PERSON_SCORING
+        """
+        self.config = config
+        self.site = re.compile(config['site'])
+        self.rules = [(score, field == 'title', re.compile(pattern),
+                       re.compile(unless) if unless else None)
+                      for score, field, pattern, unless in config['rules']]
+        self.default = config['default']
+        self.name_boost = config['name_boost']
+        self.name_mode = config['name_mode']
+        self.name_flags = re.IGNORECASE if config['ignore_case'] else 0
+
+    def name_patterns(self, name):
+        """
+        :param name: the name searched for
+        :return: list of compiled patterns, one per name part
+        """
+        if self.name_mode == 'parts':
+            parts = name.split(' ')
+        else:
+            parts = [name]
+        return [_compile(part, self.name_flags) for part in parts]
+
+    def score(self, name, items):
+        """
+        Scores a page of search results in one pass.
+        :param name: the name searched for
+        :param items: a list of search result items
+        :return: list of (confidence, item) for the items kept
+        """
+        debug = log.isEnabledFor(logging.DEBUG)
+        names = self.name_patterns(name)
+        candidates = []
+        for item in items:
+            if item['kind'] != RESULT_KIND:
+                log.warning('Google returned result of different kind: '
+                            '{}'.format(item['kind']))
+                continue
+            link = item['link']
+            if not self.site.search(link):
+                if debug:
+                    log.debug('Not from {}: {}'.format(self.config['site'],
+                                                       link))
+                continue
+            title = item['title']
+            lower_title = None
+            conf = self.default
+            for score, on_title, pattern, unless in self.rules:
+                if on_title:
+                    if lower_title is None:
+                        lower_title = title.lower()
+                    text = lower_title
+                else:
+                    text = link
+                if pattern.search(text) and \
+                        (unless is None or not unless.search(text)):
+                    conf = score
+                    break
+            if conf is None:
+                if debug:
+                    log.debug('Rejected: {} {}'.format(link, title))
+                continue
+            for pattern in names:
+                if pattern.search(title):
+                    conf += self.name_boost
+            candidates.append((conf, item))
+        return candidates
+
+    def best(self, name, items):
+        """
+        :param name: the name searched for
+        :param items: a list of search result items
+        :return: (confidence, title, link) of the best candidate, the
+                 first one on ties, or None if there is none
+        """
+        candidates = self.score(name, items)
+        if not candidates:
+            return None
+        conf, item = max(candidates, key=lambda x: x[0])
+        return conf, item['title'], item['link']
+
+
+PERSON_SCORER = Scorer(PERSON_SCORING)
+COMPANY_SCORER = Scorer(COMPANY_SCORING)
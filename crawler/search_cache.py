@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# Caches Google Custom Search responses on disk
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+CACHE_PATH = '../tmp/search_cache.sqlite3'
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Share of <max_bytes> a full cache is evicted down to, so that eviction
+# runs once per many puts rather than on each
+LOW_WATER = 0.9
+
+
+class SearchCache(object):
+    """
+    An SQLite cache of search responses keyed by (query, site, start).
+    Entries older than <ttl> seconds are ignored, and the least recently
+    used ones are evicted once the cached responses exceed <max_bytes>.
+    In offline mode, misses are not sent to the API, and expired entries
+    are served, so the scoring of search results can be re-run from the
+    cache alone. It is safe to share between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL,
+                 max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        """
+        :param path: SQLite file, created if it does not exist
+        :param ttl: seconds a response stays valid, or None for ever
+        :param max_bytes: total size of the cached responses
+        :param offline: whether to answer from the cache only
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                query TEXT NOT NULL,
+                site TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (query, site, start)
+            )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                           'ON responses (accessed)')
+        self._conn.commit()
+        self._bytes = self._conn.execute(
+            'SELECT TOTAL(LENGTH(response)) FROM responses').fetchone()[0]
+
+    def get(self, query, site, start=0):
+        """
+        :param query: search keywords
+        :param site: the domain searched in
+        :param start: offset of the results
+        :return: the cached response, or None; expired responses are
+                 returned in offline mode only
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, created FROM responses '
+                'WHERE query = ? AND site = ? AND start = ?',
+                (query, site, start)).fetchone()
+            expired = row is not None and self.ttl is not None and \
+                now - row[1] > self.ttl
+            if row is None or (expired and not self.offline):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE responses SET accessed = ? '
+                'WHERE query = ? AND site = ? AND start = ?',
+                (now, query, site, start))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, site, start, response):
+        """
+        Caches a response, evicting old ones if the cache is full.
+        :param query: search keywords
+        :param site: the domain searched in
+        :param start: offset of the results
+        :param response: a Python object returned by JSON parser
+        :return: None
+        """
+        data = json.dumps(response, separators=(',', ':'))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                'SELECT LENGTH(response) FROM responses '
+                'WHERE query = ? AND site = ? AND start = ?',
+                (query, site, start)).fetchone()
+            if old is not None:
+                self._bytes -= old[0]
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)',
+                (query, site, start, data, now, now))
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the cache is down to
+        LOW_WATER of <max_bytes>. Expired entries are kept until then, as
+        offline runs still read them.
+        """
+        # Other processes may share the file, so the running total is
+        # corrected here, once per eviction
+        self._bytes = self._conn.execute(
+            'SELECT TOTAL(LENGTH(response)) FROM responses').fetchone()[0]
+        target = self.max_bytes * LOW_WATER
+        rows = self._conn.execute(
+            'SELECT rowid, LENGTH(response) FROM responses '
+            'ORDER BY accessed')
+        victims = []
+        for rowid, size in rows:
+            if self._bytes <= target:
+                break
+            victims.append((rowid,))
+            self._bytes -= size
+        self._conn.executemany('DELETE FROM responses WHERE rowid = ?',
+                               victims)
+        log.info('Evicted {} search responses.'.format(len(victims)))
+
+    def stats(self):
+        """
+        :return: dict of hits, misses and cached responses
+        """
+        with self._lock:
+            entries, = self._conn.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': entries, 'bytes': int(self._bytes)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
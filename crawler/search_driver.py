@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# Runs Google searches concurrently within the API quotas
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+# Retrieve API Keys
+
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+QUOTA_PATH = '../tmp/search_quota.json'
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when the daily query quota is used up, or the API says so.
+    """
+
+
+class SearchFailed(Exception):
+    """
+    Raised when a search gets no answer to score, such as an error from
+    the API. It has no result to record, so a later run searches again.
+    """
+
+
+class NotCached(SearchFailed):
+    """
+    Raised in offline mode for a query the search cache cannot answer.
+    """
+
+
+QUOTA_REASONS = {'dailyLimitExceeded', 'rateLimitExceeded',
+                 'userRateLimitExceeded', 'quotaExceeded'}
+
+
+def is_quota_error(data):
+    """
+    :param data: a Custom Search API response
+    :return: whether it refuses the query for lack of quota
+    """
+    error = data.get('error') if isinstance(data, dict) else None
+    if not error:
+        return False
+    if error.get('code') == 429:
+        return True
+    return any(e.get('reason') in QUOTA_REASONS
+               for e in error.get('errors', []))
+
+
+def quota_day():
+    """
+    :return: the current day of the API quota as 'YYYY-MM-DD'. Quotas
+             reset at midnight Pacific time; daylight saving time is
+             ignored, so the day never starts early.
+    """
+    return time.strftime('%Y-%m-%d', time.gmtime(time.time() - 8 * 3600))
+
+
+class QuotaLimiter(object):
+    """
+    A token bucket allowing <per_second> queries per second on average and
+    bursts of <burst>, plus a count of the queries sent on the current
+    quota day. The count is saved to <state_path>, so it carries over
+    between runs on the same day. It is safe to share between threads.
+    """
+
+    def __init__(self, per_second=10.0, per_day=10000, burst=None,
+                 state_path=QUOTA_PATH):
+        """
+        :param per_second: queries per second
+        :param per_day: queries per quota day, or None for no limit
+        :param burst: size of the bucket, by default <per_second>
+        :param state_path: JSON file of the daily count, or None
+        """
+        self.rate = per_second
+        self.per_day = per_day
+        self.capacity = burst or max(per_second, 1.0)
+        self.state_path = state_path
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._day = quota_day()
+        self._used = 0
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path) as file:
+                state = json.load(file)
+            self._used = state.get(self._day, 0)
+
+    @property
+    def used(self):
+        with self._lock:
+            return self._used
+
+    def acquire(self):
+        """
+        Blocks until a query may be sent, and counts it.
+        :return: None
+        :raise QuotaExceeded: if the daily quota is used up
+        """
+        while True:
+            with self._lock:
+                day = quota_day()
+                if day != self._day:
+                    self._day = day
+                    self._used = 0
+                if self.per_day is not None and self._used >= self.per_day:
+                    raise QuotaExceeded('Daily quota of {} queries used '
+                                        'up'.format(self.per_day))
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._used += 1
+                    self._save()
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _save(self):
+        if self.state_path is None:
+            return
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as file:
+            json.dump({self._day: self._used}, file)
+        os.replace(tmp_path, self.state_path)
+
+
+def search_google(keyword, site, start=0, cache=None, limiter=None):
+    """
+    Run a google search with given parameters and return the JSON result
+    :param keyword: string
+    :param site: the domain name for the URL we are searching in
+    :param start: offset for search result
+    :param cache: a SearchCache to answer from and fill, or None
+    :param limiter: a QuotaLimiter to pace API queries, or None
+    :return: a Python object returned by JSON parser
+    :raise QuotaExceeded: with a limiter, if the quota is used up
+    :raise NotCached: offline, if the cache cannot answer
+    :raise SearchFailed: if the API answers with an error
+    """
+    if cache is not None:
+        data = cache.get(keyword, site, start)
+        if data is not None:
+            return data
+        if cache.offline:
+            raise NotCached('Not cached: keyword={}, site={}, '
+                            'start={}'.format(keyword, site, start))
+    log.info('Searching Google with keyword={}, site={}, start={}'.format(
+            keyword, site, start))
+    url = 'https://www.googleapis.com/customsearch/v1'
+    params = {'key': GOOGLE_API_KEY,
+              'cx': GOOGLE_CSE_ID,
+              'q': '{0} site:{1}'.format(keyword, site)}
+    if start > 0:
+        params['start'] = start
+    if limiter is not None:
+        limiter.acquire()
+    resp = requests.get(url, params)
+    data = json.loads(resp.text)
+    if limiter is not None and is_quota_error(data):
+        raise QuotaExceeded(data['error'].get('message'))
+    if 'error' in data:
+        # Not cached, as asking again may work
+        raise SearchFailed('Error from Google: {}'.format(data['error']))
+    if cache is not None:
+        cache.put(keyword, site, start, data)
+    return data
+
+
+def read_progress(out_path):
+    """
+    Reads the rows an earlier run completed.
+    :param out_path: JSON lines file written by run_searches
+    :return: (list of {'row', 'input', 'result'} dicts in row order, size
+             in bytes of the complete lines)
+    """
+    records = []
+    size = 0
+    if not os.path.exists(out_path):
+        return records, size
+    with open(out_path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                # A line cut short by a crash
+                break
+            records.append(json.loads(line.decode('utf-8')))
+            size += len(line)
+    return records, size
+
+
+def run_searches(items, search, out_path, workers=8):
+    """
+    Runs <search> over <items> in up to <workers> threads. Each result is
+    appended to <out_path> as one JSON line as soon as every row before it
+    is done, so the file always holds a prefix of the input, and a new run
+    resumes after the last completed row. The run stops early, keeping
+    what it completed, when the quota is used up or a search fails.
+    :param items: list of search inputs
+    :param search: function from an input to its result
+    :param out_path: JSON lines file of results
+    :param workers: searches in flight
+    :return: (list of results in input order, whether all rows are done)
+    """
+    records, size = read_progress(out_path)
+    for record, item in zip(records, items):
+        # Compare as JSON, which turns tuples into lists
+        if record['input'] != json.loads(json.dumps(item)):
+            raise ValueError('{} row {} is for {!r}, not {!r}. Delete it to '
+                             'start over.'.format(out_path, record['row'],
+                                                  record['input'], item))
+    results = [record['result'] for record in records[:len(items)]]
+    if results:
+        log.info('Resuming after row {}.'.format(len(results)))
+
+    if os.path.exists(out_path):
+        # Drop a line cut short by a crash before appending
+        with open(out_path, 'r+b') as file:
+            file.truncate(size)
+
+    rows = iter(range(len(results), len(items)))
+    pending = deque()
+    complete = True
+    with ThreadPoolExecutor(workers) as executor, \
+            open(out_path, 'a') as file:
+
+        def submit():
+            for row in rows:
+                pending.append((row, executor.submit(search, items[row])))
+                return
+
+        for _ in range(2 * workers):
+            submit()
+        while pending:
+            row, future = pending.popleft()
+            try:
+                result = future.result()
+            except QuotaExceeded as e:
+                log.warning('Stopping at row {}: {}'.format(row, e))
+                complete = False
+                break
+            except Exception as e:
+                log.error('Stopping at row {}: {!r}'.format(row, e))
+                complete = False
+                break
+            file.write(json.dumps({'row': row, 'input': items[row],
+                                   'result': result}) + '\n')
+            file.flush()
+            results.append(result)
+            submit()
+        if not complete:
+            # Let the searches in flight finish, but start no new ones
+            for _, future in pending:
+                future.cancel()
+    log.info('{} of {} rows done.'.format(len(results), len(items)))
+    return results, complete
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Benchmarks entity lookups and profile joins without and with the indexes
+
+import argparse
+from db.models import *
+import logging
+import os
+import random
+from sqlalchemy import and_, bindparam, create_engine, inspect, select
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+BENCH_PATH = '../tmp/bench_indexes.sqlite3'
+
+
+def new_indexes():
+    """
+    :return: the indexes the schema revision added on the tables used here
+    """
+    indexes = []
+    for model in (Company, Title, PersonExperience):
+        for index in model.__table__.indexes:
+            if index.name.endswith('_natural_key') or \
+                    index.name.startswith('ix_person_experiences_'):
+                indexes.append(index)
+    return indexes
+
+
+def populate(engine, n_rows, seed=0, chunk_size=10000):
+    """
+    Fills the tables with n_rows companies and experiences, a tenth as
+    many people and a hundredth as many titles.
+    :param engine: SQLAlchemy engine
+    :param n_rows: int
+    :param seed: random seed
+    :param chunk_size: rows per INSERT
+    :return: None
+    """
+    rng = random.Random(seed)
+    n_people = max(n_rows // 10, 1)
+    n_titles = max(n_rows // 100, 1)
+
+    def entity(i, kind):
+        name = '{} {}'.format(kind, i)
+        # Some entities have no URL, like on LinkedIn
+        url = None if i % 3 == 0 else \
+            'https://www.linkedin.com/{}/{}'.format(kind.lower(), i)
+        return {'name': name, 'url': url,
+                'natural_key': natural_key(name, url)}
+
+    tables = [
+        (Company.__table__, n_rows, lambda i: entity(i, 'Company')),
+        (Title.__table__, n_titles, lambda i: entity(i, 'Title')),
+        (Person.__table__, n_people,
+         lambda i: {'name': 'Person {}'.format(i)}),
+        (PersonExperience.__table__, n_rows, lambda i: {
+            'person_id': rng.randint(1, n_people),
+            'company_id': rng.randint(1, n_rows),
+            'title_id': rng.randint(1, n_titles)}),
+    ]
+    for table, n, make_row in tables:
+        start = time.perf_counter()
+        for first in range(1, n + 1, chunk_size):
+            last = min(first + chunk_size, n + 1)
+            rows = [make_row(i) for i in range(first, last)]
+            with engine.begin() as conn:
+                conn.execute(table.insert(), rows)
+        log.info('Inserted {} rows into {} in {:.1f} s.'.format(
+            n, table.name, time.perf_counter() - start))
+
+
+def make_queries(n_rows, n_samples, seed=1):
+    """
+    :return: list of (label, statement before, statement after, list of
+             parameter dicts); before and after differ where the code
+             changed how it looks entities up
+    """
+    rng = random.Random(seed)
+    companies = Company.__table__
+    titles = Title.__table__
+    experiences = PersonExperience.__table__
+    n_people = max(n_rows // 10, 1)
+
+    lookups = []
+    for _ in range(n_samples):
+        i = rng.randint(1, n_rows)
+        name = 'Company {}'.format(i)
+        url = None if i % 3 == 0 else \
+            'https://www.linkedin.com/company/{}'.format(i)
+        lookups.append({'name': name, 'url': url,
+                        'natural_key': natural_key(name, url)})
+    by_name_url = select([companies.c.id]).where(and_(
+        companies.c.name == bindparam('name'),
+        # IS NULL when url is None, like filter_by(url=None)
+        companies.c.url.isnot_distinct_from(bindparam('url'))))
+    by_natural_key = select([companies.c.id]).where(
+        companies.c.natural_key == bindparam('natural_key'))
+
+    profile = select([companies.c.name, titles.c.name]).select_from(
+        experiences.outerjoin(companies).outerjoin(titles)).where(
+        experiences.c.person_id == bindparam('person_id')).order_by(
+        experiences.c.id)
+    people = [{'person_id': rng.randint(1, n_people)}
+              for _ in range(n_samples)]
+
+    at_company = select([experiences.c.person_id]).where(
+        experiences.c.company_id == bindparam('company_id')).order_by(
+        experiences.c.person_id)
+    company_ids = [{'company_id': rng.randint(1, n_rows)}
+                   for _ in range(n_samples)]
+
+    replace = experiences.delete().where(
+        experiences.c.person_id == bindparam('person_id'))
+
+    return [('entity lookup', by_name_url, by_natural_key, lookups),
+            ('profile join', profile, profile, people),
+            ('people at company', at_company, at_company, company_ids),
+            ('delete profile rows', replace, replace, people)]
+
+
+def run_query(engine, statement, params, max_seconds):
+    """
+    Runs a statement once per parameter set, in a transaction rolled back
+    at the end, for at most <max_seconds>.
+    :return: (seconds per statement, list of results)
+    """
+    results = []
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        start = time.perf_counter()
+        for p in params:
+            result = conn.execute(statement, p)
+            results.append(result.fetchall() if result.returns_rows
+                           else result.rowcount)
+            if time.perf_counter() - start > max_seconds:
+                break
+        seconds = time.perf_counter() - start
+        transaction.rollback()
+    return seconds / len(results), results
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks entity lookups and profile joins before '
+                    'and after adding the natural key and foreign key '
+                    'indexes.')
+    arg_parser.add_argument('--db', default=None,
+                            help='URL of an empty database to fill, default '
+                                 'a new SQLite file {}'.format(BENCH_PATH))
+    arg_parser.add_argument('--rows', type=int, default=1000000,
+                            help='companies and experiences to insert')
+    arg_parser.add_argument('--samples', type=int, default=1000,
+                            help='statements per query')
+    arg_parser.add_argument('--max-seconds', type=float, default=10.0,
+                            help='time limit per query and schema')
+    args = arg_parser.parse_args()
+
+    if args.db is None:
+        if os.path.exists(BENCH_PATH):
+            os.remove(BENCH_PATH)
+        args.db = 'sqlite:///{}'.format(BENCH_PATH)
+    engine = create_engine(args.db)
+    if inspect(engine).get_table_names():
+        raise SystemExit('{} is not empty.'.format(args.db))
+
+    # The schema before the revision: the tables without the new indexes
+    Base.metadata.create_all(engine)
+    indexes = new_indexes()
+    for index in indexes:
+        index.drop(engine)
+    populate(engine, args.rows)
+    queries = make_queries(args.rows, args.samples)
+
+    before = {}
+    for label, statement, _, params in queries:
+        before[label] = run_query(engine, statement, params, args.max_seconds)
+
+    start = time.perf_counter()
+    for index in indexes:
+        index.create(engine)
+    log.info('Created {} indexes in {:.1f} s.'.format(
+        len(indexes), time.perf_counter() - start))
+
+    n_diff = 0
+    for label, _, statement, params in queries:
+        old_seconds, old_results = before[label]
+        new_seconds, new_results = run_query(engine, statement, params,
+                                             args.max_seconds)
+        n = min(len(old_results), len(new_results))
+        if old_results[:n] != new_results[:n]:
+            n_diff += 1
+            log.error('{}: results differ'.format(label))
+        log.info('{}: {:.3f} ms -> {:.3f} ms per statement, {:.0f}x '
+                 'faster'.format(label, old_seconds * 1e3, new_seconds * 1e3,
+                                 old_seconds / new_seconds))
+    if n_diff:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
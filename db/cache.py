@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# In-process entity resolution cache
+
+from collections import OrderedDict
+from db.models import *
+import logging
+from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+ENTITY_MODELS = (Title, Company, School, Certification, Skill)
+
+
+class EntityCache(object):
+    """
+    A bounded LRU cache resolving (model, name, url) to entity ids.
+
+    Misses are resolved with the upsert of EntityMixin.resolve_ids, so
+    processes sharing a database never create the same entity twice. Ids of
+    entities resolved since the last commit are tracked, so that they can
+    be forgotten if the transaction is rolled back.
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        :param max_size: maximum number of resolved ids to keep
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+        self._created = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def warm(self, session, models=ENTITY_MODELS):
+        """
+        Bulk loads existing entities from the database into the cache.
+        :param session: an active SQLAlchemy session
+        :param models: entity classes to load
+        :return: number of entries loaded
+        """
+        count = 0
+        for model in models:
+            table = model.__table__
+            query = select([table.c.id, table.c.name, table.c.url])
+            for id_, name, url in session.execute(query):
+                self.put(model, name, url, id_)
+                count += 1
+                if count >= self.max_size:
+                    log.warning('Entity cache full after warming '
+                                '{} entries.'.format(count))
+                    return count
+        log.info('Entity cache warmed with {} entries.'.format(count))
+        return count
+
+    def get(self, model, name, url):
+        """
+        Looks up the id of an entity, counting hits and misses.
+        :param model: entity class
+        :param name: str
+        :param url: str or None
+        :return: int or None
+        """
+        key = (model, name, url)
+        id_ = self._ids.get(key)
+        if id_ is None:
+            self.misses += 1
+            return None
+        self._ids.move_to_end(key)
+        self.hits += 1
+        return id_
+
+    def put(self, model, name, url, id_):
+        """
+        Records the id of an entity, evicting the least recently used entry
+        if the cache is full.
+        :param model: entity class
+        :param name: str
+        :param url: str or None
+        :param id_: int
+        :return: None
+        """
+        key = (model, name, url)
+        self._ids[key] = id_
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def get_or_create(self, session, model, name, url):
+        """
+        Cached equivalent of ``model.get_or_create(session, name=, url=)``.
+        :param session: an active SQLAlchemy session
+        :param model: entity class
+        :param name: str
+        :param url: str or None
+        :return: a <model> object
+        """
+        id_ = self.get_id(session, model, name, url)
+        return self._attach(session, model, id_, name, url)
+
+    def get_id(self, session, model, name, url):
+        """
+        Resolves an entity to its id with Core statements, inserting it if
+        it does not exist yet.
+        :param session: an active SQLAlchemy session
+        :param model: entity class
+        :param name: str
+        :param url: str or None
+        :return: int
+        """
+        id_ = self.get(model, name, url)
+        if id_ is not None:
+            return id_
+        return self._resolve(session, model, [(name, url)])[(name, url)]
+
+    def resolve(self, session, model, keys):
+        """
+        Resolves many entities at once, with one upsert and one SELECT for
+        all the ones not cached.
+        :param session: an active SQLAlchemy session
+        :param model: entity class
+        :param keys: iterable of (name, url), in the order to insert them
+        :return: dict from (name, url) to id
+        """
+        ids = {}
+        missing = {}
+        for name, url in keys:
+            id_ = self.get(model, name, url)
+            if id_ is None:
+                missing[(name, url)] = None
+            else:
+                ids[(name, url)] = id_
+        if missing:
+            ids.update(self._resolve(session, model, missing))
+        return ids
+
+    def _resolve(self, session, model, keys):
+        ids = model.resolve_ids(session, keys)
+        for (name, url), id_ in ids.items():
+            self.put(model, name, url, id_)
+            self._created.append((model, name, url))
+        return ids
+
+    def checkpoint(self):
+        """
+        :return: a marker to pass to rollback()
+        """
+        return len(self._created)
+
+    def rollback(self, checkpoint=0):
+        """
+        Forgets entities resolved since <checkpoint>, after the transaction
+        or savepoint that may have created them was rolled back.
+        :param checkpoint: value returned by checkpoint()
+        :return: None
+        """
+        for key in self._created[checkpoint:]:
+            self._ids.pop(key, None)
+        del self._created[checkpoint:]
+
+    def sync(self):
+        """
+        Marks the entities resolved so far as committed. Call this after
+        committing a batch.
+        :return: None
+        """
+        del self._created[:]
+
+    def stats(self):
+        """
+        :return: a dict of cache counters
+        """
+        total = self.hits + self.misses
+        return {'size': len(self._ids),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+    @staticmethod
+    def _attach(session, model, id_, name, url):
+        """
+        Puts a known entity into the session without emitting a SELECT.
+        """
+        instance = model(id=id_, name=name, url=url)
+        make_transient_to_detached(instance)
+        return session.merge(instance, load=False)
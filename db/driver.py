@@ -1,28 +1,224 @@
 #!/usr/bin/env python
+# Creates database engines and sessions
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from db.migrate import migrate
 from db.models import *
+import logging
 import os
+import random
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+import weakref
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
 
 MYSQL_DB_URL = os.getenv('LOCAL_MYSQL')
 DATABASE_PATH = '../tmp/db.sqlite3'
 
+# $DATABASE_URL takes precedence over $LOCAL_MYSQL; with neither, the
+# database is SQLite at DATABASE_PATH
+DATABASE_URL = os.getenv('DATABASE_URL') or MYSQL_DB_URL or \
+    'sqlite:///{}'.format(DATABASE_PATH)
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+# MySQL drops connections idle for wait_timeout, 8 hours by default
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))
+
+# Set on every SQLite connection. WAL lets readers run alongside the
+# writer, and with it synchronous=NORMAL is still safe against corruption;
+# a commit lost in a power failure is re-parsed on the next run.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    # Bytes of the file read through a memory map instead of read() calls
+    ('mmap_size', 256 * 1024 ** 2),
+    # Negative sizes are in KiB: a 64 MiB page cache, instead of 2 MiB
+    ('cache_size', -64 * 1024),
+    ('temp_store', 'MEMORY'),
+    # Milliseconds to wait for another process's write lock
+    ('busy_timeout', 60000),
+)
+
 Session = sessionmaker()
 
+_engines = {}
+_migrated = set()
+_engines_lock = threading.Lock()
+# Every engine make_engine created, to reset in forked processes
+_pooled_engines = weakref.WeakSet()
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas=SQLITE_PRAGMAS):
+    """
+    :param dbapi_connection: a sqlite3 connection
+    :param pragmas: sequence of (name, value)
+    :return: None
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+def _forget_inherited_pools():
+    """
+    Runs in a forked child: drops the pooled connections of the parent
+    without closing them, which would close them for the parent too, so
+    the child opens its own.
+    """
+    for engine in list(_pooled_engines):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_forget_inherited_pools)
+
+
+def make_engine(url=None, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                pool_recycle=POOL_RECYCLE, pool_pre_ping=True,
+                pragmas=SQLITE_PRAGMAS, echo=False):
+    """
+    Creates an engine whose pool can be shared by threads and inherited by
+    forked processes. On SQLite, transactions take the write lock when
+    they begin, so that processes can write the same file at once.
+    :param url: SQLAlchemy database URL, by default DATABASE_URL
+    :param pool_size: connections kept open
+    :param max_overflow: connections opened beyond <pool_size> under load
+    :param pool_recycle: seconds after which a connection is replaced
+    :param pool_pre_ping: whether to test connections before handing them
+                          out, so ones the server dropped are replaced
+    :param pragmas: sequence of (name, value) to set on SQLite connections
+    :param echo: whether to log statements
+    :return: SQLAlchemy engine
+    """
+    url = url or DATABASE_URL
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+            # Each connection would have its own in-memory database
+            engine = create_engine(url, echo=echo)
+        else:
+            # pysqlite pools no file connections by default, so every
+            # checkout would reconnect and set the pragmas again. Pooled
+            # connections move between threads, one thread at a time.
+            engine = create_engine(
+                url, poolclass=QueuePool, pool_size=pool_size,
+                max_overflow=max_overflow, pool_pre_ping=pool_pre_ping,
+                connect_args={'check_same_thread': False}, echo=echo)
+
+        @event.listens_for(engine, 'connect')
+        def connect(dbapi_connection, connection_record):
+            set_sqlite_pragmas(dbapi_connection, pragmas)
+            # pysqlite would BEGIN a deferred transaction before the first
+            # write; a transaction that read first then cannot take the
+            # write lock if another did meanwhile, and fails at once
+            # whatever busy_timeout says. Transactions are begun below.
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin(conn):
+            # Takes the write lock up front, waiting up to busy_timeout
+            # for it, so concurrent writers queue instead of failing.
+            # Statements run outside a transaction, like engine.connect()
+            # reads, begin none and take no lock.
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        engine = create_engine(url, pool_size=pool_size,
+                               max_overflow=max_overflow,
+                               pool_recycle=pool_recycle,
+                               pool_pre_ping=pool_pre_ping, echo=echo)
+    _pooled_engines.add(engine)
+    return engine
+
+
+def get_engine(url=None, **kwargs):
+    """
+    Returns the engine of a database, creating it and bringing the schema
+    up to date on the first call for its URL.
+    :param url: SQLAlchemy database URL, by default DATABASE_URL
+    :param kwargs: make_engine options, used on the first call
+    :return: SQLAlchemy engine
+    """
+    url = url or DATABASE_URL
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = make_engine(url, **kwargs)
+            _engines[url] = engine
+        if url not in _migrated:
+            _migrate(engine)
+            _migrated.add(url)
+    return engine
+
+
+def _migrate(engine, attempts=5):
+    """
+    Migrates a database that workers starting together may be migrating
+    too: when one creates a table or index between another's check and its
+    CREATE, the other fails and checks again.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            migrate(engine)
+            return
+        except exc.DBAPIError as e:
+            if attempt == attempts:
+                raise
+            log.info('Schema changed while migrating, checking again: '
+                     '{}'.format(e.orig))
+            time.sleep(random.uniform(0.1, 1.0))
+
+
+def _scope():
+    # Thread-local sessions, and a fresh one in a forked process even on
+    # the thread that forked
+    return os.getpid(), threading.get_ident()
+
+
+def make_scoped_session(engine=None):
+    """
+    :param engine: SQLAlchemy engine, by default get_engine()
+    :return: a scoped_session registry giving each thread of each process
+             its own session; call remove() when a thread is done with it
+    """
+    return scoped_session(sessionmaker(bind=engine or get_engine()),
+                          scopefunc=_scope)
+
+
+@contextmanager
+def session_scope(engine=None):
+    """
+    A session for a unit of work, committed at the end, or rolled back if
+    it raises, and closed either way. Safe in thread and process pools, as
+    each call has its own session.
+    :param engine: SQLAlchemy engine, by default get_engine()
+    :return: context manager yielding a session
+    """
+    session = Session(bind=engine or get_engine())
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
 
-def prepare_db_session():
+def prepare_db_session(url=None, **kwargs):
     """
     Prepares the database.
+    :param url: SQLAlchemy database URL, by default DATABASE_URL
+    :param kwargs: make_engine options, used on the first call for <url>
     :return: SQLAlchemy session
     """
-    # engine = create_engine("sqlite:///{}".format(DATABASE_PATH))
-    engine = create_engine(MYSQL_DB_URL)
-    Base.metadata.bind = engine
-    Base.metadata.create_all()
-    Session.configure(bind=engine)
-    session = Session()
-    return session
+    return Session(bind=get_engine(url, **kwargs))
 
 
 if __name__ == '__main__':
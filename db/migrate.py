@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Brings databases created by older versions up to the current schema
+
+import argparse
+from db.models import *
+import logging
+from sqlalchemy import Column, Float, MetaData, String, Table, bindparam, \
+    inspect, select
+from sqlalchemy.exc import IntegrityError
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+ENTITY_MODELS = (Title, Company, School, Certification, Skill)
+
+NATURAL_KEYS = 'natural_keys'
+
+# Data migrations done once per database, recorded in their own metadata
+# so that code walking the tables of the models never sees them
+metadata = MetaData()
+
+migrations = Table(
+    'migrations', metadata,
+    Column('name', String(64), primary_key=True),
+    Column('applied', Float, nullable=False),
+)
+
+
+def is_applied(engine, name):
+    """
+    :param engine: SQLAlchemy engine
+    :param name: name of a data migration
+    :return: whether <name> was recorded as done in this database
+    """
+    metadata.create_all(engine)
+    with engine.connect() as conn:
+        return conn.execute(select([migrations.c.name]).where(
+            migrations.c.name == name)).first() is not None
+
+
+def mark_applied(engine, name):
+    """
+    Records a data migration as done, so later starts skip it.
+    :param engine: SQLAlchemy engine
+    :param name: name of a data migration
+    :return: None
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(migrations.insert().values(name=name,
+                                                    applied=time.time()))
+    except IntegrityError:
+        # Another process finished the same migration meanwhile
+        pass
+
+
+def upgrade_schema(engine):
+    """
+    Adds the columns and indexes of the models that tables created by
+    older versions lack. create_all() only creates missing tables.
+    :param engine: SQLAlchemy engine
+    :return: None
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            log.info('Adding column {}.{}.'.format(table.name, column.name))
+            engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                table.name, column.name, column_type))
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                log.info('Creating index {}.'.format(index.name))
+                index.create(engine)
+
+
+def references(table):
+    """
+    :param table: a Table of Base.metadata
+    :return: list of (table, column) of the foreign keys to <table>
+    """
+    return [(child, fk.parent)
+            for child in Base.metadata.sorted_tables
+            for fk in child.foreign_keys if fk.column.table is table]
+
+
+def backfill_natural_keys(engine, model, chunk_size=1000):
+    """
+    Sets the natural key of the rows of an entity table that lack one.
+    Rows with the key of an earlier row are duplicates the old (name, url)
+    lookup let through: references to them are moved to the earlier row
+    and they are deleted.
+    :param engine: SQLAlchemy engine
+    :param model: entity class
+    :param chunk_size: rows per transaction
+    :return: (rows keyed, duplicate rows merged)
+    """
+    table = model.__table__
+    refs = references(table)
+    with engine.connect() as conn:
+        if conn.execute(select([table.c.id]).where(
+                table.c.natural_key.is_(None)).limit(1)).first() is None:
+            return 0, 0
+        keys = {key: id_ for id_, key in conn.execute(
+            select([table.c.id, table.c.natural_key]).where(
+                table.c.natural_key.isnot(None)))}
+    set_key = table.update().where(table.c.id == bindparam('row_id')) \
+        .values(natural_key=bindparam('key'))
+    moves = [child.update().where(column == bindparam('dup_id'))
+             .values({column.name: bindparam('keep_id')})
+             for child, column in refs]
+    delete = table.delete().where(table.c.id == bindparam('dup_id'))
+    keyed = merged = 0
+    last = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select([table.c.id, table.c.name,
+                                        table.c.url]).where(
+                table.c.natural_key.is_(None)).where(
+                table.c.id > last).order_by(table.c.id).limit(
+                chunk_size)).fetchall()
+            if not rows:
+                break
+            last = rows[-1].id
+            updates = []
+            duplicates = []
+            for id_, name, url in rows:
+                key = natural_key(name, url)
+                keep = keys.get(key)
+                if keep is None:
+                    keys[key] = id_
+                    updates.append({'row_id': id_, 'key': key})
+                else:
+                    duplicates.append({'dup_id': id_, 'keep_id': keep})
+            if duplicates:
+                for move in moves:
+                    conn.execute(move, duplicates)
+                conn.execute(delete, duplicates)
+            if updates:
+                conn.execute(set_key, updates)
+            keyed += len(updates)
+            merged += len(duplicates)
+    return keyed, merged
+
+
+def migrate(engine):
+    """
+    Creates missing tables, columns and indexes, and fills in the natural
+    keys of entities once per database. Safe to run on every start: once a
+    database is up to date it only inspects it.
+    :param engine: SQLAlchemy engine
+    :return: None
+    """
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    if is_applied(engine, NATURAL_KEYS):
+        return
+    for model in ENTITY_MODELS:
+        keyed, merged = backfill_natural_keys(engine, model)
+        if keyed or merged:
+            log.info('{}: keyed {} rows, merged {} duplicates.'.format(
+                model.__tablename__, keyed, merged))
+    mark_applied(engine, NATURAL_KEYS)
+
+
+def main():
+    """
+    Driver method.
+    """
+    # Imported here, as db.driver imports this module
+    from db.driver import DATABASE_URL, make_engine
+    arg_parser = argparse.ArgumentParser(
+        description='Upgrades a database to the current schema.')
+    arg_parser.add_argument('--db', default=DATABASE_URL,
+                            help='database URL, default $DATABASE_URL, '
+                                 '$LOCAL_MYSQL or a SQLite file')
+    args = arg_parser.parse_args()
+
+    migrate(make_engine(args.db))
+
+
+if __name__ == '__main__':
+    main()
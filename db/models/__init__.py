@@ -1,4 +1,4 @@
-from .base import Base
+from .base import Base, EntityMixin, natural_key
 from .certification import Certification
 from .company import Company
 from .person import Person
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.ext.declarative import declarative_base
+import hashlib
+import json
+from sqlalchemy import Column, Index, Integer, String, select
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import object_mapper
 
 
@@ -42,3 +44,116 @@ class RepresentableBase(object):
 
 
 Base = declarative_base(cls=RepresentableBase)
+
+
+def natural_key(name, url):
+    """
+    Identifies an entity by its name and URL. Unlike a (name, url) index,
+    the key fits a unique index on any database, whatever the length of
+    the name, and is equal for two entities with the same name and no URL.
+    :param name: str
+    :param url: str or None
+    :return: SHA-1 hex digest
+    """
+    data = json.dumps([name, url], ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _natural_key_default(context):
+    params = context.get_current_parameters()
+    return natural_key(params.get('name'), params.get('url'))
+
+
+def _insert_missing(session, table, rows):
+    """
+    Inserts the rows whose natural key is not taken yet, in one statement
+    that cannot fail on a key another transaction inserted first.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        # A no-op update; unlike INSERT IGNORE, it keeps other errors
+        statement = statement.on_duplicate_key_update(
+            natural_key=statement.inserted.natural_key)
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=['natural_key'])
+    else:
+        # No native upsert: not safe against concurrent writers
+        keys = [row['natural_key'] for row in rows]
+        taken = {key for key, in session.execute(select(
+            [table.c.natural_key]).where(table.c.natural_key.in_(keys)))}
+        rows = [row for row in rows if row['natural_key'] not in taken]
+        if not rows:
+            return
+        statement = table.insert().values(rows)
+    session.execute(statement)
+
+
+class EntityMixin(object):
+    """
+    The natural key of the entities profiles refer to by (name, url):
+    titles, companies, schools, certifications and skills. It is filled in
+    on INSERT, through the ORM or not.
+    """
+
+    natural_key = Column(String(40), default=_natural_key_default)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (Index('{}_natural_key'.format(cls.__tablename__),
+                      'natural_key', unique=True),)
+
+    @classmethod
+    def resolve_ids(cls, session, keys, chunk_size=300):
+        """
+        Finds or creates entities, in two statements per chunk whatever its
+        size: an upsert of all of them, native to the database, and a
+        SELECT of their ids. Processes writing the same database at the
+        same time get the same ids, never duplicate rows; on SQLite, only
+        through engines from db.driver.make_engine, whose transactions
+        hold the write lock from the start.
+        :param session: an active SQLAlchemy session
+        :param keys: iterable of (name, url)
+        :param chunk_size: entities per statement
+        :return: dict from (name, url) to id
+        """
+        table = cls.__table__
+        # Entities are inserted in the order of <keys>
+        by_key = {natural_key(name, url): (name, url)
+                  for name, url in dict.fromkeys(keys)}
+        digests = list(by_key)
+        ids = {}
+        for i in range(0, len(digests), chunk_size):
+            chunk = digests[i:i + chunk_size]
+            _insert_missing(session, table, [
+                {'name': by_key[key][0], 'url': by_key[key][1],
+                 'natural_key': key} for key in chunk])
+            # A locking read sees rows committed after this transaction's
+            # snapshot, which a plain SELECT on MySQL would not
+            query = select([table.c.natural_key, table.c.id]).where(
+                table.c.natural_key.in_(chunk)).with_for_update(read=True)
+            for key, id_ in session.execute(query):
+                ids[by_key[key]] = id_
+        return ids
+
+    @classmethod
+    def get_or_create(cls, session, name=None, url=None):
+        """
+        Finds or creates an entity like resolve_ids, in two statements: the
+        upsert, and a locking SELECT that loads the instance.
+        :param session: an active SQLAlchemy session
+        :param name: str
+        :param url: str or None
+        :return: a <cls> object
+        """
+        key = natural_key(name, url)
+        _insert_missing(session, cls.__table__,
+                        [{'name': name, 'url': url, 'natural_key': key}])
+        return session.query(cls).filter(cls.natural_key == key) \
+            .with_for_update(read=True).one()
@@ -1,9 +1,9 @@
 from sqlalchemy import Column
 from sqlalchemy.orm import relationship
-from db.models.base import Base
+from db.models.base import Base, EntityMixin
 
 
-class Certification(Base):
+class Certification(EntityMixin, Base):
     """
     Representing a professional certification on LinkedIn
     """
@@ -1,9 +1,9 @@
 from sqlalchemy import Column
 from sqlalchemy.orm import relationship
-from db.models.base import Base
+from db.models.base import Base, EntityMixin
 
 
-class Company(Base):
+class Company(EntityMixin, Base):
     """
     Representing a company on LinkedIn
     """
@@ -13,3 +13,4 @@ class Company(Base):
     url = Column(Base.ShortString, index=True)
 
     experiences = relationship('PersonExperience', back_populates='company')
+    certifications = relationship('PersonCertification', back_populates='company')
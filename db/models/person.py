@@ -1,4 +1,4 @@
-from sqlalchemy import Column
+from sqlalchemy import Column, Index, String
 from sqlalchemy.orm import relationship
 from db.models.base import Base
 
@@ -8,11 +8,16 @@ class Person(Base):
     Representing a person of our research interest.
     """
     __tablename__ = 'people'
+    __table_args__ = (Index('people_url', 'url', unique=True),)
 
     name = Column(Base.String)
     headline = Column(Base.String)
     locality = Column(Base.String)
     meta = Column(Base.String)
+    # Canonical profile URL and SHA-1 of the page last parsed, so that
+    # parsing a page again updates the person instead of adding another
+    url = Column(Base.ShortString)
+    content_hash = Column(String(40))
 
     experiences = relationship('PersonExperience', back_populates='person')
     educations = relationship('PersonEducation', back_populates='person')
@@ -9,9 +9,9 @@ class PersonCertification(Base):
     """
     __tablename__ = 'person_certifications'
 
-    person_id = Column(Integer, ForeignKey('people.id'), nullable=False)
-    certification_id = Column(Integer, ForeignKey('certifications.id'))
-    company_id = Column(Integer, ForeignKey('companies.id'))
+    person_id = Column(Integer, ForeignKey('people.id'), nullable=False, index=True)
+    certification_id = Column(Integer, ForeignKey('certifications.id'), index=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), index=True)
     title = Column(Base.String)
     start_date = Column(Date)
     end_date = Column(Date)
@@ -19,3 +19,4 @@ class PersonCertification(Base):
 
     person = relationship('Person', back_populates='certifications')
     certification = relationship('Certification', back_populates='certifications')
+    company = relationship('Company', back_populates='certifications')
@@ -9,8 +9,8 @@ class PersonEducation(Base):
     """
     __tablename__ = 'person_educations'
 
-    person_id = Column(Integer, ForeignKey('people.id'), nullable=False)
-    school_id = Column(Integer, ForeignKey('schools.id'))
+    person_id = Column(Integer, ForeignKey('people.id'), nullable=False, index=True)
+    school_id = Column(Integer, ForeignKey('schools.id'), index=True)
     degree = Column(Base.String)
     start_date = Column(Date)
     end_date = Column(Date)
@@ -9,9 +9,9 @@ class PersonExperience(Base):
     """
     __tablename__ = 'person_experiences'
 
-    person_id = Column(Integer, ForeignKey('people.id'), nullable=False)
-    title_id = Column(Integer, ForeignKey('titles.id'))
-    company_id = Column(Integer, ForeignKey('companies.id'))
+    person_id = Column(Integer, ForeignKey('people.id'), nullable=False, index=True)
+    title_id = Column(Integer, ForeignKey('titles.id'), index=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), index=True)
     start_date = Column(Date)
     end_date = Column(Date)
     description = Column(Text)
@@ -9,8 +9,8 @@ class PersonSkill(Base):
     """
     __tablename__ = 'person_skills'
 
-    person_id = Column(Integer, ForeignKey('people.id'), nullable=False)
-    skill_id = Column(Integer, ForeignKey('skills.id'))
+    person_id = Column(Integer, ForeignKey('people.id'), nullable=False, index=True)
+    skill_id = Column(Integer, ForeignKey('skills.id'), index=True)
 
     person = relationship('Person', back_populates='skills')
     skill = relationship('Skill', back_populates='skills')
@@ -1,9 +1,9 @@
 from sqlalchemy import Column
 from sqlalchemy.orm import relationship
-from db.models.base import Base
+from db.models.base import Base, EntityMixin
 
 
-class School(Base):
+class School(EntityMixin, Base):
     """
     Representing a school on LinkedIn
     """
@@ -1,9 +1,9 @@
 from sqlalchemy import Column
 from sqlalchemy.orm import relationship
-from db.models.base import Base
+from db.models.base import Base, EntityMixin
 
 
-class Skill(Base):
+class Skill(EntityMixin, Base):
     """
     Representing a professional skill on LinkedIn
     """
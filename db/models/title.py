@@ -1,9 +1,9 @@
 from sqlalchemy import Column
 from sqlalchemy.orm import relationship
-from db.models.base import Base
+from db.models.base import Base, EntityMixin
 
 
-class Title(Base):
+class Title(EntityMixin, Base):
     """
     Representing a title of a job on LinkedIn
     """
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# Durable task queue shared by workers on several hosts
+
+from db.driver import make_engine
+import json
+import logging
+import os
+import socket
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, \
+    Table, Text, UniqueConstraint, and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+import time
+import uuid
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+QUEUE_DB_URL = os.getenv('QUEUE_DB_URL')
+QUEUE_PATH = '../tmp/queue.sqlite3'
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# The queue has its own metadata, so it can live in the profile database
+# or in a separate one without either creating the other's tables
+metadata = MetaData()
+
+tasks = Table(
+    'tasks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('queue', String(64), nullable=False),
+    # Optional name of the task, unique per queue, so enqueueing the same
+    # work twice adds it once
+    Column('key', String(255)),
+    Column('payload', Text, nullable=False),
+    Column('status', String(16), nullable=False),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('available_at', Float, nullable=False),
+    Column('lease_owner', String(255)),
+    Column('lease_token', String(32)),
+    Column('lease_expires', Float),
+    Column('result', Text),
+    Column('error', Text),
+    Column('created', Float, nullable=False),
+    Column('updated', Float, nullable=False),
+    UniqueConstraint('queue', 'key', name='tasks_queue_key'),
+    Index('tasks_claim', 'queue', 'status', 'available_at'),
+)
+
+# Queues no worker claims from until a time, e.g. while a quota they need
+# is used up
+pauses = Table(
+    'queue_pauses', metadata,
+    Column('queue', String(64), primary_key=True),
+    Column('paused_until', Float, nullable=False),
+    Column('reason', Text),
+)
+
+
+def make_queue_engine(url=None):
+    """
+    :param url: SQLAlchemy database URL; by default $QUEUE_DB_URL, or
+                SQLite at QUEUE_PATH
+    :return: SQLAlchemy engine
+    """
+    # On SQLite, workers in several processes wait for each other's writes
+    # instead of failing with "database is locked", and in WAL mode claims
+    # do not block on readers
+    return make_engine(url or QUEUE_DB_URL or
+                       'sqlite:///{}'.format(QUEUE_PATH))
+
+
+def default_owner():
+    """
+    :return: name of this worker process, 'host:pid'
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeasedTask(object):
+    """
+    A task claimed by a worker. The lease token identifies this claim: once
+    the lease expires and another worker claims the task, heartbeats and
+    results of the first claim are refused.
+    """
+
+    def __init__(self, id_, queue, key, payload, attempts, token):
+        self.id = id_
+        self.queue = queue
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+        self.token = token
+
+    def __repr__(self):
+        return '<LeasedTask {} {}:{} attempt {}>'.format(
+            self.id, self.queue, self.key, self.attempts)
+
+
+class TaskQueue(object):
+    """
+    A task queue in a SQL table. A claimed task is leased to its worker for
+    <visibility_timeout> seconds; the worker renews the lease with
+    heartbeats while it works. A task whose lease runs out, because its
+    worker crashed or hangs, becomes visible again and is claimed by
+    another worker, up to <max_attempts> claims in all.
+
+    Claims are optimistic: a worker picks candidate rows and takes one with
+    an UPDATE conditioned on the row still being claimable, so it works the
+    same on MySQL and on SQLite without row locks.
+
+    A queue can be paused for all workers at once, e.g. when one of them
+    finds the search quota used up.
+    """
+
+    def __init__(self, engine, visibility_timeout=300.0, max_attempts=5):
+        """
+        :param engine: SQLAlchemy engine, e.g. from make_queue_engine
+        :param visibility_timeout: seconds a lease lasts without heartbeats
+        :param max_attempts: claims of a task before it is failed for good
+        """
+        self.engine = engine
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        metadata.create_all(engine)
+
+    def put(self, queue, payload, key=None, delay=0.0):
+        """
+        :param queue: name of the queue, e.g. 'download'
+        :param payload: JSON-serializable task description
+        :param key: name of the task, or None
+        :param delay: seconds before the task may be claimed
+        :return: whether the task was added, False if <key> is taken
+        """
+        return self.put_many(queue, [(payload, key)], delay) == 1
+
+    def put_many(self, queue, items, delay=0.0, batch_size=500):
+        """
+        :param queue: name of the queue
+        :param items: iterable of (payload, key or None), read lazily
+        :param delay: seconds before the tasks may be claimed
+        :param batch_size: tasks per transaction
+        :return: number of tasks added
+        """
+        added = 0
+        items = iter(items)
+        while True:
+            batch = [item for _, item in zip(range(batch_size), items)]
+            if not batch:
+                return added
+            while True:
+                try:
+                    with self.engine.begin() as conn:
+                        added += self._put_many(conn, queue, batch, delay)
+                    break
+                except IntegrityError:
+                    # Another process added some of the keys meanwhile;
+                    # they are found and skipped on the next try
+                    log.info('Retrying a batch of {} tasks.'.format(queue))
+
+    def _put_many(self, conn, queue, items, delay):
+        """
+        Inserts tasks whose key is not in the queue yet, in the
+        transaction of <conn>.
+        :return: number of tasks added
+        """
+        keys = {key for _, key in items if key is not None}
+        taken = set()
+        if keys:
+            query = select([tasks.c.key]).where(
+                and_(tasks.c.queue == queue, tasks.c.key.in_(keys)))
+            taken = {key for key, in conn.execute(query)}
+        now = time.time()
+        rows = []
+        for payload, key in items:
+            if key is not None:
+                if key in taken:
+                    continue
+                taken.add(key)
+            rows.append({'queue': queue, 'key': key,
+                         'payload': json.dumps(payload), 'status': PENDING,
+                         'attempts': 0, 'available_at': now + delay,
+                         'created': now, 'updated': now})
+        if rows:
+            conn.execute(tasks.insert(), rows)
+        return len(rows)
+
+    def _claimable(self, queue, now):
+        return and_(tasks.c.queue == queue,
+                    or_(and_(tasks.c.status == PENDING,
+                             tasks.c.available_at <= now),
+                        and_(tasks.c.status == LEASED,
+                             tasks.c.lease_expires < now)))
+
+    def _reap(self, conn, queue, now):
+        """
+        Fails the tasks whose last allowed lease ran out.
+        """
+        result = conn.execute(tasks.update().where(and_(
+            tasks.c.queue == queue, tasks.c.status == LEASED,
+            tasks.c.lease_expires < now,
+            tasks.c.attempts >= self.max_attempts)).values(
+                status=FAILED, lease_token=None, updated=now,
+                error='Lease expired on the last attempt'))
+        if result.rowcount:
+            log.warning('{} {} tasks failed after their last lease '
+                        'expired.'.format(result.rowcount, queue))
+
+    def pause(self, queue, delay, reason=None):
+        """
+        Stops every worker from claiming tasks of a queue for <delay>
+        seconds, replacing any earlier pause of it.
+        :param queue: name of the queue
+        :param delay: seconds until tasks may be claimed again
+        :param reason: why the queue is paused, for the logs
+        :return: None
+        """
+        until = time.time() + delay
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(pauses.delete().where(pauses.c.queue == queue))
+                conn.execute(pauses.insert().values(
+                    queue=queue, paused_until=until, reason=reason))
+        except IntegrityError:
+            # Another worker paused it at the same time
+            pass
+        log.warning('Paused {} for {:.0f} s: {}'.format(queue, delay,
+                                                        reason))
+
+    def resume(self, queue):
+        """
+        Lifts the pause of a queue.
+        :param queue: name of the queue
+        :return: None
+        """
+        with self.engine.begin() as conn:
+            conn.execute(pauses.delete().where(pauses.c.queue == queue))
+
+    def paused(self, queues, now=None):
+        """
+        :param queues: names of queues
+        :param now: the current time, by default time.time()
+        :return: {queue: time the pause ends} of the paused <queues>
+        """
+        now = time.time() if now is None else now
+        query = select([pauses.c.queue, pauses.c.paused_until]).where(and_(
+            pauses.c.queue.in_(queues), pauses.c.paused_until > now))
+        with self.engine.connect() as conn:
+            return dict(conn.execute(query).fetchall())
+
+    def claim(self, queues, owner=None, candidates=16):
+        """
+        Claims the oldest claimable task of the first queue that has one,
+        skipping paused queues.
+        :param queues: names of queues, in order of preference
+        :param owner: name of the worker, by default default_owner()
+        :param candidates: rows read per attempt; more rows make it less
+                           likely that other workers take all of them
+        :return: a LeasedTask, or None if every queue is empty or paused
+        """
+        owner = owner or default_owner()
+        paused = self.paused(queues)
+        for queue in queues:
+            if queue in paused:
+                continue
+            while True:
+                now = time.time()
+                with self.engine.begin() as conn:
+                    self._reap(conn, queue, now)
+                    query = select([tasks.c.id]).where(
+                        self._claimable(queue, now)).order_by(
+                            tasks.c.id).limit(candidates)
+                    ids = [id_ for id_, in conn.execute(query)]
+                if not ids:
+                    break
+                for id_ in ids:
+                    task = self._take(queue, id_, owner, now)
+                    if task is not None:
+                        return task
+                # Other workers took every candidate; look again
+        return None
+
+    def _take(self, queue, id_, owner, now):
+        """
+        :return: a LeasedTask if task <id_> was still claimable, else None
+        """
+        token = uuid.uuid4().hex
+        with self.engine.begin() as conn:
+            result = conn.execute(tasks.update().where(and_(
+                tasks.c.id == id_, self._claimable(queue, now))).values(
+                    status=LEASED, lease_owner=owner, lease_token=token,
+                    lease_expires=now + self.visibility_timeout,
+                    attempts=tasks.c.attempts + 1, updated=now))
+            if result.rowcount != 1:
+                return None
+            row = conn.execute(select([tasks.c.key, tasks.c.payload,
+                                       tasks.c.attempts]).where(
+                tasks.c.id == id_)).first()
+        return LeasedTask(id_, queue, row.key, json.loads(row.payload),
+                          row.attempts, token)
+
+    def _owned(self, task):
+        return and_(tasks.c.id == task.id, tasks.c.status == LEASED,
+                    tasks.c.lease_token == task.token)
+
+    def heartbeat(self, task):
+        """
+        Renews the lease of a task.
+        :param task: a LeasedTask
+        :return: whether the lease is still held; False means the task was
+                 given to another worker and its result will be refused
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            result = conn.execute(tasks.update().where(
+                self._owned(task)).values(
+                    lease_expires=now + self.visibility_timeout,
+                    updated=now))
+        return result.rowcount == 1
+
+    def complete(self, task, result=None, follow_ups=()):
+        """
+        Marks a task done and enqueues the tasks it leads to, in one
+        transaction, so a crash never loses or duplicates the hand-over.
+        Follow-ups whose key is taken are skipped; if another worker adds
+        the same key at the same time, IntegrityError is raised and nothing
+        changes.
+        :param task: a LeasedTask
+        :param result: JSON-serializable result to keep, or None
+        :param follow_ups: iterable of (queue, payload, key or None)
+        :return: whether the lease was still held; if not, nothing changes
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            updated = conn.execute(tasks.update().where(
+                self._owned(task)).values(
+                    status=DONE, lease_token=None, updated=now,
+                    result=None if result is None else json.dumps(result)))
+            if updated.rowcount != 1:
+                log.warning('Lease of {} lost; result dropped.'.format(task))
+                return False
+            for queue, payload, key in follow_ups:
+                self._put_many(conn, queue, [(payload, key)], 0.0)
+        return True
+
+    def fail(self, task, error, delay=0.0, retry=True):
+        """
+        Returns a task to its queue after <delay> seconds, or fails it for
+        good once it had <max_attempts> attempts.
+        :param task: a LeasedTask
+        :param error: description of the error
+        :param delay: seconds before the task may be claimed again
+        :param retry: False to fail the task for good at once
+        :return: whether the task will be retried
+        """
+        now = time.time()
+        retry = retry and task.attempts < self.max_attempts
+        values = {'lease_token': None, 'error': error, 'updated': now}
+        if retry:
+            values.update(status=PENDING, available_at=now + delay)
+        else:
+            values.update(status=FAILED)
+        with self.engine.begin() as conn:
+            conn.execute(tasks.update().where(self._owned(task)).values(
+                **values))
+        return retry
+
+    def release(self, task, delay=0.0):
+        """
+        Returns a task to its queue without counting the attempt, e.g. when
+        the worker stops or runs out of quota before doing it.
+        :param task: a LeasedTask
+        :param delay: seconds before the task may be claimed again
+        :return: None
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(tasks.update().where(self._owned(task)).values(
+                status=PENDING, lease_token=None, available_at=now + delay,
+                attempts=tasks.c.attempts - 1, updated=now))
+
+    def retry_failed(self, queue):
+        """
+        Returns the failed tasks of a queue to it, with fresh attempts.
+        :return: number of tasks returned
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            result = conn.execute(tasks.update().where(and_(
+                tasks.c.queue == queue, tasks.c.status == FAILED)).values(
+                    status=PENDING, attempts=0, available_at=now,
+                    updated=now))
+        return result.rowcount
+
+    def counts(self):
+        """
+        :return: {queue: {status: number of tasks}}
+        """
+        query = select([tasks.c.queue, tasks.c.status,
+                        func.count()]).group_by(tasks.c.queue,
+                                                tasks.c.status)
+        counts = {}
+        with self.engine.connect() as conn:
+            for queue, status, n in conn.execute(query):
+                counts.setdefault(queue, {})[status] = n
+        return counts
+
+    def idle(self, queues):
+        """
+        :return: whether <queues> hold no pending or leased tasks; pending
+                 tasks of paused queues do not count, as no worker can
+                 claim them yet
+        """
+        paused = list(self.paused(queues))
+        query = select([func.count()]).where(and_(
+            tasks.c.queue.in_(queues),
+            or_(tasks.c.status == LEASED,
+                and_(tasks.c.status == PENDING,
+                     tasks.c.queue.notin_(paused)))))
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar() == 0
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# Batched bulk-insert writer for parsed profiles
+
+from db.models import *
+import logging
+from parsing.loader import PROFILE_MODELS, delete_profile_rows
+import random
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import OperationalError
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Times a transaction is written again when another one held the lock it
+# needed for longer than the database waits, and the cap of the delay
+# before writing it again, in seconds
+LOCK_RETRIES = 8
+MAX_LOCK_DELAY = 30.0
+
+
+def is_lock_error(exc):
+    """
+    :param exc: an exception raised by a statement
+    :return: whether another transaction held a lock the statement needed,
+             so that running the transaction again may succeed
+    """
+    if not isinstance(exc, OperationalError):
+        return False
+    code = exc.orig.args[0] if exc.orig.args else None
+    # MySQL: lock wait timeout exceeded, deadlock found
+    return code in (1205, 1213) or 'database is locked' in str(exc.orig)
+
+
+class BatchWriter(object):
+    """
+    Writes parsed profiles to the database N profiles at a time.
+
+    Each batch is written inside a savepoint with one multi-row INSERT per
+    table. People already in the database, by URL, are updated with one
+    executemany and the rest of their profile replaced. If a batch fails,
+    it is rolled back and its profiles are written one by one, so that a
+    bad profile only loses itself. If another process holds the database
+    lock for longer than the database waits, the transaction is rolled
+    back and its batches written again after a backoff, instead of failing
+    profiles.
+    """
+
+    def __init__(self, session, cache, batch_size=100, commit_interval=10):
+        """
+        :param session: an active SQLAlchemy session
+        :param cache: an EntityCache
+        :param batch_size: number of profiles per INSERT batch
+        :param commit_interval: number of batches per commit
+        """
+        self.session = session
+        self.cache = cache
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.written = 0
+        self.failed = 0
+        self._batch = []
+        self._ids = {}
+        # Batches since the last commit, and how many of them are written
+        self._uncommitted = []
+        self._uncommitted_written = 0
+        # (written, failed) at the last commit
+        self._committed = (0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def add(self, profile):
+        """
+        Queues a profile, writing the batch once it is full.
+        :param profile: a ProfileRecord
+        :return: None
+        """
+        self._batch.append(profile)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the queued profiles.
+        :return: None
+        """
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self._uncommitted.append(batch)
+        self._retry_locked()
+        if len(self._uncommitted) >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """
+        Commits everything written so far.
+        :return: None
+        """
+        self._retry_locked(self.session.commit)
+        self.cache.sync()
+        self._uncommitted = []
+        self._uncommitted_written = 0
+        self._committed = (self.written, self.failed)
+
+    def close(self):
+        """
+        Writes the remaining profiles and commits.
+        :return: None
+        """
+        self.flush()
+        self.commit()
+        log.info('Wrote {} profiles, {} failed.'.format(
+            self.written, self.failed))
+
+    def _retry_locked(self, then=None):
+        """
+        Writes the batches of the transaction not written yet, then calls
+        <then>. On a lock error, rolls the transaction back, waits with
+        exponential backoff and full jitter, and writes all its batches
+        again, up to LOCK_RETRIES times.
+        :param then: function to call once the batches are written
+        :return: None
+        """
+        for attempt in range(1, LOCK_RETRIES + 1):
+            try:
+                while self._uncommitted_written < len(self._uncommitted):
+                    self._write_batch(
+                        self._uncommitted[self._uncommitted_written])
+                    self._uncommitted_written += 1
+                if then is not None:
+                    then()
+                return
+            except OperationalError as e:
+                if not is_lock_error(e) or attempt == LOCK_RETRIES:
+                    raise
+                self.session.rollback()
+                self.cache.rollback()
+                self.written, self.failed = self._committed
+                self._uncommitted_written = 0
+                delay = random.uniform(0, min(MAX_LOCK_DELAY, 2 ** attempt))
+                log.warning('[Batch] {}, writing {} batches again in '
+                            '{:.1f} s'.format(e.orig, len(self._uncommitted),
+                                              delay))
+                time.sleep(delay)
+
+    def _write_batch(self, batch):
+        checkpoint = self.cache.checkpoint()
+        try:
+            with self.session.begin_nested():
+                self._write(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.cache.rollback(checkpoint)
+            if is_lock_error(e):
+                raise
+            log.error('[Batch] {}, retrying row by row'.format(e))
+            for profile in batch:
+                self._write_one(profile)
+
+    def _write_one(self, profile):
+        checkpoint = self.cache.checkpoint()
+        try:
+            with self.session.begin_nested():
+                self._write([profile])
+            self.written += 1
+        except Exception as e:
+            self.cache.rollback(checkpoint)
+            if is_lock_error(e):
+                raise
+            self.failed += 1
+            log.error('[Batch] Skipped profile {}: {}'.format(
+                profile.person.meta, e))
+
+    def _write(self, batch):
+        """
+        Inserts a list of profiles with one statement per table.
+        """
+        batch = self._dedupe(batch)
+        self._resolve_entities(batch)
+        existing = self._existing_people(batch)
+        if existing:
+            delete_profile_rows(self.session, list(existing.values()))
+        person_ids = self._write_people(batch, existing)
+        rows = {model: [] for model in PROFILE_MODELS}
+        for profile, person_id in zip(batch, person_ids):
+            self._add_profile_rows(rows, profile, person_id)
+        for model, model_rows in rows.items():
+            if model_rows:
+                self.session.execute(model.__table__.insert(), model_rows)
+
+    @staticmethod
+    def _dedupe(batch):
+        """
+        :return: <batch> without the profiles whose page is listed again
+                 later in it, as the last copy would overwrite them
+        """
+        last = {profile.person.url: i for i, profile in enumerate(batch)}
+        return [profile for i, profile in enumerate(batch)
+                if profile.person.url is None or
+                last[profile.person.url] == i]
+
+    def _add_profile_rows(self, rows, profile, person_id):
+        """
+        Adds the rows of the experiences, educations, certifications and
+        skills of a profile to <rows>.
+        :param rows: {model: list of row dicts}, for PROFILE_MODELS
+        :param profile: a ProfileRecord
+        :param person_id: id of the person
+        :return: None
+        """
+        for exp in profile.experiences:
+            rows[PersonExperience].append({
+                'person_id': person_id,
+                'title_id': self._entity_id(Title, exp.title),
+                'company_id': self._entity_id(Company, exp.company),
+                'start_date': exp.start_date,
+                'end_date': exp.end_date,
+                'description': exp.description})
+        for edu in profile.educations:
+            rows[PersonEducation].append({
+                'person_id': person_id,
+                'school_id': self._entity_id(School, edu.school),
+                'degree': edu.degree,
+                'start_date': edu.start_date,
+                'end_date': edu.end_date,
+                'description': edu.description})
+        for pc in profile.certifications:
+            rows[PersonCertification].append({
+                'person_id': person_id,
+                'certification_id': self._entity_id(Certification,
+                                                    pc.certification),
+                'company_id': self._entity_id(Company, pc.company),
+                'start_date': pc.start_date,
+                'end_date': pc.end_date,
+                'description': pc.description})
+        for ps in profile.skills:
+            rows[PersonSkill].append({
+                'person_id': person_id,
+                'skill_id': self._entity_id(Skill, ps.skill)})
+
+    def _resolve_entities(self, batch):
+        """
+        Resolves the entities of <batch> with one upsert and one SELECT per
+        entity table, instead of one or two statements per entity. The ids
+        are kept for the batch, even if the cache is too small for them.
+        """
+        # Dicts keep the keys in order, so ids are assigned like they were
+        # one entity at a time
+        keys = {model: {} for model in (Title, Company, School,
+                                        Certification, Skill)}
+        for profile in batch:
+            for exp in profile.experiences:
+                keys[Title][exp.title] = None
+                keys[Company][exp.company] = None
+            for edu in profile.educations:
+                keys[School][edu.school] = None
+            for pc in profile.certifications:
+                keys[Certification][pc.certification] = None
+                keys[Company][pc.company] = None
+            for ps in profile.skills:
+                keys[Skill][ps.skill] = None
+        self._ids = {}
+        for model, model_keys in keys.items():
+            model_keys.pop(None, None)
+            self._ids[model] = self.cache.resolve(self.session, model,
+                                                  model_keys)
+
+    def _existing_people(self, batch):
+        """
+        :return: {url: id} of the people of <batch> in the database
+        """
+        urls = [profile.person.url for profile in batch
+                if profile.person.url is not None]
+        if not urls:
+            return {}
+        table = Person.__table__
+        query = select([table.c.url, table.c.id]).where(table.c.url.in_(urls))
+        return dict(self.session.execute(query).fetchall())
+
+    def _write_people(self, batch, existing):
+        """
+        Updates the people of <batch> in the database and inserts the
+        others, with one executemany each, then reads the ids of the new
+        people back by URL with one SELECT.
+        :param batch: list of ProfileRecords, without repeated URLs
+        :param existing: {url: id} of the people in the database
+        :return: list of the ids of the people of <batch>, in order
+        """
+        table = Person.__table__
+        updates = []
+        inserts = []
+        for profile in batch:
+            person = profile.person
+            if person.url in existing:
+                values = self._person_values(person)
+                values['person_id'] = existing[person.url]
+                updates.append(values)
+            elif person.url is not None:
+                inserts.append(self._person_values(person))
+        if updates:
+            self.session.execute(table.update().where(
+                table.c.id == bindparam('person_id')), updates)
+        ids = dict(existing)
+        if inserts:
+            self.session.execute(table.insert(), inserts)
+            query = select([table.c.url, table.c.id]).where(
+                table.c.url.in_([values['url'] for values in inserts]))
+            ids.update(self.session.execute(query).fetchall())
+        person_ids = []
+        for profile in batch:
+            if profile.person.url is None:
+                # Without a URL the person cannot be found again; these
+                # are rare, and inserted one at a time
+                result = self.session.execute(
+                    table.insert(), self._person_values(profile.person))
+                person_ids.append(result.inserted_primary_key[0])
+            else:
+                person_ids.append(ids[profile.person.url])
+        return person_ids
+
+    @staticmethod
+    def _person_values(person):
+        """
+        :param person: a PersonRecord
+        :return: dict of the columns of the person
+        """
+        return {'name': person.name,
+                'headline': person.headline,
+                'locality': person.locality,
+                'meta': person.meta,
+                'url': person.url,
+                'content_hash': person.content_hash}
+
+    def _entity_id(self, model, key):
+        if key is None:
+            return None
+        return self._ids[model][key]
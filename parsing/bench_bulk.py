@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Benchmarks the bulk loader against the batched writer on made-up profiles
+
+import argparse
+import datetime
+from db.cache import EntityCache
+from db.driver import Session, make_engine
+from db.migrate import migrate
+import logging
+import os
+from parsing.batch import BatchWriter
+from parsing.bulk import BULK_CHUNK_SIZE, BULK_PRAGMAS, BulkLoader
+from parsing.records import CertificationRecord, EducationRecord, \
+    ExperienceRecord, PersonRecord, ProfileRecord, SkillRecord
+import random
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+BENCH_PATH = '../tmp/bench_bulk.sqlite3'
+
+
+def make_profiles(n, seed=0):
+    """
+    Makes profiles shaped like parsed ones: three experiences, two
+    educations, a certification and four skills each, among a tenth as
+    many companies as people and a hundredth as many titles and schools.
+    :param n: number of profiles
+    :param seed: random seed
+    :return: generator of ProfileRecord
+    """
+    rng = random.Random(seed)
+
+    def entities(kind, n_kind):
+        # Some entities have no URL, like on LinkedIn
+        return [('{} {}'.format(kind, i), None if i % 3 == 0 else
+                 'https://www.linkedin.com/{}/{}'.format(kind.lower(), i))
+                for i in range(n_kind)]
+
+    companies = entities('Company', max(n // 10, 1))
+    titles = entities('Title', max(n // 100, 1))
+    schools = entities('School', max(n // 100, 1))
+    certifications = entities('Certification', 1000)
+    skills = entities('Skill', 5000)
+    periods = []
+    for _ in range(1000):
+        start = datetime.date(rng.randint(1990, 2015), rng.randint(1, 12), 1)
+        periods.append(
+            (start, start + datetime.timedelta(days=rng.randint(30, 3000))))
+    choice = rng.choice
+
+    for i in range(n):
+        person = PersonRecord(
+            'Person {}'.format(i), 'Engineer at Company {}'.format(i % 97),
+            'Greater Boston Area', 'Person {} | LinkedIn.html'.format(i),
+            'https://www.linkedin.com/in/person-{}'.format(i),
+            '{:040x}'.format(i))
+        yield ProfileRecord(
+            person,
+            [ExperienceRecord(choice(titles), choice(companies),
+                              *choice(periods), 'Worked on things.')
+             for _ in range(3)],
+            [EducationRecord(choice(schools), 'BSc', *choice(periods), None)
+             for _ in range(2)],
+            [CertificationRecord(choice(certifications), choice(companies),
+                                 *choice(periods), None)],
+            [SkillRecord(choice(skills)) for _ in range(4)])
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Loads made-up profiles into a new SQLite database with '
+                    'the bulk loader or the batched writer.')
+    arg_parser.add_argument('--db', default=BENCH_PATH,
+                            help='path of the SQLite file to create')
+    arg_parser.add_argument('--profiles', type=int, default=1000000,
+                            help='profiles to load')
+    arg_parser.add_argument('--writer', choices=['bulk', 'batch'],
+                            default='bulk', help='writer to benchmark')
+    arg_parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                            help='profiles per transaction for bulk, per '
+                                 'INSERT batch for batch')
+    arg_parser.add_argument('--cache-size', type=int, default=100000,
+                            help='entity cache size')
+    args = arg_parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    url = 'sqlite:///{}'.format(args.db)
+    if args.writer == 'bulk':
+        engine = make_engine(url, pragmas=BULK_PRAGMAS)
+    else:
+        engine = make_engine(url)
+    migrate(engine)
+    session = Session(bind=engine)
+    cache = EntityCache(max_size=args.cache_size)
+
+    start = time.perf_counter()
+    if args.writer == 'bulk':
+        writer = BulkLoader(session, cache, chunk_size=args.chunk_size)
+    else:
+        writer = BatchWriter(session, cache, batch_size=args.chunk_size)
+    with writer:
+        for profile in make_profiles(args.profiles):
+            writer.add(profile)
+    seconds = time.perf_counter() - start
+    log.info('{}: {} profiles in {:.1f} s, {:.0f} profiles/s.'.format(
+        args.writer, args.profiles, seconds, args.profiles / seconds))
+    log.info('Entity cache: {}'.format(cache.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# Bulk loader of parsed profiles for offline ingests into SQLite
+
+from db.driver import SQLITE_PRAGMAS
+from db.models import *
+import logging
+from operator import itemgetter
+from parsing.batch import BatchWriter
+from parsing.loader import PROFILE_MODELS
+from sqlalchemy import and_, bindparam, func, select
+import time
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Profiles per transaction
+BULK_CHUNK_SIZE = 10000
+
+# Set after the usual pragmas. Without syncs, a power failure during the
+# load can corrupt the file, which a one-off ingest can afford: it is
+# loaded again. A crash of the process alone loses nothing committed.
+BULK_PRAGMAS = SQLITE_PRAGMAS + (
+    ('synchronous', 'OFF'),
+    # 512 MiB, mostly for sorting when the indexes are created
+    ('cache_size', -512 * 1024),
+)
+
+
+def deferred_indexes():
+    """
+    :return: the indexes of the profile tables, which a bulk load drops
+             and creates again at the end
+    """
+    return [index for model in PROFILE_MODELS
+            for index in model.__table__.indexes]
+
+
+class BulkLoader(BatchWriter):
+    """
+    Loads parsed profiles into a SQLite database, for offline ingests of
+    millions of profiles. It must be the only writer of the database.
+
+    Each chunk of profiles is one transaction, and no ORM objects are
+    created. Ids are assigned here instead of by the database, so people
+    are inserted like the other tables, with one prepared statement the
+    driver runs for all the rows of the chunk, rather than one INSERT per
+    person to learn its id. The indexes of the profile tables are dropped
+    for the load and created at the end, which sorts each column once
+    instead of updating a B-tree for every row.
+
+    People already in the database, by URL, are updated, and the rows of
+    their previous profile deleted once the indexes are back. If the load
+    stops early, the chunks written stay; loading the same pages again
+    deletes the previous rows, and migrate() creates missing indexes.
+    """
+
+    def __init__(self, session, cache, chunk_size=BULK_CHUNK_SIZE):
+        """
+        :param session: an active SQLAlchemy session on a SQLite database,
+                        best from an engine with BULK_PRAGMAS
+        :param cache: an EntityCache
+        :param chunk_size: number of profiles per transaction
+        """
+        if session.get_bind().dialect.name != 'sqlite':
+            raise ValueError('Bulk loads write to SQLite databases only')
+        super(BulkLoader, self).__init__(session, cache,
+                                         batch_size=chunk_size,
+                                         commit_interval=1)
+        # Rows inserted and seconds spent inserting them, per model
+        self.rows = {model: 0 for model in (Person,) + PROFILE_MODELS}
+        self.seconds = dict.fromkeys(self.rows, 0.0)
+        # {id of a re-loaded person: {model: first id of its new rows}}
+        self._stale = {}
+        # {(model, column keys): _insert_statement()}
+        self._statements = {}
+        self._start = time.perf_counter()
+        self._drop_indexes()
+
+    def flush(self):
+        """
+        Writes the queued profiles in a transaction of their own.
+        :return: None
+        """
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        checkpoint = self.cache.checkpoint()
+        try:
+            stale = self._write(batch)
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            self.cache.rollback(checkpoint)
+            raise
+        self.cache.sync()
+        self._stale.update(stale)
+        self.written += len(batch)
+        log.info('[Bulk] Loaded {} profiles, {:.0f} profiles/s.'.format(
+            self.written, self.written / (time.perf_counter() - self._start)))
+
+    def close(self):
+        """
+        Writes the remaining profiles, creates the indexes, deletes the
+        previous rows of re-loaded people and reports the throughput.
+        :return: None
+        """
+        self.flush()
+        self._create_indexes()
+        self._delete_stale()
+        self.session.commit()
+        self.report()
+
+    def report(self):
+        """
+        Logs the profiles loaded per second, and the rows inserted per
+        second in each table.
+        :return: None
+        """
+        seconds = time.perf_counter() - self._start
+        log.info('Loaded {} profiles in {:.1f} s, {:.0f} profiles/s.'.format(
+            self.written, seconds, self.written / seconds))
+        for model, n in self.rows.items():
+            seconds = self.seconds[model]
+            log.info('{}: {} rows in {:.1f} s, {:.0f} rows/s.'.format(
+                model.__tablename__, n, seconds,
+                n / seconds if seconds else 0))
+
+    def _drop_indexes(self):
+        connection = self.session.connection()
+        for index in deferred_indexes():
+            index.drop(connection, checkfirst=True)
+        self.session.commit()
+
+    def _create_indexes(self):
+        connection = self.session.connection()
+        for index in deferred_indexes():
+            start = time.perf_counter()
+            index.create(connection, checkfirst=True)
+            log.info('Created index {} in {:.1f} s.'.format(
+                index.name, time.perf_counter() - start))
+
+    def _delete_stale(self):
+        """
+        Deletes the rows of the profiles that re-loaded people replaced.
+        """
+        if not self._stale:
+            return
+        for model in PROFILE_MODELS:
+            table = model.__table__
+            self.session.execute(table.delete().where(and_(
+                table.c.person_id == bindparam('stale_id'),
+                table.c.id < bindparam('first_id'))), [
+                {'stale_id': person_id, 'first_id': first_ids[model]}
+                for person_id, first_ids in self._stale.items()])
+        log.info('Replaced the profiles of {} people.'.format(
+            len(self._stale)))
+        self._stale = {}
+
+    def _write(self, batch):
+        """
+        Inserts a list of profiles with one prepared statement per table.
+        :return: {id of a re-loaded person: {model: first id of its rows}}
+        """
+        batch = self._dedupe(batch)
+        self._resolve_entities(batch)
+        existing = self._existing_people(batch)
+        first_ids = self._next_ids()
+        next_person_id = first_ids[Person]
+        people = []
+        updates = []
+        stale = {}
+        rows = {model: [] for model in PROFILE_MODELS}
+        for profile in batch:
+            values = self._person_values(profile.person)
+            person_id = existing.get(profile.person.url)
+            if person_id is None:
+                person_id = values['id'] = next_person_id
+                next_person_id += 1
+                people.append(values)
+            else:
+                values['person_id'] = person_id
+                updates.append(values)
+                stale[person_id] = first_ids
+            self._add_profile_rows(rows, profile, person_id)
+
+        self._insert(Person, people)
+        if updates:
+            start = time.perf_counter()
+            table = Person.__table__
+            # The SET clause is the columns of the rows, other than
+            # person_id
+            self.session.execute(table.update().where(
+                table.c.id == bindparam('person_id')), updates)
+            self._count(Person, len(updates), start)
+        for model, model_rows in rows.items():
+            for id_, row in enumerate(model_rows, first_ids[model]):
+                row['id'] = id_
+            self._insert(model, model_rows)
+        return stale
+
+    def _next_ids(self):
+        """
+        :return: {model: id of its next row} for people and PROFILE_MODELS
+        """
+        next_ids = {}
+        for model in self.rows:
+            table = model.__table__
+            last = self.session.execute(
+                select([func.max(table.c.id)])).scalar()
+            next_ids[model] = (last or 0) + 1
+        return next_ids
+
+    def _insert(self, model, rows):
+        """
+        Inserts rows with the same keys through one prepared statement.
+        Converting the values here and handing tuples to the driver skips
+        SQLAlchemy's processing of each row, which takes longer than the
+        inserts themselves.
+        """
+        if not rows:
+            return
+        start = time.perf_counter()
+        statement, keys, processors = self._insert_statement(
+            model, tuple(rows[0]))
+        # Column by column, so only the values that need it are converted
+        columns = list(zip(*map(itemgetter(*keys), rows)))
+        for i, process in processors:
+            columns[i] = map(process, columns[i])
+        self.session.connection().exec_driver_sql(statement,
+                                                  list(zip(*columns)))
+        self._count(model, len(rows), start)
+
+    def _insert_statement(self, model, keys):
+        """
+        :return: (SQL of an INSERT of the columns <keys> of the table of
+                 <model>, the keys in the order of its parameters,
+                 [(position, bind processor)] of the columns whose values
+                 the driver cannot take as they are)
+        """
+        statement = self._statements.get((model, keys))
+        if statement is None:
+            table = model.__table__
+            dialect = self.session.get_bind().dialect
+            compiled = table.insert().compile(dialect=dialect,
+                                              column_keys=keys)
+            order = compiled.positiontup
+            processors = []
+            for i, key in enumerate(order):
+                process = table.c[key].type.dialect_impl(dialect) \
+                    .bind_processor(dialect)
+                if process is not None:
+                    processors.append((i, process))
+            statement = compiled.string, order, processors
+            self._statements[(model, keys)] = statement
+        return statement
+
+    def _count(self, model, n, start):
+        self.seconds[model] += time.perf_counter() - start
+        self.rows[model] += n
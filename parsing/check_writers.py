@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Checks that processes writing one SQLite database at once lose no profile
+
+import argparse
+from db.cache import EntityCache
+from db.driver import SQLITE_PRAGMAS, Session, make_engine
+from db.migrate import migrate
+from db.models import *
+import logging
+import multiprocessing
+import os
+from parsing.batch import BatchWriter
+from parsing.bench_bulk import make_profiles
+from sqlalchemy import func, select
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+CHECK_PATH = '../tmp/check_writers.sqlite3'
+
+
+def write_shard(args):
+    """
+    Writes every <n_writers>th made-up profile from <shard>, and those of
+    the next shard, so that each profile is written by two processes.
+    :param args: (url, pragmas, shard, n_writers, n_profiles, batch_size)
+    :return: (profiles written, profiles failed)
+    """
+    url, pragmas, shard, n_writers, n_profiles, batch_size = args
+    engine = make_engine(url, pragmas=pragmas)
+    session = Session(bind=engine)
+    writer = BatchWriter(session, EntityCache(), batch_size=batch_size,
+                         commit_interval=2)
+    with writer:
+        for i, profile in enumerate(make_profiles(n_profiles)):
+            if i % n_writers in (shard, (shard + 1) % n_writers):
+                writer.add(profile)
+    session.close()
+    engine.dispose()
+    return writer.written, writer.failed
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Writes made-up profiles from several processes into a '
+                    'new SQLite database at once, and checks that every '
+                    'profile is there once, whole.')
+    arg_parser.add_argument('--db', default=CHECK_PATH,
+                            help='path of the SQLite file to create')
+    arg_parser.add_argument('--writers', type=int, default=4,
+                            help='processes writing at once')
+    arg_parser.add_argument('--profiles', type=int, default=20000,
+                            help='profiles to write, each by two processes')
+    arg_parser.add_argument('--batch-size', type=int, default=100,
+                            help='profiles per batch')
+    arg_parser.add_argument('--busy-timeout', type=int, default=50,
+                            help='milliseconds a writer waits for the lock, '
+                                 'short so lock errors are retried')
+    args = arg_parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    url = 'sqlite:///{}'.format(args.db)
+    engine = make_engine(url)
+    migrate(engine)
+    pragmas = SQLITE_PRAGMAS + (('busy_timeout', args.busy_timeout),)
+
+    with multiprocessing.Pool(args.writers) as pool:
+        counts = pool.map(write_shard, [
+            (url, pragmas, shard, args.writers, args.profiles,
+             args.batch_size) for shard in range(args.writers)])
+    for shard, (written, failed) in enumerate(counts):
+        log.info('Writer {}: {} profiles written, {} failed.'.format(
+            shard, written, failed))
+
+    profiles = list(make_profiles(args.profiles))
+    expected = {
+        Person: len(profiles),
+        PersonExperience: sum(len(p.experiences) for p in profiles),
+        PersonEducation: sum(len(p.educations) for p in profiles),
+        PersonCertification: sum(len(p.certifications) for p in profiles),
+        PersonSkill: sum(len(p.skills) for p in profiles),
+    }
+    n_errors = sum(failed for _, failed in counts)
+    with engine.connect() as conn:
+        for model, n in expected.items():
+            table = model.__table__
+            found = conn.execute(select([func.count()]).select_from(
+                table)).scalar()
+            if found != n:
+                n_errors += 1
+                log.error('{}: {} rows, expected {}'.format(
+                    table.name, found, n))
+        urls = conn.execute(select([func.count(
+            Person.__table__.c.url.distinct())])).scalar()
+        if urls != len(profiles):
+            n_errors += 1
+            log.error('people: {} URLs, expected {}'.format(
+                urls, len(profiles)))
+    if n_errors:
+        raise SystemExit(1)
+    log.info('All {} profiles written once, whole.'.format(len(profiles)))
+
+
+if __name__ == '__main__':
+    main()
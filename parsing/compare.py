@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Checks that the parser engines agree field for field on saved profiles
+
+import argparse
+from glob import glob
+import logging
+import os
+import time
+from parsing.main import ENGINES
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+SECTIONS = ['experiences', 'educations', 'certifications', 'skills']
+
+# Small cleaned pages kept with the code, covering missing sections and
+# fields, entities with and without links, and non-ASCII text
+FIXTURES_PATTERN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'fixtures', '*.html')
+
+
+def diff_profiles(expected, actual):
+    """
+    Lists the fields in which two ProfileRecords differ.
+    :param expected: a ProfileRecord
+    :param actual: a ProfileRecord
+    :return: list of (field path, expected value, actual value)
+    """
+    diffs = []
+
+    def diff_records(path, a, b):
+        for field in a.__slots__:
+            x = getattr(a, field)
+            y = getattr(b, field)
+            if x != y:
+                diffs.append(('{}.{}'.format(path, field), x, y))
+
+    diff_records('person', expected.person, actual.person)
+    for section in SECTIONS:
+        xs = getattr(expected, section)
+        ys = getattr(actual, section)
+        if len(xs) != len(ys):
+            diffs.append(('{}.length'.format(section), len(xs), len(ys)))
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            diff_records('{}[{}]'.format(section, i), x, y)
+    return diffs
+
+
+def extract(engine, content):
+    """
+    :return: (ProfileRecord or None, error string or None, seconds)
+    """
+    start = time.perf_counter()
+    try:
+        profile = ENGINES[engine](content).extract()
+        error = None
+    except Exception as e:
+        profile = None
+        error = '{}: {}'.format(type(e).__name__, e)
+    return profile, error, time.perf_counter() - start
+
+
+def compare_files(file_paths, expected='bs4', actual='lxml', strict=False):
+    """
+    Runs two engines over each file and reports every difference.
+    :param file_paths: list of HTML files
+    :param expected: reference engine
+    :param actual: engine under test
+    :param strict: whether a file that both engines fail on counts as
+                   differing, for pages known to be good
+    :return: number of files that differ
+    """
+    n_diff = 0
+    times = {expected: 0.0, actual: 0.0}
+    for file_path in file_paths:
+        with open(file_path) as file:
+            content = file.read()
+        a, a_error, a_time = extract(expected, content)
+        b, b_error, b_time = extract(actual, content)
+        times[expected] += a_time
+        times[actual] += b_time
+        if a_error or b_error:
+            diffs = []
+            if (a_error is None) != (b_error is None) or strict:
+                diffs.append(('error', a_error, b_error))
+        else:
+            diffs = diff_profiles(a, b)
+        if diffs:
+            n_diff += 1
+            for path, x, y in diffs:
+                log.error('{}: {}: {}={!r} {}={!r}'.format(
+                    file_path, path, expected, x, actual, y))
+    log.info('{} of {} files differ.'.format(n_diff, len(file_paths)))
+    for engine, seconds in times.items():
+        log.info('{}: {:.3f}s'.format(engine, seconds))
+    return n_diff
+
+
+def main():
+    """
+    Driver method.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Compares parser engines on saved profiles.')
+    arg_parser.add_argument('pattern', nargs='?',
+                            default='../tmp/clean_profiles/*.html',
+                            help='glob of HTML files')
+    arg_parser.add_argument('--expected', choices=sorted(ENGINES),
+                            default='bs4')
+    arg_parser.add_argument('--actual', choices=sorted(ENGINES),
+                            default='lxml')
+    arg_parser.add_argument('--fixtures', action='store_true',
+                            help='check the engines on the pages in '
+                                 'parsing/fixtures instead, failing on any '
+                                 'error too')
+    args = arg_parser.parse_args()
+
+    pattern = FIXTURES_PATTERN if args.fixtures else args.pattern
+    file_paths = sorted(glob(pattern))
+    if not file_paths:
+        raise SystemExit('No files match {}.'.format(pattern))
+    n_diff = compare_files(file_paths, args.expected, args.actual,
+                           strict=args.fixtures)
+    if n_diff:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# Persists extracted profile records through the ORM
+
+from db.models import *
+import logging
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Rows making up a profile besides the person, replaced when it is loaded
+# again
+PROFILE_MODELS = (PersonExperience, PersonEducation, PersonCertification,
+                  PersonSkill)
+
+
+def delete_profile_rows(session, person_ids):
+    """
+    Deletes the experiences, educations, certifications and skills of
+    people, in the current transaction.
+    :param session: an active SQLAlchemy session
+    :param person_ids: list of ids of people
+    :return: None
+    """
+    for model in PROFILE_MODELS:
+        table = model.__table__
+        session.execute(table.delete().where(
+            table.c.person_id.in_(person_ids)))
+
+
+class ProfileLoader(object):
+    """
+    Writes ProfileRecords to the database as ORM objects, resolving entities
+    to existing rows.
+    """
+
+    def __init__(self, session, cache=None):
+        """
+        :param session: an active SQLAlchemy session
+        :param cache: an EntityCache, or None to query the database directly
+        """
+        self.session = session
+        self.cache = cache
+
+    def load(self, profile):
+        """
+        Adds a profile to the session and flushes it. If a person with the
+        same URL exists, they are updated and the rest of their profile is
+        replaced, in the current transaction.
+        :param profile: a ProfileRecord
+        :return: a Person object
+        """
+        person = self.load_person_overview(profile.person)
+        self.load_person_experiences(person, profile.experiences)
+        self.load_person_educations(person, profile.educations)
+        self.load_person_certifications(person, profile.certifications)
+        self.load_person_skills(person, profile.skills)
+        self.session.flush()
+        return person
+
+    def load_person_overview(self, record):
+        """
+        :param record: a PersonRecord
+        :return: a Person object
+        """
+        person = None
+        if record.url is not None:
+            person = self.session.query(Person).filter_by(
+                url=record.url).first()
+        if person is None:
+            person = Person(url=record.url)
+            self.session.add(person)
+        else:
+            delete_profile_rows(self.session, [person.id])
+            self.session.expire(person, ['experiences', 'educations',
+                                         'certifications', 'skills'])
+        person.name = record.name
+        person.headline = record.headline
+        person.locality = record.locality
+        person.meta = record.meta
+        person.content_hash = record.content_hash
+        return person
+
+    def load_person_experiences(self, person, records):
+        """
+        :param person: a Person object
+        :param records: list of ExperienceRecord
+        :return: None
+        """
+        for record in records:
+            exp = PersonExperience()
+            exp.person = person
+            exp.title = self._get_or_create(Title, record.title)
+            exp.company = self._get_or_create(Company, record.company)
+            exp.start_date = record.start_date
+            exp.end_date = record.end_date
+            exp.description = record.description
+            self.session.add(exp)
+
+    def load_person_educations(self, person, records):
+        """
+        :param person: a Person object
+        :param records: list of EducationRecord
+        :return: None
+        """
+        for record in records:
+            edu = PersonEducation()
+            edu.person = person
+            edu.school = self._get_or_create(School, record.school)
+            edu.degree = record.degree
+            edu.start_date = record.start_date
+            edu.end_date = record.end_date
+            edu.description = record.description
+            self.session.add(edu)
+
+    def load_person_certifications(self, person, records):
+        """
+        :param person: a Person object
+        :param records: list of CertificationRecord
+        :return: None
+        """
+        for record in records:
+            pc = PersonCertification()
+            pc.person = person
+            pc.certification = self._get_or_create(Certification,
+                                                   record.certification)
+            pc.company = self._get_or_create(Company, record.company)
+            pc.start_date = record.start_date
+            pc.end_date = record.end_date
+            pc.description = record.description
+            self.session.add(pc)
+
+    def load_person_skills(self, person, records):
+        """
+        :param person: a Person object
+        :param records: list of SkillRecord
+        :return: None
+        """
+        for record in records:
+            ps = PersonSkill()
+            ps.person = person
+            ps.skill = self._get_or_create(Skill, record.skill)
+            self.session.add(ps)
+
+    def _get_or_create(self, model, key):
+        """
+        Find or create a <model> instance for an entity reference.
+        :param model: Class of model (Title, Company)
+        :param key: (name, url) pair, or None
+        :return: a <model> object, or None
+        """
+        if key is None:
+            return None
+        name, url = key
+        if self.cache is not None:
+            return self.cache.get_or_create(self.session, model, name, url)
+        return model.get_or_create(self.session, name=name, url=url)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# A faster LinkedIn HTML parser built on compiled lxml XPath expressions
+
+import logging
+from lxml import etree
+import lxml.html
+from parsing.parser import parse_date_range
+from parsing.records import *
+from urllib.parse import urlparse
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def _has_class(name):
+    """
+    XPath predicate equivalent to BeautifulSoup's class_=<name>
+    """
+    return ("contains(concat(' ', normalize-space(@class), ' '), "
+            "concat(' ', {}, ' '))".format(name))
+
+
+# ids of the profile sections, found with one pass over the tree
+_SECTION_IDS = ('topcard', 'experience', 'education', 'certifications',
+                'skills')
+_SECTIONS = etree.XPath('descendant-or-self::*[{}]'.format(' or '.join(
+    "@id='{}'".format(id_) for id_ in _SECTION_IDS)))
+# Each expression returns a list of at most one element, like bs4's find()
+_CHILD_BY_ID = etree.XPath('(.//*[@id=$id])[1]')
+_CHILD_BY_CLASS = etree.XPath('(.//*[{}])[1]'.format(_has_class('$cls')))
+_ITEMS = etree.XPath('.//li[{}]'.format(_has_class('$cls')))
+_LINK = etree.XPath('(.//a)[1]')
+_TIMES = etree.XPath('.//time')
+# bs4's .text skips comments and the contents of <script> and <style>
+_TEXT = etree.XPath('.//text()[not(ancestor::script or ancestor::style)]')
+
+
+def _text(element):
+    return ''.join(_TEXT(element))
+
+
+def _first(expr, element, **kwargs):
+    result = expr(element, **kwargs)
+    if result:
+        return result[0]
+    return None
+
+
+class LxmlLinkedInParser(object):
+    """
+    A LinkedIn HTML parser with the same API and output as LinkedInParser,
+    but working on an lxml tree with precompiled XPath expressions instead
+    of BeautifulSoup's find()/find_all() scans.
+    """
+
+    def __init__(self, html):
+        """
+        :param html: string
+        """
+        self.root = lxml.html.document_fromstring(html)
+        self._sections = None
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        Creates a parser over an already parsed tree, such as the profile
+        isolated by crawler.cleaner.isolate_profile.
+        :param element: an lxml element
+        :return: a LxmlLinkedInParser
+        """
+        parser = cls.__new__(cls)
+        parser.root = element
+        parser._sections = None
+        return parser
+
+    def _section(self, section_id):
+        """
+        :param section_id: one of _SECTION_IDS
+        :return: the first element with that id, or None
+        """
+        if self._sections is None:
+            # Elements come in document order, so the first of each id
+            # wins, like bs4's find()
+            self._sections = {}
+            for element in _SECTIONS(self.root):
+                self._sections.setdefault(element.get('id'), element)
+        return self._sections.get(section_id)
+
+    def extract(self):
+        """
+        Extracts everything from HTML.
+        :return: a ProfileRecord
+        """
+        return ProfileRecord(self.extract_person_overview(),
+                             self.extract_person_experiences(),
+                             self.extract_person_educations(),
+                             self.extract_person_certifications(),
+                             self.extract_person_skills())
+
+    def extract_person_overview(self):
+        """
+        Extracts a person's overview information from HTML.
+        :return: a PersonRecord
+        """
+        person = PersonRecord()
+        sec = self._section('topcard')
+        if sec is None:
+            raise AttributeError('No topcard in profile')
+        # Get the name
+        name_tag = _first(_CHILD_BY_ID, sec, id='name')
+        if name_tag is not None:
+            person.name = _text(name_tag).strip()
+        # Get the headline
+        headline_tag = _first(_CHILD_BY_CLASS, sec, cls='headline')
+        if headline_tag is not None:
+            person.headline = _text(headline_tag).strip()
+        # Get the locality
+        dm = _first(_CHILD_BY_ID, sec, id='demographics')
+        if dm is not None:
+            locality_tag = _first(_CHILD_BY_CLASS, dm, cls='locality')
+            if locality_tag is not None:
+                person.locality = _text(locality_tag).strip()
+        # Done.
+        return person
+
+    def extract_person_experiences(self):
+        """
+        Extracts a person's experiences information from HTML.
+        :return: list of ExperienceRecord
+        """
+        records = []
+        for li in self._items('experience', 'position'):
+            exp = ExperienceRecord()
+            exp.title = self._extract_li_subitem(li, 'item-title')
+            exp.company = self._extract_li_subitem(li, 'item-subtitle')
+            exp.start_date, exp.end_date = self._extract_date_range(li)
+            exp.description = self._extract_description(li)
+            records.append(exp)
+        return records
+
+    def extract_person_educations(self):
+        """
+        Extracts a person's education information from HTML.
+        :return: list of EducationRecord
+        """
+        records = []
+        for li in self._items('education', 'school'):
+            edu = EducationRecord()
+            edu.school = self._extract_li_subitem(li, 'item-title')
+            degree_tag = _first(_CHILD_BY_CLASS, li, cls='item-subtitle')
+            if degree_tag is not None:
+                edu.degree = _text(degree_tag).strip()
+            edu.start_date, edu.end_date = self._extract_date_range(li)
+            edu.description = self._extract_description(li)
+            records.append(edu)
+        return records
+
+    def extract_person_certifications(self):
+        """
+        Extracts a person's certifications information from HTML.
+        :return: list of CertificationRecord
+        """
+        records = []
+        for li in self._items('certifications', 'certification'):
+            pc = CertificationRecord()
+            pc.certification = self._extract_li_subitem(li, 'item-title')
+            pc.company = self._extract_li_subitem(li, 'item-subtitle')
+            pc.start_date, pc.end_date = self._extract_date_range(li)
+            pc.description = self._extract_description(li)
+            records.append(pc)
+        return records
+
+    def extract_person_skills(self):
+        """
+        Extracts a person's skills information from HTML.
+        :return: list of SkillRecord
+        """
+        return [SkillRecord(self._extract_li_subitem(li, None))
+                for li in self._items('skills', 'skill')]
+
+    def _items(self, section_id, class_):
+        """
+        Find the <li> elements of a profile section.
+        :param section_id: id of the section
+        :param class_: CSS class of the items
+        :return: list of HTML elements
+        """
+        sec = self._section(section_id)
+        if sec is None:
+            return []
+        return _ITEMS(sec, cls=class_)
+
+    @staticmethod
+    def _extract_li_subitem(li, class_):
+        """
+        Find the name and URL of an entity from given HTML element.
+        :param li: HTML element
+        :param class_: CSS class, or None for the li element itself.
+        :return: (name, url) pair, url can be None; or None
+        """
+        if class_ is None:
+            h = li
+        else:
+            h = _first(_CHILD_BY_CLASS, li, cls=class_)
+        if h is None:
+            return None
+        a = _first(_LINK, h)
+        if a is None:
+            name = _text(h).strip()
+            url = None
+        else:
+            name = _text(a).strip()
+            url = a.attrib['href']
+            url = urlparse(url).path
+        return name, url
+
+    @staticmethod
+    def _extract_date_range(li):
+        """
+        Extract the start date and end date from given HTML element.
+        :param li: HTML element
+        :return: (date, date), date can be None
+        """
+        s = _first(_CHILD_BY_CLASS, li, cls='date-range')
+        if s is None:
+            return None, None
+        times = _TIMES(s)
+        return parse_date_range([_text(t) for t in times[:2]])
+
+    @staticmethod
+    def _extract_description(li):
+        """
+        Extract the description field from given HTML element.
+        :param li: HTML element
+        :return: string
+        """
+        p = _first(_CHILD_BY_CLASS, li, cls='description')
+        if p is None:
+            return None
+        return _text(p).strip()
@@ -1,25 +1,48 @@
 #!/usr/bin/env python
 
-import ast
+import argparse
+from db.cache import EntityCache
+from crawler.cleaner import isolate_profile, write_atomic
+from crawler.interchange import find_input, read_results
+from crawler.pagestore import open_store
 from db.driver import prepare_db_session
+from db.migrate import is_applied, mark_applied
+from db.models import Person
+import hashlib
+import itertools
 import json
 import logging
+import lxml.html
 import os
+from parsing.batch import BatchWriter
+from parsing.bulk import BULK_CHUNK_SIZE, BULK_PRAGMAS, BulkLoader
+from parsing.loader import ProfileLoader
+from parsing.lxml_parser import LxmlLinkedInParser
 from parsing.parser import LinkedInParser
+from parsing.pipeline import imap_ordered
+from sqlalchemy import and_, bindparam, select
+import urllib.parse
 
 # Set up logging
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# Parser engines selectable with --engine
+ENGINES = {'bs4': LinkedInParser, 'lxml': LxmlLinkedInParser}
 
-def parse(session, title, url):
+# Read in place of a profile from a page whose hash is the known one
+UNCHANGED = 'unchanged'
+
+# Name of the one-time backfill_urls run in db.migrate's migrations table
+PERSON_URLS = 'person_urls'
+
+
+def read_profile_file(title):
     """
-    Parses LinkedIn content and insert into database.
-    :param session: an active SQLAlchemy session
+    Reads the cleaned HTML of a LinkedIn page.
     :param title: title of the LinkedIn page
-    :param url: LinkedIn URL
-    :return: None
+    :return: (file name, HTML string)
     """
     root_path = '../tmp/clean_profiles/'
     file_name = "{}.html".format(title)
@@ -27,60 +50,383 @@ def parse(session, title, url):
     file_path = os.path.join(root_path, file_name)
     with open(file_path) as file:
         content = file.read()
+    return file_name, content
 
-    p = LinkedInParser(session, content)
 
-    # 1. Get person's basic information
+def read_profile_page(store, title, url):
+    """
+    Reads a LinkedIn page from a page store.
+    :param store: directory of the page store
+    :param title: title of the LinkedIn page
+    :param url: LinkedIn URL, the key of the page
+    :return: (file name, HTML bytes)
+    """
+    content = open_store(store).get(url)
+    if content is None:
+        raise KeyError('No page for {} in {}'.format(url, store))
+    return "{}.html".format(title), content
 
-    person = p.extract_person_overview()
 
-    # Add metadata to the person
+def make_meta(url, file_name):
+    """
+    :param url: LinkedIn URL
+    :param file_name: name of the parsed file
+    :return: JSON string stored in Person.meta
+    """
     meta = {'url': url, 'file_name': file_name}
-    person.meta = json.dumps(meta, separators=(',', ':'))
-    session.flush()
+    return json.dumps(meta, separators=(',', ':'))
+
+
+def canonical_url(url):
+    """
+    :param url: LinkedIn URL as found by the search
+    :return: the URL over https, on www.linkedin.com for linkedin.com and
+             its country subdomains, without query, fragment or trailing
+             slash, so that every link to a profile names the same person
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host == 'linkedin.com' or host.endswith('.linkedin.com'):
+        host = 'www.linkedin.com'
+    return urllib.parse.urlunsplit(('https', host, parts.path.rstrip('/'),
+                                    '', ''))
+
+
+def content_hash(content):
+    """
+    :param content: page as bytes or str
+    :return: SHA-1 of the page as a hex string
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+def set_identity(profile, url, file_name, digest):
+    """
+    Records where a profile comes from.
+    :param profile: a ProfileRecord
+    :param url: LinkedIn URL
+    :param file_name: name of the parsed file
+    :param digest: content_hash of the page
+    :return: None
+    """
+    profile.person.meta = make_meta(url, file_name)
+    profile.person.url = canonical_url(url)
+    profile.person.content_hash = digest
 
-    # 2. Get experiences list
-    p.extract_person_experiences(person)
 
-    # 3. Get educations list
-    p.extract_person_educations(person)
+def with_known_hashes(engine, triplets, chunk_size=500):
+    """
+    Looks up the hash of the page each profile was last parsed from, one
+    query per chunk. It has its own connection, so it can run in another
+    thread than the writer.
+    :param engine: SQLAlchemy engine
+    :param triplets: iterable of (confidence, title, url), read lazily
+    :param chunk_size: URLs per query
+    :return: generator of (triplet, hash or None)
+    """
+    triplets = iter(triplets)
+    while True:
+        chunk = list(itertools.islice(triplets, chunk_size))
+        if not chunk:
+            return
+        urls = {canonical_url(url) for _, _, url in chunk}
+        query = select([Person.url, Person.content_hash]).where(
+            Person.url.in_(urls))
+        with engine.connect() as conn:
+            known = dict(conn.execute(query).fetchall())
+        for triplet in chunk:
+            yield triplet, known.get(canonical_url(triplet[2]))
 
-    # 4. Get certifications list
-    p.extract_person_certifications(person)
 
-    # 5. Get skills list
-    p.extract_person_skills(person)
+def backfill_urls(session, chunk_size=500):
+    """
+    Sets the URL of the people parsed before people had one, from their
+    meta. Of people parsed from the same page, the latest gets the URL.
+    :param session: an active SQLAlchemy session
+    :param chunk_size: URLs per query
+    :return: number of people updated
+    """
+    table = Person.__table__
+    query = select([table.c.id, table.c.meta]).where(and_(
+        table.c.url.is_(None), table.c.meta.isnot(None))).order_by(table.c.id)
+    latest = {}
+    for id_, meta in session.execute(query).fetchall():
+        try:
+            url = json.loads(meta)['url']
+        except (ValueError, KeyError, TypeError):
+            continue
+        latest[canonical_url(url)] = id_
+    urls = list(latest)
+    for i in range(0, len(urls), chunk_size):
+        # URLs taken by people parsed since
+        taken = select([table.c.url]).where(
+            table.c.url.in_(urls[i:i + chunk_size]))
+        for url, in session.execute(taken).fetchall():
+            del latest[url]
+    if latest:
+        session.execute(table.update().where(
+            table.c.id == bindparam('person_id')).values(
+                url=bindparam('new_url')),
+            [{'person_id': id_, 'new_url': url}
+             for url, id_ in latest.items()])
+        log.info('Set the URL of {} people.'.format(len(latest)))
+    # Even with nothing to update: on SQLite the transaction holds the
+    # write lock
+    session.commit()
+    return len(latest)
 
-    # X. Commit changes
 
+def parse(session, title, url, cache=None, engine='bs4', store=None):
+    """
+    Parses LinkedIn content and insert into database.
+    :param session: an active SQLAlchemy session
+    :param title: title of the LinkedIn page
+    :param url: LinkedIn URL
+    :param cache: an EntityCache, or None
+    :param engine: key of ENGINES
+    :param store: directory of a page store of cleaned pages to read from
+                  instead of files
+    :return: None
+    """
+    profile = read_profile(title, url, engine, store)
+    ProfileLoader(session, cache=cache).load(profile)
     session.commit()
+    if cache is not None:
+        cache.sync()
+
+
+def read_profile(title, url, engine='bs4', store=None, file_path=None,
+                 known_hash=None):
+    """
+    Parses LinkedIn content into records, without touching the database.
+    :param title: title of the LinkedIn page
+    :param url: LinkedIn URL
+    :param engine: key of ENGINES
+    :param store: directory of a page store of cleaned pages to read from
+                  instead of files
+    :param file_path: cleaned page to read instead of the one named after
+                      <title>
+    :param known_hash: content_hash of the page the profile was last parsed
+                       from, or None
+    :return: a ProfileRecord, or UNCHANGED if the page has <known_hash>
+    """
+    if store is not None:
+        file_name, content = read_profile_page(store, title, url)
+        digest = content_hash(content)
+        if digest == known_hash:
+            return UNCHANGED
+        content = content.decode('utf-8')
+    else:
+        if file_path is not None:
+            file_name = os.path.basename(file_path)
+            with open(file_path) as file:
+                content = file.read()
+        else:
+            file_name, content = read_profile_file(title)
+        digest = content_hash(content)
+        if digest == known_hash:
+            return UNCHANGED
+    profile = ENGINES[engine](content).extract()
+    set_identity(profile, url, file_name, digest)
+    return profile
+
 
+def read_raw_profile(title, url, write_clean=False, store=None,
+                     known_hash=None):
+    """
+    Parses a raw downloaded LinkedIn page into records. The page is cleaned
+    in memory and the cleaned tree is handed straight to the lxml engine,
+    so it is parsed only once.
+    :param title: title of the LinkedIn page
+    :param url: LinkedIn URL
+    :param write_clean: whether to also save the cleaned HTML
+    :param store: directory of a page store of raw pages to read from
+                  instead of files
+    :param known_hash: content_hash of the page the profile was last parsed
+                       from, or None
+    :return: a ProfileRecord, or UNCHANGED if the page has <known_hash>
+    """
+    if store is not None:
+        file_name, content = read_profile_page(store, title, url)
+        file_path = url
+    else:
+        file_name = "{}.html".format(title)
+        file_path = os.path.join('../tmp/profiles/', file_name)
+        with open(file_path, 'rb') as file:
+            content = file.read()
+    digest = content_hash(content)
+    if digest == known_hash:
+        return UNCHANGED
+    element = isolate_profile(content)
+    if element is None:
+        raise ValueError('No profile in {}'.format(file_path))
+    if write_clean:
+        clean_path = os.path.join('../tmp/clean_profiles/', file_name)
+        write_atomic(clean_path, lxml.html.tostring(
+            element, encoding='utf-8', with_tail=False))
+    profile = LxmlLinkedInParser.from_element(element).extract()
+    set_identity(profile, url, file_name, digest)
+    return profile
+
+
+def read_task(read, title, url, *args):
+    """
+    Reads a profile in a worker process.
+    :param read: read_profile or read_raw_profile
+    :param title: title of the LinkedIn page
+    :param url: LinkedIn URL
+    :param args: further arguments of <read>
+    :return: (title, profile), so results say which page they are of
+    """
+    return title, read(title, url, *args)
 
-def parse_all(session, results):
+
+def parse_all(session, results, cache_size=100000, batch_size=0,
+              commit_interval=10, workers=0, engine='bs4', raw=False,
+              write_clean=False, store=None, incremental=False,
+              bulk_load=False):
     """
+    Profiles already in the database are updated, by canonical URL, rather
+    than added again.
     :param session: an active SQLAlchemy session
-    :param results: list of triplets
+    :param results: iterable of triplets, read lazily
+    :param cache_size: size of the entity cache, or 0 to disable it
+    :param batch_size: profiles per bulk INSERT, or 0 to insert through the
+                       ORM one profile at a time
+    :param commit_interval: batches per commit in bulk INSERT mode
+    :param workers: number of parsing processes, or 0 to parse in this one.
+                    This process remains the only database writer.
+    :param engine: key of ENGINES
+    :param raw: whether to read raw downloaded pages and clean them in
+                memory instead of reading cleaned pages. Implies the lxml
+                engine.
+    :param write_clean: in raw mode, whether to also save the cleaned pages
+    :param store: directory of a page store to read pages from instead of
+                  files, keyed by URL: raw pages in raw mode, cleaned pages
+                  otherwise
+    :param incremental: whether to skip, without parsing them, the pages
+                        whose hash is the one of the page the profile was
+                        last parsed from
+    :param bulk_load: whether to load into a SQLite database with a
+                      BulkLoader, <batch_size> profiles per transaction
     :return: None
     """
-    for triplet in results:
-        if triplet is None:
-            continue
-        _, title, url = triplet
-        print('Parsing:', title)
-        parse(session, title, url)
+    if write_clean and store is not None:
+        raise ValueError('write_clean saves files; clean a page store with '
+                         'crawler.cleaner instead')
+    bind = session.get_bind()
+    # People parsed before people had a URL only exist in databases from
+    # before the first run of this version, so they are looked for once
+    if not is_applied(bind, PERSON_URLS):
+        backfill_urls(session)
+        mark_applied(bind, PERSON_URLS)
+    triplets = filter(None, results)
+    if incremental:
+        triplets = with_known_hashes(bind, triplets)
+    else:
+        triplets = ((triplet, None) for triplet in triplets)
+    # Titles travel with the tasks and come back with the profiles: the
+    # feeder thread of imap_ordered reads <triplets>, so nothing else may
+    # read it alongside
+    if raw:
+        tasks = ((read_raw_profile, title, url, write_clean, store,
+                  known_hash)
+                 for (_, title, url), known_hash in triplets)
+    else:
+        tasks = ((read_profile, title, url, engine, store, None, known_hash)
+                 for (_, title, url), known_hash in triplets)
+    # With no workers, the tasks run here, failing the same way
+    results = imap_ordered(read_task, tasks, workers=workers)
+    # A failed task gives None; imap_ordered logged the error
+    profiles = filter(None, results)
+
+    cache = None
+    if cache_size > 0 or batch_size > 0 or bulk_load:
+        cache = EntityCache(max_size=max(cache_size, 1))
+        cache.warm(session)
+        # Ends the read, which holds the write lock on SQLite
+        session.commit()
+    unchanged = 0
+    if batch_size > 0 or bulk_load:
+        if bulk_load:
+            writer = BulkLoader(session, cache,
+                                chunk_size=batch_size or BULK_CHUNK_SIZE)
+        else:
+            writer = BatchWriter(session, cache, batch_size=batch_size,
+                                 commit_interval=commit_interval)
+        with writer:
+            for title, profile in profiles:
+                print('Parsing:', title)
+                if profile == UNCHANGED:
+                    unchanged += 1
+                elif profile is not None:
+                    writer.add(profile)
+    else:
+        loader = ProfileLoader(session, cache=cache)
+        for title, profile in profiles:
+            print('Parsing:', title)
+            if profile == UNCHANGED:
+                unchanged += 1
+                continue
+            if profile is None:
+                continue
+            loader.load(profile)
+            session.commit()
+            if cache is not None:
+                cache.sync()
+    if cache is not None:
+        log.info('Entity cache: {}'.format(cache.stats()))
+    if incremental:
+        log.info('Skipped {} unchanged profiles.'.format(unchanged))
 
 
 def main():
     """
     Driver method.
     """
-    file_path = '../tmp/html_urls.py'
-    with open(file_path) as file:
-        content = file.read()
-        people = ast.literal_eval(content)
+    arg_parser = argparse.ArgumentParser(
+        description='Parses LinkedIn pages into the database.')
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES),
+                            default='bs4', help='HTML parser engine')
+    arg_parser.add_argument('--raw', action='store_true',
+                            help='parse raw pages, cleaning them in memory')
+    arg_parser.add_argument('--write-clean', action='store_true',
+                            help='with --raw, also save the cleaned pages')
+    arg_parser.add_argument('--workers', type=int, default=0,
+                            help='number of parsing processes')
+    arg_parser.add_argument('--batch-size', type=int, default=0,
+                            help='profiles per bulk INSERT, 0 to use the ORM')
+    arg_parser.add_argument('--commit-interval', type=int, default=10,
+                            help='batches per commit')
+    arg_parser.add_argument('--cache-size', type=int, default=100000,
+                            help='entity cache size, 0 to disable')
+    arg_parser.add_argument('--store', default=None,
+                            help='page store to read pages from')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='skip pages unchanged since last parsed')
+    arg_parser.add_argument('--bulk-load', action='store_true',
+                            help='load into a SQLite database in bulk, '
+                                 'with --batch-size profiles per '
+                                 'transaction, default {}'.format(
+                                     BULK_CHUNK_SIZE))
+    arg_parser.add_argument('--links', default=find_input('../tmp/html_urls'),
+                            help='search results of the pages to parse')
+    args = arg_parser.parse_args()
+
+    people = read_results(args.links)
 
-    session = prepare_db_session()
-    parse_all(session, people)
+    if args.bulk_load:
+        session = prepare_db_session(pragmas=BULK_PRAGMAS)
+    else:
+        session = prepare_db_session()
+    parse_all(session, people, cache_size=args.cache_size,
+              batch_size=args.batch_size,
+              commit_interval=args.commit_interval, workers=args.workers,
+              engine=args.engine, raw=args.raw,
+              write_clean=args.write_clean, store=args.store,
+              incremental=args.incremental, bulk_load=args.bulk_load)
 
 
 if __name__ == '__main__':
@@ -2,8 +2,8 @@
 
 from bs4 import BeautifulSoup
 import dateutil.parser
-from db.models import *
 import logging
+from parsing.records import *
 from urllib.parse import urlparse
 
 # Set up logging
@@ -12,25 +12,57 @@ logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+def parse_date_range(texts):
+    """
+    Parses the texts of the <time> elements in a date range.
+    :param texts: list of strings
+    :return: (date, date), date can be None
+    """
+    def parse_date(i):
+        if len(texts) <= i:
+            return None
+        t = texts[i].strip()
+        try:
+            result = dateutil.parser.parse(t)
+        except ValueError as e:
+            result = None
+            log.error('[Date range] {}'.format(e))
+        return result
+
+    start = parse_date(0)
+    end = parse_date(1)
+    return start, end
+
+
 class LinkedInParser(object):
     """
-    A LinkedIn HTML parser.
+    A LinkedIn HTML parser. It only extracts records from HTML; see
+    parsing.loader for writing them to the database.
     """
 
-    def __init__(self, session, html):
+    def __init__(self, html):
         """
-        :param session: an active SQLAlchemy session
         :param html: string
         """
-        self.session = session
         self.soup = BeautifulSoup(html, 'lxml')
 
+    def extract(self):
+        """
+        Extracts everything from HTML.
+        :return: a ProfileRecord
+        """
+        return ProfileRecord(self.extract_person_overview(),
+                             self.extract_person_experiences(),
+                             self.extract_person_educations(),
+                             self.extract_person_certifications(),
+                             self.extract_person_skills())
+
     def extract_person_overview(self):
         """
         Extracts a person's overview information from HTML.
-        :return: a Person object
+        :return: a PersonRecord
         """
-        person = Person()
+        person = PersonRecord()
         sec = self.soup.find(id='topcard')
         # Get the name
         name_tag = sec.find(id='name')
@@ -47,129 +79,98 @@ class LinkedInParser(object):
             if locality_tag is not None:
                 person.locality = locality_tag.text.strip()
         # Done.
-        self.session.add(person)
         return person
 
-    def extract_person_experiences(self, person):
+    def extract_person_experiences(self):
         """
         Extracts a person's experiences information from HTML.
-        :param person: a Person object
-        :return: None
+        :return: list of ExperienceRecord
         """
         sec = self.soup.find(id='experience')
         if sec is None:
-            return
-        items = sec.find_all('li', class_='position')
-        for li in items:
-            # Create a position object
-            exp = PersonExperience()
-            exp.person = person
+            return []
+        records = []
+        for li in sec.find_all('li', class_='position'):
+            exp = ExperienceRecord()
             # Get title
-            title = self._extract_li_subitem(li, Title, 'item-title')
-            exp.title = title
+            exp.title = self._extract_li_subitem(li, 'item-title')
             # Get company
-            company = self._extract_li_subitem(li, Company, 'item-subtitle')
-            exp.company = company
+            exp.company = self._extract_li_subitem(li, 'item-subtitle')
             # Get date range
-            start, end = self._extract_date_range(li)
-            exp.start_date = start
-            exp.end_date = end
+            exp.start_date, exp.end_date = self._extract_date_range(li)
             # Get description
             exp.description = self._extract_description(li)
             # Done.
-            self.session.add(exp)
-            self.session.flush()
+            records.append(exp)
+        return records
 
-    def extract_person_educations(self, person):
+    def extract_person_educations(self):
         """
         Extracts a person's education information from HTML.
-        :param person: a Person object
-        :return: None
+        :return: list of EducationRecord
         """
         sec = self.soup.find(id='education')
         if sec is None:
-            return
-        items = sec.find_all('li', class_='school')
-        for li in items:
-            # Create an education object
-            edu = PersonEducation()
-            edu.person = person
+            return []
+        records = []
+        for li in sec.find_all('li', class_='school'):
+            edu = EducationRecord()
             # Get school
-            school = self._extract_li_subitem(li, School, 'item-title')
-            edu.school = school
+            edu.school = self._extract_li_subitem(li, 'item-title')
             # Get degree
             degree_tag = li.find(class_='item-subtitle')
             if degree_tag is not None:
                 edu.degree = degree_tag.text.strip()
             # Get date range
-            start, end = self._extract_date_range(li)
-            edu.start_date = start
-            edu.end_date = end
+            edu.start_date, edu.end_date = self._extract_date_range(li)
             # Get description
             edu.description = self._extract_description(li)
             # Done.
-            self.session.add(edu)
-            self.session.flush()
+            records.append(edu)
+        return records
 
-    def extract_person_certifications(self, person):
+    def extract_person_certifications(self):
         """
         Extracts a person's certifications information from HTML.
-        :param person: a Person object
-        :return: None
+        :return: list of CertificationRecord
         """
         sec = self.soup.find(id='certifications')
         if sec is None:
-            return
-        items = sec.find_all('li', class_='certification')
-        for li in items:
-            # Create a person-certification object
-            pc = PersonCertification()
-            pc.person = person
+            return []
+        records = []
+        for li in sec.find_all('li', class_='certification'):
+            pc = CertificationRecord()
             # Get certification
-            cert = self._extract_li_subitem(li, Certification, 'item-title')
-            pc.certification = cert
+            pc.certification = self._extract_li_subitem(li, 'item-title')
             # Get company
-            company = self._extract_li_subitem(li, Company, 'item-subtitle')
-            pc.company = company
+            pc.company = self._extract_li_subitem(li, 'item-subtitle')
             # Get date range
-            start, end = self._extract_date_range(li)
-            pc.start_date = start
-            pc.end_date = end
+            pc.start_date, pc.end_date = self._extract_date_range(li)
             # Get description
             pc.description = self._extract_description(li)
             # Done.
-            self.session.add(pc)
-            self.session.flush()
+            records.append(pc)
+        return records
 
-    def extract_person_skills(self, person):
+    def extract_person_skills(self):
         """
         Extracts a person's skills information from HTML.
-        :param person: a Person object
-        :return: None
+        :return: list of SkillRecord
         """
         sec = self.soup.find(id='skills')
         if sec is None:
-            return
-        items = sec.find_all('li', class_='skill')
-        for li in items:
-            # Create a person-skill object
-            ps = PersonSkill()
-            ps.person = person
-            # Get skill
-            skill = self._extract_li_subitem(li, Skill, None)
-            ps.skill = skill
-            # Done.
-            self.session.add(ps)
-            self.session.flush()
+            return []
+        return [SkillRecord(self._extract_li_subitem(li, None))
+                for li in sec.find_all('li', class_='skill')]
 
-    def _extract_li_subitem(self, li, model, class_):
+    @staticmethod
+    def _extract_li_subitem(li, class_):
         # TODO: Account for class_='external-link'
         """
-        Find or create a <model> instance from given HTML element.
+        Find the name and URL of an entity from given HTML element.
         :param li: HTML element
-        :param model: Class of model (Title, Company)
         :param class_: CSS class, or None for the li element itself.
-        :return: a <model> object
+        :return: (name, url) pair, url can be None; or None
         """
         if class_ is None:
             h = li
@@ -185,10 +186,7 @@ class LinkedInParser(object):
             name = a.text.strip()
             url = a['href']
             url = urlparse(url).path
-
-        # Find or create <instance>
-        instance = model.get_or_create(self.session, name=name, url=url)
-        return instance
+        return name, url
 
     @staticmethod
     def _extract_date_range(li):
@@ -203,21 +201,7 @@ class LinkedInParser(object):
         times = s.find_all('time')
         if times is None:
             return None, None
-
-        def parse_date(i):
-            if len(times) <= i:
-                return None
-            t = times[i].text.strip()
-            try:
-                result = dateutil.parser.parse(t)
-            except ValueError as e:
-                result = None
-                log.error('[Date range] {}'.format(e))
-            return result
-
-        start = parse_date(0)
-        end = parse_date(1)
-        return start, end
+        return parse_date_range([t.text for t in times[:2]])
 
     @staticmethod
     def _extract_description(li):
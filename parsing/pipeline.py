@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Runs a CPU-bound stage in a process pool with bounded queues
+
+import logging
+import multiprocessing
+import queue
+import threading
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def process_worker(func, task_queue, result_queue):
+    """
+    Applies <func> to tasks until it receives None.
+    :param func: a function of the task arguments
+    :param task_queue: queue of (seq, args)
+    :param result_queue: queue of (seq, result, error)
+    :return: None
+    """
+    while True:
+        item = task_queue.get()
+        if item is None:
+            return
+        seq, args = item
+        try:
+            result_queue.put((seq, func(*args), None))
+        except Exception as e:
+            result_queue.put((seq, None, describe_error(e)))
+
+
+def describe_error(exc):
+    """
+    :param exc: an exception raised by a task
+    :return: a line saying what it was, to log
+    """
+    return '{}: {}'.format(type(exc).__name__, exc)
+
+
+def imap_ordered(func, tasks, workers=4, queue_size=None, max_ahead=None):
+    """
+    Computes func(*args) for every args in <tasks> in <workers> processes,
+    yielding the results in input order.
+
+    Unlike multiprocessing.Pool.imap, both the task queue and the result
+    queue are bounded, so a slow consumer stalls the workers instead of
+    buffering the whole input in memory. Results that arrive before their
+    turn are held back, but no more than <max_ahead> tasks are submitted
+    past the one whose result is awaited, so a slow task cannot make them
+    pile up. Failed tasks are logged and yield None, with or without
+    workers.
+    :param func: a module-level function
+    :param tasks: iterable of argument tuples
+    :param workers: number of processes, or 0 to run the tasks in this one
+    :param queue_size: bound of both queues, by default 4 per worker
+    :param max_ahead: most tasks submitted and not yielded yet, by default
+                      twice <queue_size>
+    :return: generator of results
+    """
+    if workers < 1:
+        for seq, args in enumerate(tasks):
+            try:
+                result = func(*args)
+            except Exception as e:
+                log.error('[Task {}] {}'.format(seq, describe_error(e)))
+                result = None
+            yield result
+        return
+    if queue_size is None:
+        queue_size = 4 * workers
+    if max_ahead is None:
+        max_ahead = 2 * queue_size
+    task_queue = multiprocessing.Queue(queue_size)
+    result_queue = multiprocessing.Queue(queue_size)
+    # A slot per task submitted and not yielded yet
+    window = threading.Semaphore(max_ahead)
+    n_tasks = []
+
+    def feed():
+        count = 0
+        for args in tasks:
+            window.acquire()
+            task_queue.put((count, args))
+            count += 1
+        n_tasks.append(count)
+        for _ in range(workers):
+            task_queue.put(None)
+
+    processes = []
+    for _ in range(workers):
+        p = multiprocessing.Process(target=process_worker,
+                                    args=(func, task_queue, result_queue))
+        p.daemon = True
+        p.start()
+        processes.append(p)
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    # Results arrive out of order; hold them back until their turn
+    buffered = {}
+    seq = 0
+    while not n_tasks or seq < n_tasks[0]:
+        if seq in buffered:
+            result = buffered.pop(seq)
+            seq += 1
+            window.release()
+            yield result
+            continue
+        try:
+            i, result, error = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                raise RuntimeError('All worker processes exited with {} '
+                                   'results pending.'.format(
+                                       len(buffered) + 1))
+            continue
+        if error is not None:
+            log.error('[Task {}] {}'.format(i, error))
+        buffered[i] = result
+
+    feeder.join()
+    for p in processes:
+        p.join()
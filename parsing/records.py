@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Plain records produced by the extraction stage
+
+# Entities (titles, companies, schools, certifications and skills) are
+# referred to by (name, url) pairs, where url can be None.
+
+
+class Record(object):
+    """
+    Base class of lightweight records. Subclasses list their fields in
+    ``__slots__``; records compare equal field for field.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for field, value in zip(self.__slots__, args):
+            setattr(self, field, value)
+        for field in self.__slots__[len(args):]:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError('Unknown fields: {}'.format(', '.join(kwargs)))
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{0}({1})".format(
+            self.__class__.__name__,
+            ', '.join(['{0}={1!r}'.format(field, getattr(self, field))
+                       for field in self.__slots__]))
+
+    def __getstate__(self):
+        return tuple(self)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+
+class PersonRecord(Record):
+    """
+    A person's overview information. The canonical profile URL and the
+    SHA-1 of the page are set when the page is read, not by the parsers.
+    """
+    __slots__ = ('name', 'headline', 'locality', 'meta', 'url',
+                 'content_hash')
+
+
+class ExperienceRecord(Record):
+    """
+    A position in a person's profile
+    """
+    __slots__ = ('title', 'company', 'start_date', 'end_date', 'description')
+
+
+class EducationRecord(Record):
+    """
+    An education entry in a person's profile
+    """
+    __slots__ = ('school', 'degree', 'start_date', 'end_date', 'description')
+
+
+class CertificationRecord(Record):
+    """
+    A professional certification entry in a person's profile
+    """
+    __slots__ = ('certification', 'company', 'start_date', 'end_date',
+                 'description')
+
+
+class SkillRecord(Record):
+    """
+    A skill entry in a person's profile
+    """
+    __slots__ = ('skill',)
+
+
+class ProfileRecord(Record):
+    """
+    Everything extracted from one profile page
+    """
+    __slots__ = ('person', 'experiences', 'educations', 'certifications',
+                 'skills')